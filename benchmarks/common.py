@@ -0,0 +1,110 @@
+"""Shared helpers for the benchmark scripts.
+
+Run them from the repository root with ``python -m benchmarks.<name>``
+against a scratch Postgres database given by ``BENCH_DSN`` (default
+``dbname=textbookai_bench``). Each benchmark drops and recreates its own
+schema, so other schemas in that database are left alone.
+"""
+
+import json
+import os
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2
+
+from db import DatabaseManager
+
+ROOT = Path(__file__).resolve().parent.parent
+
+BENCH_DSN = os.getenv("BENCH_DSN", "dbname=textbookai_bench")
+
+
+def connect(dsn: str = BENCH_DSN, schema: Optional[str] = None):
+    """Open an autocommit connection, optionally scoped to a schema."""
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    if schema:
+        with conn.cursor() as cur:
+            cur.execute(f"SET search_path TO {schema}")
+    return conn
+
+
+def reset_schema(conn, schema: str) -> None:
+    """Drop and recreate a schema and make it the connection's search path."""
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        cur.execute(f"CREATE SCHEMA {schema}")
+        cur.execute(f"SET search_path TO {schema}")
+
+
+def apply_sql_file(conn, path: Path) -> None:
+    """Run a SQL file on the connection."""
+    with conn.cursor() as cur:
+        cur.execute(path.read_text())
+
+
+def create_database(conn, schema: str, upto: Optional[str] = None) -> None:
+    """Create the base schema and apply migrations in order.
+
+    Args:
+        upto: Stop before the first migration whose file name sorts at or
+            after this prefix, e.g. ``"003"``
+    """
+    reset_schema(conn, schema)
+    apply_sql_file(conn, ROOT / "benchmarks" / "schema.sql")
+    for migration in sorted((ROOT / "migrations").glob("*.sql")):
+        if upto and migration.name >= upto:
+            break
+        apply_sql_file(conn, migration)
+
+
+def apply_migration(conn, prefix: str) -> None:
+    """Apply the single migration whose file name starts with prefix."""
+    (migration,) = (ROOT / "migrations").glob(f"{prefix}*.sql")
+    apply_sql_file(conn, migration)
+
+
+def database_manager(schema: str, dsn: str = BENCH_DSN) -> DatabaseManager:
+    """DatabaseManager whose connections use the given schema."""
+    return DatabaseManager(
+        primary_dsn=f"{dsn} options='-c search_path={schema}'", replica_dsns=[]
+    )
+
+
+def time_calls(fn: Callable[[], Any], repeat: int, warmup: int = 3) -> Dict[str, float]:
+    """Call fn repeatedly and summarise wall-clock latency in milliseconds."""
+    for _ in range(warmup):
+        fn()
+
+    samples: List[float] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(1000 * (time.perf_counter() - started))
+
+    samples.sort()
+    return {
+        "calls": repeat,
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+def table_sizes(conn, tables: List[str]) -> Dict[str, int]:
+    """Heap size in bytes of each table, excluding TOAST and indexes."""
+    sizes = {}
+    with conn.cursor() as cur:
+        for table in tables:
+            cur.execute("SELECT pg_relation_size(%s)", (table,))
+            sizes[table] = cur.fetchone()[0]
+    return sizes
+
+
+def report(result: Dict[str, Any]) -> None:
+    """Print a benchmark result as JSON on stdout."""
+    print(json.dumps(result, indent=2, default=str))
@@ -0,0 +1,141 @@
+"""Payload size and latency of API responses with and without compression.
+
+Builds a large generated-notes response and a large book structure, then for
+each reports serialization time with the stdlib encoder (JSONResponse) and
+orjson (ORJSONResponse), body size and compression time for identity, gzip
+and brotli at the middleware's default settings, and the estimated transfer
+time of each body at --mbps. Needs no database.
+
+    python -m benchmarks.compression --mbps 10
+"""
+
+import argparse
+import random
+import string
+from typing import Dict, List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from benchmarks.common import report, time_calls
+from compression import CompressionMiddleware, _Compressor, brotli
+
+
+def vocabulary(rng: random.Random, size: int = 2000) -> List[str]:
+    """Pseudo-words to draw text from."""
+    return [
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10)))
+        for _ in range(size)
+    ]
+
+
+def words(rng: random.Random, count: int) -> str:
+    """Text whose word frequencies follow Zipf's law, like natural language."""
+    return " ".join(rng.choices(VOCABULARY, weights=ZIPF_WEIGHTS, k=count))
+
+
+VOCABULARY = vocabulary(random.Random(1))
+ZIPF_WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+
+
+def notes_payload(rng: random.Random) -> Dict:
+    """A topic notes response with long markdown notes."""
+    sections = [
+        f"## {words(rng, 4)}\n\n{words(rng, 120)}\n\n"
+        f"- {words(rng, 12)}\n- {words(rng, 12)}"
+        for _ in range(30)
+    ]
+    return {
+        "notes": "\n\n".join(sections),
+        "images": [
+            {"filename": f"image_{i}_1.png", "caption": words(rng, 8)} for i in range(6)
+        ],
+        "username": "bench_user",
+        "pdf_folder": "book_18e1b007",
+    }
+
+
+def structure_payload(rng: random.Random) -> Dict:
+    """A get_pdf_structure response for a big book."""
+    return {
+        "structure": {
+            "chapters": [
+                {
+                    "id": c,
+                    "name": f"Chapter {c}: {words(rng, 4)}",
+                    "topics": [
+                        {
+                            "id": c * 100 + t,
+                            "name": f"{words(rng, 5)}",
+                            "has_notes": rng.random() < 0.5,
+                            "subtopics": [
+                                {"id": c * 10000 + t * 100 + s, "name": words(rng, 6)}
+                                for s in range(8)
+                            ],
+                        }
+                        for t in range(15)
+                    ],
+                }
+                for c in range(40)
+            ]
+        }
+    }
+
+
+def measure(payload: Dict, args) -> Dict:
+    """Serialization, compression and estimated transfer numbers for a payload."""
+    body = JSONResponse(content=payload).body
+    defaults = CompressionMiddleware(app=None)
+    result = {
+        "serialize": {
+            "json": time_calls(lambda: JSONResponse(content=payload), args.repeat),
+            "orjson": time_calls(lambda: ORJSONResponse(content=payload), args.repeat),
+        },
+        "encodings": {},
+    }
+
+    encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+    for encoding in encodings:
+        if encoding == "identity":
+            encoded = body
+            timing = None
+        else:
+
+            def compress() -> bytes:
+                compressor = _Compressor(
+                    encoding, defaults.gzip_level, defaults.brotli_quality
+                )
+                return compressor.compress(body, final=True)
+
+            encoded = compress()
+            timing = time_calls(compress, args.repeat)
+
+        result["encodings"][encoding] = {
+            "bytes": len(encoded),
+            "ratio": round(len(encoded) / len(body), 3),
+            "compress": timing,
+            "transfer_ms": round(len(encoded) * 8 / (args.mbps * 1000), 1),
+        }
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument(
+        "--mbps", type=float, default=10, help="client bandwidth for transfer estimates"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    report(
+        {
+            "params": vars(args),
+            "notes": measure(notes_payload(rng), args),
+            "structure": measure(structure_payload(rng), args),
+        }
+    )
+
+
+if __name__ == "__main__":
+    main()
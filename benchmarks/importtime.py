@@ -0,0 +1,99 @@
+"""Import-time budget for ``import main``, using ``python -X importtime``.
+
+Each sample imports main in a fresh interpreter and reads the cumulative
+time from the importtime report. The script exits non-zero when the median
+exceeds the budget or when a module that should load lazily (the Gemini SDK,
+PyMuPDF, passlib) is imported at startup, so CI can run it as a check.
+
+    python -m benchmarks.importtime --budget-ms 800
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+from benchmarks.common import ROOT, report
+
+# Modules that must only be imported on first use
+LAZY_MODULES = ["google.generativeai", "fitz", "pymupdf", "passlib"]
+
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def sample() -> Dict[str, Dict[str, int]]:
+    """Import main in a new interpreter and parse its importtime report.
+
+    Returns:
+        Dict of module name to {"self_us", "cumulative_us"}
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            modules[name] = {
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+            }
+    return modules
+
+
+def lazy_violations(modules: Dict[str, Dict[str, int]]) -> List[str]:
+    """Modules in LAZY_MODULES (or their submodules) imported at startup."""
+    return sorted(
+        name
+        for name in LAZY_MODULES
+        if any(module == name or module.startswith(name + ".") for module in modules)
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=float(os.getenv("IMPORT_BUDGET_MS", "800")),
+        help="fail when the median import of main takes longer",
+    )
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    samples = [sample() for _ in range(args.samples)]
+    median_ms = statistics.median(s["main"]["cumulative_us"] for s in samples) / 1000
+
+    # Top-level packages from the last sample, heaviest first
+    last = samples[-1]
+    slowest = sorted(
+        ((name, times["cumulative_us"] / 1000) for name, times in last.items()),
+        key=lambda item: item[1],
+        reverse=True,
+    )[: args.top]
+    violations = lazy_violations(last)
+
+    report(
+        {
+            "params": vars(args),
+            "import_main_ms": median_ms,
+            "over_budget": median_ms > args.budget_ms,
+            "eager_lazy_modules": violations,
+            "slowest_ms": dict(slowest),
+        }
+    )
+    if median_ms > args.budget_ms or violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
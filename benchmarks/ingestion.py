@@ -0,0 +1,378 @@
+"""Stage timings, throughput, peak memory and DB round trips of PDF ingestion.
+
+Generates a synthetic book with PyMuPDF (pages of text, embedded images and
+a table of contents of the given depth), then runs each stage of
+FileService.process_pdf_upload on it: the streaming save, image extraction,
+rendition resizing, the PDF record, structure extraction and
+create_pdf_structure. Gemini is replaced by a stub that answers with the
+book's table of contents as JSON after --llm-latency-ms, so the real prompt,
+parsing and validation code still runs. Finally it times the whole
+process_pdf_upload call. Database stages run against the local Postgres in
+BENCH_DSN, counting every statement, commit and rollback as a round trip.
+
+    BENCH_DSN="dbname=textbookai_bench" python -m benchmarks.ingestion \\
+        --pages 300 --images 60 --chapters 12 --toc-depth 3
+
+Peak RSS is the process high-water mark after each stage, so a stage only
+shows up there if it grows memory past every stage before it.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import string
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from functools import lru_cache
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Tuple
+
+import psycopg2.extensions
+from starlette.datastructures import Headers, UploadFile
+
+import storage
+from benchmarks.common import connect, create_database, database_manager, report
+from file_utils import save_uploaded_file
+from images import create_renditions
+from pdf import NoteGenerator
+from services import FileService
+
+SCHEMA = "bench_ingestion"
+USERNAME = "bench_user"
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """Connection counting the statements, commits and rollbacks it sends."""
+
+    round_trips = 0
+
+    def cursor(self, *args, **kwargs):
+        factory = (
+            kwargs.pop("cursor_factory", None)
+            or self.cursor_factory
+            or psycopg2.extensions.cursor
+        )
+        return super().cursor(*args, cursor_factory=counting_cursor(factory), **kwargs)
+
+    def commit(self) -> None:
+        CountingConnection.round_trips += 1
+        super().commit()
+
+    def rollback(self) -> None:
+        CountingConnection.round_trips += 1
+        super().rollback()
+
+
+@lru_cache(maxsize=None)
+def counting_cursor(factory: type) -> type:
+    """Subclass of a cursor class that counts executes as round trips."""
+
+    def execute(self, query, vars=None):
+        CountingConnection.round_trips += 1
+        return factory.execute(self, query, vars)
+
+    def executemany(self, query, vars_list):
+        # psycopg2 sends one statement per parameter set
+        vars_list = list(vars_list)
+        CountingConnection.round_trips += len(vars_list)
+        return factory.executemany(self, query, vars_list)
+
+    return type(
+        f"Counting{factory.__name__}",
+        (factory,),
+        {"execute": execute, "executemany": executemany},
+    )
+
+
+class StubModel:
+    """Stands in for a Gemini model, answering every prompt with the same reply."""
+
+    def __init__(self, reply: str, latency: float):
+        self.model_name = "models/stub"
+        self.reply = reply
+        self.latency = latency
+
+    def generate_content(self, contents: List[Any], **kwargs) -> SimpleNamespace:
+        time.sleep(self.latency)
+        return SimpleNamespace(text=self.reply, usage_metadata=None)
+
+
+def stub_genai(reply: str, latency: float) -> SimpleNamespace:
+    """The parts of the Gemini SDK that ingestion uses, without the network."""
+
+    def upload_file(path, mime_type=None):
+        time.sleep(latency)
+        return SimpleNamespace(
+            name=f"files/{Path(path).stem}", display_name=Path(path).name
+        )
+
+    return SimpleNamespace(
+        GenerativeModel=lambda **kwargs: StubModel(reply, latency),
+        GenerationConfig=dict,
+        upload_file=upload_file,
+    )
+
+
+def words(rng: random.Random, count: int) -> str:
+    """Filler text."""
+    return " ".join(
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10)))
+        for _ in range(count)
+    )
+
+
+def outline(rng: random.Random, args) -> List[Dict]:
+    """Chapters with topics and (nested) subtopics down to --toc-depth levels."""
+
+    def level(depth: int, prefix: str) -> List[Dict]:
+        count = args.chapters if depth == 1 else args.fanout
+        nodes = []
+        for index in range(1, count + 1):
+            number = f"{prefix}{index}"
+            node = {"name": f"{number} {words(rng, 3).title()}"}
+            if depth < args.toc_depth:
+                key = "topics" if depth == 1 else "subtopics"
+                node[key] = level(depth + 1, f"{number}.")
+            nodes.append(node)
+        return nodes
+
+    return level(1, "")
+
+
+def flatten(nodes: List[Dict], depth: int = 1) -> Iterator[Tuple[int, str]]:
+    """(level, title) of every outline node, in reading order."""
+    for node in nodes:
+        yield depth, node["name"]
+        yield from flatten(node.get("topics") or node.get("subtopics") or [], depth + 1)
+
+
+def build_pdf(args) -> Tuple[bytes, Dict]:
+    """A synthetic book and the structure an LLM would extract from it.
+
+    Images are random noise, so they compress about as badly as photos.
+    """
+    import fitz  # PyMuPDF
+
+    rng = random.Random(args.seed)
+    chapters = outline(rng, args)
+    entries = list(flatten(chapters))
+
+    doc = fitz.open()
+    for page_number in range(args.pages):
+        page = doc.new_page()
+        page.insert_textbox(
+            fitz.Rect(72, 72, page.rect.width - 72, page.rect.height - 72),
+            words(rng, 350),
+            fontsize=9,
+        )
+
+    side = args.image_size
+    for index in range(args.images):
+        page = doc[index * args.pages // args.images]
+        pixmap = fitz.Pixmap(fitz.csRGB, side, side, rng.randbytes(side * side * 3), 0)
+        top = 72 + (index % 3) * 200
+        page.insert_image(fitz.Rect(72, top, 272, top + 200), pixmap=pixmap)
+
+    # Spread the table of contents evenly over the pages
+    doc.set_toc(
+        [
+            [level, title, 1 + position * args.pages // len(entries)]
+            for position, (level, title) in enumerate(entries)
+        ]
+    )
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data, {"chapters": chapters}
+
+
+def upload(data: bytes, filename: str) -> UploadFile:
+    """An in-memory upload like the one FastAPI hands to the upload route."""
+    return UploadFile(
+        file=io.BytesIO(data),
+        size=len(data),
+        filename=filename,
+        headers=Headers({"content-type": "application/pdf"}),
+    )
+
+
+def peak_rss_mib() -> float:
+    """High-water mark of this process's resident memory."""
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextmanager
+def stage(samples: Dict[str, List[Dict]], name: str) -> Iterator[None]:
+    """Record the duration, round trips and peak RSS of one stage run."""
+    trips = CountingConnection.round_trips
+    started = time.perf_counter()
+    yield
+    samples.setdefault(name, []).append(
+        {
+            "seconds": time.perf_counter() - started,
+            "round_trips": CountingConnection.round_trips - trips,
+            "peak_rss_mib": peak_rss_mib(),
+        }
+    )
+
+
+def summarize(runs: List[Dict], work: Dict[str, float]) -> Dict:
+    """Latency percentiles, throughput, round trips and peak RSS of a stage."""
+    seconds = sorted(run["seconds"] for run in runs)
+    mean = statistics.fmean(seconds)
+    return {
+        "runs": len(runs),
+        "mean_ms": round(mean * 1000, 3),
+        "p50_ms": round(seconds[len(seconds) // 2] * 1000, 3),
+        "max_ms": round(seconds[-1] * 1000, 3),
+        "throughput": {
+            f"{unit}_per_second": round(amount / mean, 1) if mean else None
+            for unit, amount in work.items()
+        },
+        "round_trips": max(run["round_trips"] for run in runs),
+        "peak_rss_mib": round(max(run["peak_rss_mib"] for run in runs), 1),
+    }
+
+
+async def run_stages(db, generator: NoteGenerator, data: bytes, args) -> Dict:
+    """Run each ingestion stage on its own, --repeat times."""
+    samples: Dict[str, List[Dict]] = {}
+    counts = {}
+    for run in range(args.repeat):
+        filename = f"stages_{run}.pdf"
+        images_dir = Path("uploads") / USERNAME / "images" / f"stages_{run}_18e1b007"
+        images_dir.mkdir(parents=True, exist_ok=True)
+
+        with stage(samples, "save"):
+            pdf_path = await save_uploaded_file(
+                upload(data, filename), USERNAME, filename
+            )
+        with stage(samples, "extract_images"):
+            image_files = generator.extract_images_from_pdf(pdf_path, images_dir)
+        with stage(samples, "renditions"):
+            create_renditions(images_dir)
+        with stage(samples, "db_record"):
+            pdf_id = db.create_pdf_record(str(pdf_path), USERNAME, filename)
+            db.record_pdf_usage(pdf_id, len(data), *storage.usage(images_dir))
+        gemini_file = generator.upload_to_gemini(pdf_path)
+        with stage(samples, "extract_structure"):
+            structure = generator.extract_pdf_structure(gemini_file)
+        with stage(samples, "db_structure"):
+            db.create_pdf_structure(pdf_id, structure)
+
+        counts = {
+            "images": len(image_files),
+            "image_bytes": storage.usage(images_dir)[0],
+            "nodes": sum(1 for _ in flatten(structure["chapters"])),
+        }
+
+    megabytes = len(data) / 1024**2
+    work = {
+        "save": {"mb": megabytes},
+        "extract_images": {
+            "pages": args.pages,
+            "images": counts["images"],
+            "mb": counts["image_bytes"] / 1024**2,
+        },
+        "renditions": {"images": counts["images"]},
+        "db_record": {},
+        "extract_structure": {"nodes": counts["nodes"]},
+        "db_structure": {"nodes": counts["nodes"]},
+    }
+    return {
+        "counts": counts,
+        "stages": {name: summarize(runs, work[name]) for name, runs in samples.items()},
+    }
+
+
+async def run_end_to_end(db, generator: NoteGenerator, data: bytes, args) -> Dict:
+    """Time whole process_pdf_upload calls, as the upload route makes them."""
+    # Renditions are scheduled in the background; a single worker lets each
+    # run wait for its own before the next one starts
+    executor = ThreadPoolExecutor(max_workers=1)
+    service = FileService(db, generator, executor)
+    samples: Dict[str, List[Dict]] = {}
+    try:
+        for run in range(args.repeat):
+            with stage(samples, "process_pdf_upload"):
+                result, status = await service.process_pdf_upload(
+                    upload(data, f"upload_{run}.pdf"), USERNAME
+                )
+            if status != 200:
+                raise RuntimeError(f"process_pdf_upload failed: {result}")
+            with stage(samples, "background_renditions"):
+                executor.submit(lambda: None).result()
+    finally:
+        executor.shutdown()
+    return {
+        name: summarize(runs, {"pages": args.pages, "mb": len(data) / 1024**2})
+        for name, runs in samples.items()
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--image-size", type=int, default=400, help="pixels per side")
+    parser.add_argument("--chapters", type=int, default=10)
+    parser.add_argument("--toc-depth", type=int, default=3, help="1 = chapters only")
+    parser.add_argument("--fanout", type=int, default=4, help="children per TOC entry")
+    parser.add_argument("--llm-latency-ms", type=float, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    conn = connect()
+    create_database(conn, SCHEMA)
+
+    data, structure = build_pdf(args)
+    reply = (
+        f"```json\n{json.dumps(structure, indent=2)}\n```\nFollows the book's contents."
+    )
+    generator = NoteGenerator()
+    generator.genai = stub_genai(reply, args.llm_latency_ms / 1000)
+
+    # Uploads are written relative to the working directory
+    workdir = Path(tempfile.mkdtemp(prefix="bench_ingestion_"))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    # Repeated uploads of a large book would run into the storage quota
+    storage.STORAGE_QUOTA_BYTES = storage.STORAGE_QUOTA_FILES = 0
+
+    db = database_manager(SCHEMA)
+    db.primary.connect_kwargs["connection_factory"] = CountingConnection
+    db.primary.create_pool()
+    try:
+        # NoteGenerator prints model responses; keep stdout for the report
+        with redirect_stdout(sys.stderr):
+            db.create_user(USERNAME, "x", f"{USERNAME}@example.com")
+            stages = asyncio.run(run_stages(db, generator, data, args))
+            end_to_end = asyncio.run(run_end_to_end(db, generator, data, args))
+    finally:
+        db.close()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report(
+        {
+            "params": vars(args),
+            "pdf_bytes": len(data),
+            **stages,
+            "end_to_end": end_to_end,
+        }
+    )
+
+
+if __name__ == "__main__":
+    main()
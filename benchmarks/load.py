@@ -0,0 +1,469 @@
+"""Load test: classroom traffic against one app instance.
+
+Seeds a class of students, each with a book (structure from the fake LLM
+backend), in a scratch schema. Then virtual students log in and repeat a
+study journey: the home page and PDF list, the book page, topic and subtopic
+pages with their notes, a chapter quiz and its answers. Between steps they
+pause for an exponentially distributed --think-ms. Notes and quizzes that do
+not exist yet are generated by the fake backend after --llm-latency-ms.
+
+Two modes:
+
+- ``ramp`` adds students in --steps equal steps up to --users, holding each
+  level for --seconds / --steps, to find the concurrency where latency or
+  errors take off
+- ``soak`` holds --users for --seconds and reports every --window-seconds,
+  to surface slow leaks such as connections not returned to the pool
+
+Two transports:
+
+- ``asgi`` calls the app in this process through httpx's ASGI transport,
+  measuring event-loop lag with a ticker on the app's own loop
+- ``socket`` starts ``uvicorn main:app`` (one worker) and goes over HTTP.
+  Event-loop lag is approximated by the latency of /health/live polled on
+  its own connection
+
+Every phase reports p50/p95/p99 per route, error rates, requests per second,
+event-loop lag and the connection pool counters from /admin/db/pools. The
+server's own lag and the calls that blocked its loop for longer than
+--block-threshold-ms come from /admin/event-loop, and the statements with
+the most database time so far from /admin/db/queries.
+
+    BENCH_DSN="dbname=textbookai_bench" python -m benchmarks.load \\
+        --mode ramp --transport asgi --users 200 --steps 5 --seconds 150
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+from benchmarks.common import (
+    ROOT,
+    connect,
+    create_database,
+    database_manager,
+    report,
+)
+from benchmarks.scaling import app_env, wait_until_ready
+from passwords import BCRYPT_ROUNDS, hash_password
+from pdf import FakeNoteGenerator
+
+SCHEMA = "bench_load"
+PASSWORD = "bench-password"
+ADMIN = "bench_admin"
+
+
+def seed(schema: str, students: int) -> Tuple[List[Dict], Dict]:
+    """Create the students, each with one book, and an administrator.
+
+    Passwords are hashed at BCRYPT_ROUNDS, so logins cost what they do in
+    production and are not rehashed.
+
+    Returns:
+        (students as username and pdf_id, the book structure)
+    """
+    db = database_manager(schema)
+    structure = FakeNoteGenerator().extract_pdf_structure(None)
+    hashed = hash_password(PASSWORD, BCRYPT_ROUNDS)
+    accounts = []
+    try:
+        db.create_user(ADMIN, hashed, f"{ADMIN}@example.com")
+        for index in range(students):
+            username = f"student_{index}"
+            db.create_user(username, hashed, f"{username}@example.com")
+            pdf_id = db.create_pdf_record(
+                f"uploads/{username}/textbook.pdf",
+                username,
+                "textbook.pdf",
+                status="completed",
+            )
+            db.create_pdf_structure(pdf_id, structure)
+            accounts.append({"username": username, "pdf_id": pdf_id})
+    finally:
+        db.close()
+    return accounts, structure
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max in milliseconds."""
+    if not seconds:
+        return {}
+    ordered = sorted(seconds)
+    return {
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+class Recorder:
+    """Collects request samples and loop-lag samples, labelled by phase."""
+
+    def __init__(self):
+        self.phase = ""
+        self.requests: List[Tuple[str, str, int, float, float]] = []
+        self.lag: List[Tuple[str, float, float]] = []
+
+    def request(self, route: str, status: int, seconds: float) -> None:
+        self.requests.append((self.phase, route, status, seconds, time.monotonic()))
+
+    def loop_lag(self, seconds: float) -> None:
+        self.lag.append((self.phase, seconds, time.monotonic()))
+
+    def summary(self, phase: str, since: float, until: float) -> Dict[str, Any]:
+        """Per-route latencies and errors, and loop lag, within a phase and time span."""
+        samples = [
+            sample
+            for sample in self.requests
+            if sample[0] == phase and since <= sample[4] < until
+        ]
+        routes: Dict[str, List[Tuple[int, float]]] = {}
+        for _, route, status, seconds, _ in samples:
+            routes.setdefault(route, []).append((status, seconds))
+
+        def failed(status: int) -> bool:
+            return status == 0 or status >= 400
+
+        errors = sum(1 for sample in samples if failed(sample[2]))
+        return {
+            "requests": len(samples),
+            "requests_per_second": round(len(samples) / (until - since), 1),
+            "error_rate": round(errors / len(samples), 4) if samples else None,
+            "latency": latency_summary([sample[3] for sample in samples]),
+            "loop_lag": latency_summary(
+                [
+                    seconds
+                    for lag_phase, seconds, at in self.lag
+                    if lag_phase == phase and since <= at < until
+                ]
+            ),
+            "routes": {
+                route: {
+                    "requests": len(results),
+                    "errors": sum(1 for status, _ in results if failed(status)),
+                    "statuses": sorted({status for status, _ in results}),
+                    **latency_summary([seconds for _, seconds in results]),
+                }
+                for route, results in sorted(routes.items())
+            },
+        }
+
+
+async def call(
+    client: httpx.AsyncClient,
+    recorder: Recorder,
+    route: str,
+    method: str,
+    url: str,
+    **kwargs,
+) -> Optional[httpx.Response]:
+    """Make one request and record it under its route template."""
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except httpx.HTTPError:
+        recorder.request(route, 0, time.perf_counter() - started)
+        return None
+    recorder.request(route, response.status_code, time.perf_counter() - started)
+    return response
+
+
+async def log_in(client: httpx.AsyncClient, recorder: Recorder, username: str) -> bool:
+    """Log in, keeping the session cookie on the client."""
+    response = await call(
+        client,
+        recorder,
+        "POST /login",
+        "POST",
+        "/login",
+        data={"login": username, "password": PASSWORD, "login_method": "username"},
+    )
+    return response is not None and response.status_code == 200
+
+
+async def journey(
+    client: httpx.AsyncClient,
+    recorder: Recorder,
+    account: Dict,
+    structure: Dict,
+    rng: random.Random,
+    think: float,
+) -> None:
+    """One pass through a study session, pausing between steps."""
+
+    async def pause() -> None:
+        if think:
+            await asyncio.sleep(rng.expovariate(1 / think))
+
+    chapter = rng.choice(structure["chapters"])
+    topic = rng.choice(chapter["topics"])
+    subtopic = rng.choice(topic["subtopics"])
+    c, t, s = (quote(item["name"]) for item in (chapter, topic, subtopic))
+    pdf_id = account["pdf_id"]
+
+    steps = [
+        [("GET /", "/"), ("GET /api/user_pdfs", "/api/user_pdfs")],
+        [
+            ("GET /book/{pdf_id}", f"/book/{pdf_id}"),
+            ("GET /api/book/{pdf_id}", f"/api/book/{pdf_id}"),
+        ],
+        [
+            ("GET /topic/{chapter}/{topic}", f"/topic/{c}/{t}"),
+            ("GET /api/topic_notes/{chapter}/{topic}", f"/api/topic_notes/{c}/{t}"),
+        ],
+        [
+            ("GET /subtopic/{chapter}/{topic}/{subtopic}", f"/subtopic/{c}/{t}/{s}"),
+            (
+                "GET /api/notes/{chapter}/{topic}/{subtopic}",
+                f"/api/notes/{c}/{t}/{s}",
+            ),
+        ],
+    ]
+    for requests in steps:
+        for route, url in requests:
+            await call(client, recorder, route, "GET", url)
+        await pause()
+
+    await call(client, recorder, "GET /quiz/{chapter}", "GET", f"/quiz/{c}")
+    quiz = await call(
+        client, recorder, "GET /api/quiz/{chapter}", "GET", f"/api/quiz/{c}"
+    )
+    await pause()
+    if quiz is not None and quiz.status_code == 200:
+        quiz_id = quiz.json()["quiz_id"]
+        await call(
+            client,
+            recorder,
+            "GET /api/quiz/{quiz_id}/answers",
+            "GET",
+            f"/api/quiz/{quiz_id}/answers",
+        )
+    await pause()
+
+
+async def student(
+    make_client,
+    recorder: Recorder,
+    account: Dict,
+    structure: Dict,
+    think: float,
+    stop: asyncio.Event,
+) -> None:
+    """A virtual student: log in once, then study until told to stop."""
+    rng = random.Random(account["username"])
+    async with make_client() as client:
+        logged_in = False
+        while not stop.is_set():
+            if not logged_in:
+                logged_in = await log_in(client, recorder, account["username"])
+                if not logged_in:
+                    await asyncio.sleep(think or 1)
+                    continue
+            await journey(client, recorder, account, structure, rng, think)
+
+
+async def loop_ticker(recorder: Recorder, stop: asyncio.Event, interval=0.05) -> None:
+    """Measure how late the event loop runs a timer."""
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        recorder.loop_lag(max(0.0, time.perf_counter() - expected))
+
+
+async def liveness_prober(
+    make_client, recorder: Recorder, stop: asyncio.Event, interval=0.1
+) -> None:
+    """Approximate a remote server's loop lag by its liveness probe latency."""
+    async with make_client() as client:
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                await client.get("/health/live")
+                recorder.loop_lag(time.perf_counter() - started)
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(interval)
+
+
+async def server_diagnostics(make_client) -> Dict[str, Any]:
+    """The app's pool, event loop and query reports, read as the administrator."""
+    async with make_client() as client:
+        response = await client.post(
+            "/login",
+            data={"login": ADMIN, "password": PASSWORD, "login_method": "username"},
+        )
+        if response.status_code != 200:
+            return {}
+        return {
+            "pools": (await client.get("/admin/db/pools")).json(),
+            "event_loop": (await client.get("/admin/event-loop")).json(),
+            "queries": (
+                await client.get("/admin/db/queries", params={"limit": 10})
+            ).json(),
+        }
+
+
+def phases(args) -> List[Tuple[str, int, float]]:
+    """(name, students, seconds) of each phase of the run."""
+    if args.mode == "soak":
+        return [("soak", args.users, args.seconds)]
+    return [
+        (f"{users}_users", users, args.seconds / args.steps)
+        for users in (
+            max(1, round(args.users * step / args.steps))
+            for step in range(1, args.steps + 1)
+        )
+    ]
+
+
+async def drive(make_client, accounts, structure, args, in_process: bool) -> Dict:
+    """Run the phases, adding students as each one starts."""
+    recorder = Recorder()
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(
+        loop_ticker(recorder, stop)
+        if in_process
+        else liveness_prober(make_client, recorder, stop)
+    )
+    tasks: List[asyncio.Task] = []
+    results = {}
+    think = args.think_ms / 1000
+
+    for name, users, seconds in phases(args):
+        recorder.phase = name
+        started = time.monotonic()
+        while len(tasks) < users:
+            account = accounts[len(tasks)]
+            tasks.append(
+                asyncio.create_task(
+                    student(make_client, recorder, account, structure, think, stop)
+                )
+            )
+        await asyncio.sleep(seconds)
+
+        result = recorder.summary(name, started, started + seconds)
+        result["students"] = users
+        if args.mode == "soak":
+            result["windows"] = [
+                {
+                    "start_seconds": offset,
+                    **recorder.summary(
+                        name,
+                        started + offset,
+                        min(started + offset + args.window_seconds, started + seconds),
+                    ),
+                }
+                for offset in range(0, int(seconds), args.window_seconds)
+            ]
+            for window in result["windows"]:
+                window.pop("routes")
+        result.update(await server_diagnostics(make_client))
+        results[name] = result
+
+    stop.set()
+    await asyncio.gather(*tasks, monitor, return_exceptions=True)
+    return results
+
+
+async def run_in_process(accounts, structure, args) -> Dict:
+    """Drive the app through its ASGI interface, in this process."""
+    import main  # after the environment points it at the benchmark schema
+
+    def make_client() -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=main.app),
+            base_url="http://testserver",
+            timeout=args.timeout,
+        )
+
+    async with main.app.router.lifespan_context(main.app):
+        return await drive(make_client, accounts, structure, args, in_process=True)
+
+
+async def run_over_socket(accounts, structure, args, env: Dict[str, str]) -> Dict:
+    """Drive a uvicorn process over HTTP."""
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(args.port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+
+    def make_client() -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout
+        )
+
+    try:
+        await asyncio.to_thread(wait_until_ready, args.port)
+        return await drive(make_client, accounts, structure, args, in_process=False)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["ramp", "soak"], default="ramp")
+    parser.add_argument("--transport", choices=["asgi", "socket"], default="asgi")
+    parser.add_argument("--users", type=int, default=100, help="peak students")
+    parser.add_argument("--steps", type=int, default=5, help="ramp levels")
+    parser.add_argument("--seconds", type=float, default=100, help="whole run")
+    parser.add_argument("--window-seconds", type=int, default=30, help="soak windows")
+    parser.add_argument("--think-ms", type=float, default=2000)
+    parser.add_argument("--llm-latency-ms", type=float, default=2000)
+    parser.add_argument("--block-threshold-ms", type=float, default=100)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    conn = connect()
+    create_database(conn, SCHEMA)
+    accounts, structure = seed(SCHEMA, args.users)
+
+    env = app_env(SCHEMA, 1, args.port)
+    env.update(
+        {
+            "FAKE_LLM_LATENCY_MS": str(int(args.llm_latency_ms)),
+            "ADMIN_USERS": ADMIN,
+            "LOOP_BLOCK_THRESHOLD_MS": str(args.block_threshold_ms),
+            # A whole class logs in from one address
+            "LOGIN_IP_ATTEMPTS_PER_MINUTE": str(60 * args.users * 10),
+            "LOGIN_IP_BURST": str(args.users * 10),
+        }
+    )
+
+    if args.transport == "asgi":
+        os.environ.update(env)
+        os.chdir(ROOT)
+        results = asyncio.run(run_in_process(accounts, structure, args))
+    else:
+        results = asyncio.run(run_over_socket(accounts, structure, args, env))
+
+    report({"params": vars(args), "cpu_count": os.cpu_count(), "phases": results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Password verification throughput and event-loop stalls during a login burst.
+
+Runs a burst of bcrypt verifications the old way (synchronously on the event
+loop) and through PasswordHasher with 1..N executor threads. For each, it
+reports logins per second, logins per second per core used, and the longest
+time a concurrent 10 ms ticker on the loop was held up. Needs no database.
+
+    python -m benchmarks.logins --rounds 12 --logins 64
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict
+
+from benchmarks.common import report
+from passwords import BCRYPT_ROUNDS, PasswordHasher, hash_password, verify_password
+
+PASSWORD = "correct horse battery staple"
+
+
+async def burst(login: Callable[[], Awaitable[bool]], logins: int) -> Dict[str, float]:
+    """Run logins concurrently while a ticker measures event-loop lag."""
+    lag = 0.0
+    done = asyncio.Event()
+
+    async def ticker() -> None:
+        nonlocal lag
+        while not done.is_set():
+            expected = time.perf_counter() + 0.01
+            await asyncio.sleep(0.01)
+            lag = max(lag, time.perf_counter() - expected)
+
+    ticking = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await ticking
+
+    assert all(results)
+    return {"logins_per_second": logins / elapsed, "max_loop_lag_ms": lag * 1000}
+
+
+async def run(args) -> Dict:
+    hashed = hash_password(PASSWORD, args.rounds)
+
+    async def on_loop() -> bool:
+        # What login_user used to do
+        return verify_password(PASSWORD, hashed)
+
+    results = {"on_loop": await burst(on_loop, args.logins)}
+    for workers in args.workers:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            hasher = PasswordHasher(executor, rounds=args.rounds)
+            result = await burst(lambda: hasher.verify(PASSWORD, hashed), args.logins)
+        cores = min(workers, os.cpu_count() or 1)
+        result["logins_per_second_per_core"] = result["logins_per_second"] / cores
+        results[f"executor_{workers}"] = result
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=BCRYPT_ROUNDS)
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=sorted({1, os.cpu_count() or 1}),
+    )
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report({"params": vars(args), "cpu_count": os.cpu_count(), "results": results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Before/after benchmark for moving note bodies out of hot rows.
+
+Seeds a library with generated notes stored inline (the layout before
+migrations/003_note_content_tables.sql), times get_pdf_structure and
+get_user_pdfs, applies the migration, vacuums, and times them again.
+
+    BENCH_DSN="dbname=textbookai_bench" python -m benchmarks.note_storage --pdfs 20
+"""
+
+import argparse
+import json
+import random
+import string
+
+from benchmarks.common import (
+    apply_migration,
+    connect,
+    create_database,
+    database_manager,
+    report,
+    table_sizes,
+    time_calls,
+)
+
+SCHEMA = "bench_note_storage"
+USERNAME = "bench_user"
+
+
+def words(rng: random.Random, size: int) -> str:
+    """Markdown-ish filler text of roughly size characters."""
+    out = []
+    length = 0
+    while length < size:
+        word = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10)))
+        out.append(word)
+        length += len(word) + 1
+    return " ".join(out)[:size]
+
+
+def seed(conn, args, rng: random.Random) -> None:
+    """Create one user's library with notes generated for every node."""
+    gemini_file = {
+        "name": "files/bench",
+        "uri": "https://generativelanguage.googleapis.com/v1beta/files/bench",
+        "padding": words(rng, 1500),
+    }
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO users (username, password_hash) VALUES (%s, 'x')",
+            (USERNAME,),
+        )
+        for pdf_index in range(args.pdfs):
+            cur.execute(
+                """
+                INSERT INTO pdfs (pdf_path, username, title, status, gemini_file)
+                VALUES (%s, %s, %s, 'completed', %s::jsonb)
+                RETURNING pdfid
+                """,
+                (
+                    f"uploads/{USERNAME}/book_{pdf_index}.pdf",
+                    USERNAME,
+                    f"book_{pdf_index}.pdf",
+                    json.dumps(gemini_file),
+                ),
+            )
+            pdf_id = cur.fetchone()[0]
+            for chapter_index in range(args.chapters):
+                cur.execute(
+                    "INSERT INTO chapters (pdfid, chaptername) VALUES (%s, %s) RETURNING chapterid",
+                    (pdf_id, f"Chapter {pdf_index}.{chapter_index}"),
+                )
+                chapter_id = cur.fetchone()[0]
+                for topic_index in range(args.topics):
+                    cur.execute(
+                        """
+                        INSERT INTO topics (chapterid, topicname, notes, images)
+                        VALUES (%s, %s, %s, %s::jsonb)
+                        RETURNING topicid
+                        """,
+                        (
+                            chapter_id,
+                            f"Topic {topic_index}",
+                            words(rng, args.note_bytes),
+                            json.dumps(
+                                [{"filename": "image_1_1.png", "caption": "figure"}]
+                            ),
+                        ),
+                    )
+                    topic_id = cur.fetchone()[0]
+                    for subtopic_index in range(args.subtopics):
+                        cur.execute(
+                            """
+                            INSERT INTO subtopics (topicid, subtopicname, notes, images)
+                            VALUES (%s, %s, %s, '[]'::jsonb)
+                            """,
+                            (
+                                topic_id,
+                                f"Subtopic {subtopic_index}",
+                                words(rng, args.note_bytes),
+                            ),
+                        )
+        cur.execute("ANALYZE")
+
+
+def measure(db, conn, pdf_id: int, repeat: int) -> dict:
+    """Time the structure and listing queries and record heap sizes."""
+    return {
+        "get_pdf_structure": time_calls(lambda: db.get_pdf_structure(pdf_id), repeat),
+        "get_user_pdfs": time_calls(lambda: db.get_user_pdfs(USERNAME), repeat),
+        "heap_bytes": table_sizes(conn, ["pdfs", "topics", "subtopics"]),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdfs", type=int, default=20)
+    parser.add_argument("--chapters", type=int, default=10)
+    parser.add_argument("--topics", type=int, default=8)
+    parser.add_argument("--subtopics", type=int, default=6)
+    parser.add_argument(
+        "--note-bytes",
+        type=int,
+        default=1800,
+        help="size of each generated note; below ~2 kB Postgres keeps it in the row",
+    )
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    conn = connect()
+    create_database(conn, SCHEMA, upto="003")
+    seed(conn, args, random.Random(args.seed))
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT MIN(pdfid) FROM pdfs")
+        pdf_id = cur.fetchone()[0]
+
+    db = database_manager(SCHEMA)
+    before = measure(db, conn, pdf_id, args.repeat)
+
+    apply_migration(conn, "003")
+    with conn.cursor() as cur:
+        cur.execute("VACUUM (FULL, ANALYZE) topics, subtopics, pdfs")
+    after = measure(db, conn, pdf_id, args.repeat)
+
+    report({"params": vars(args), "before": before, "after": after})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Replay benchmark: parse, validate and store recorded Gemini responses.
+
+Reads a corpus written with LLM_BACKEND=record (see llm_replay.py) and runs
+each response through the parsing and validation NoteGenerator applies to
+that operation, reporting per-operation parse times, output sizes and
+failures. A structure NoteGenerator would send back to Gemini to be fixed
+counts as a failure. No network access or API key is needed, and the
+results are deterministic for a given corpus.
+
+With --db, parsed structures are also written with create_pdf_structure
+and quizzes with store_quiz_questions, in a scratch schema, and timed.
+With --strict the exit status is non-zero if any response fails to parse,
+so a corpus doubles as a regression check for parser changes.
+
+    LLM_BACKEND=record uvicorn main:app   # use the app, then stop it
+    python -m benchmarks.replay llm_corpus.jsonl --db
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.common import connect, create_database, database_manager, report
+from llm_replay import read_corpus
+from pdf import LLM_CORPUS, NoteGenerator
+
+SCHEMA = "bench_replay"
+
+
+class OfflineNoteGenerator(NoteGenerator):
+    """Parses like NoteGenerator, but never asks Gemini to fix a structure."""
+
+    def fix_structure(self, structure: Dict) -> Dict:
+        raise ValueError("Structure needs fixing by the model")
+
+
+def parsers(generator: NoteGenerator) -> Dict[str, Callable[[str], Any]]:
+    """How NoteGenerator turns each operation's response text into data."""
+
+    def structure(text: str) -> Dict:
+        return generator._validate_structure(generator._parse_json_response(text))
+
+    def quiz(text: str) -> List[Dict]:
+        questions = generator._parse_json_response(text)
+        if not isinstance(questions, list):
+            raise ValueError("Invalid quiz format: expected list of questions")
+        return questions
+
+    return {
+        "structure": structure,
+        "fix_structure": structure,
+        "topic_notes": generator._parse_json_response,
+        "subtopic_notes": lambda text: json.loads(generator._clean_json_response(text)),
+        "quiz": quiz,
+    }
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Mean, p50, p95 and max of millisecond samples."""
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    return {
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+def parse_all(
+    entries: List[Dict], repeat: int
+) -> Tuple[Dict[str, Any], Dict[str, List[Any]]]:
+    """Parse every entry `repeat` times, grouped by operation.
+
+    Returns:
+        (per-operation results, parsed values per operation)
+    """
+    parse = parsers(OfflineNoteGenerator())
+    samples: Dict[str, List[float]] = defaultdict(list)
+    results: Dict[str, Dict[str, Any]] = {}
+    parsed: Dict[str, List[Any]] = defaultdict(list)
+
+    for entry in entries:
+        operation = entry["operation"]
+        result = results.setdefault(
+            operation,
+            {
+                "responses": 0,
+                "failures": 0,
+                "errors": [],
+                "output_chars": 0,
+                "recorded_latency": [],
+            },
+        )
+        result["responses"] += 1
+        result["output_chars"] += len(entry["output"])
+        result["recorded_latency"].append(entry["latency_ms"])
+        if operation not in parse:
+            continue
+        try:
+            value = parse[operation](entry["output"])
+        except Exception as e:
+            result["failures"] += 1
+            result["errors"].append({"key": entry["key"][:16], "error": str(e)})
+            continue
+        parsed[operation].append(value)
+        for _ in range(repeat):
+            started = time.perf_counter()
+            parse[operation](entry["output"])
+            samples[operation].append(1000 * (time.perf_counter() - started))
+
+    for operation, result in results.items():
+        result["recorded_latency"] = summarize(result.pop("recorded_latency"))
+        result["parse"] = summarize(samples[operation])
+        if operation not in parse:
+            result["parse"] = "no parser for this operation"
+    return results, parsed
+
+
+def store_all(parsed: Dict[str, List[Any]]) -> Dict[str, Any]:
+    """Write the parsed structures and quizzes and time each write."""
+    conn = connect()
+    create_database(conn, SCHEMA)
+    db = database_manager(SCHEMA)
+    writes: Dict[str, List[float]] = defaultdict(list)
+    try:
+        db.create_user("bench_replay", "x", "bench_replay@example.com")
+        for index, structure in enumerate(
+            parsed.get("structure", []) + parsed.get("fix_structure", [])
+        ):
+            pdf_id = db.create_pdf_record(
+                f"uploads/bench_replay/book_{index}.pdf",
+                "bench_replay",
+                f"book_{index}.pdf",
+            )
+            started = time.perf_counter()
+            db.create_pdf_structure(pdf_id, structure)
+            writes["create_pdf_structure"].append(
+                1000 * (time.perf_counter() - started)
+            )
+        for index, questions in enumerate(parsed.get("quiz", [])):
+            started = time.perf_counter()
+            db.store_quiz_questions(f"Chapter {index}", questions)
+            writes["store_quiz_questions"].append(
+                1000 * (time.perf_counter() - started)
+            )
+    finally:
+        db.close()
+        conn.close()
+    return {
+        method: {"calls": len(samples), **summarize(samples)}
+        for method, samples in writes.items()
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("corpus", nargs="?", default=LLM_CORPUS)
+    parser.add_argument("--repeat", type=int, default=20, help="parses per response")
+    parser.add_argument("--db", action="store_true", help="also time database writes")
+    parser.add_argument(
+        "--strict", action="store_true", help="exit 1 if any response fails to parse"
+    )
+    args = parser.parse_args()
+
+    entries = list(read_corpus(args.corpus))
+    operations, parsed = parse_all(entries, args.repeat)
+    result = {"params": vars(args), "responses": len(entries), "operations": operations}
+    if args.db:
+        result["database"] = store_all(parsed)
+    report(result)
+
+    failures = sum(operation["failures"] for operation in operations.values())
+    if args.strict and failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
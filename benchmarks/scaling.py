@@ -0,0 +1,213 @@
+"""Load test: request throughput as gunicorn workers are added.
+
+Seeds a user and a book (structure from the fake LLM backend) in a scratch
+schema, then for each worker count starts ``gunicorn main:app`` with
+LLM_BACKEND=fake against that schema, logs in, and drives the topic notes
+API from several client processes for a fixed time. The first pass over the
+topics generates their notes through the fake backend; the timed run serves
+them from the database and the per-worker response cache.
+
+    BENCH_DSN="dbname=textbookai_bench" python -m benchmarks.scaling --workers 1 2 4
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+from urllib.parse import quote, urlencode
+
+from psycopg2.extensions import parse_dsn
+
+from benchmarks.common import (
+    BENCH_DSN,
+    ROOT,
+    connect,
+    create_database,
+    database_manager,
+    report,
+)
+from passwords import hash_password
+from pdf import FakeNoteGenerator
+
+SCHEMA = "bench_scaling"
+USERNAME = "bench_user"
+PASSWORD = "bench-password"
+
+
+def seed(schema: str) -> List[str]:
+    """Create the user and one book, returning the topic notes API paths."""
+    db = database_manager(schema)
+    try:
+        db.create_user(USERNAME, hash_password(PASSWORD), f"{USERNAME}@example.com")
+        pdf_id = db.create_pdf_record(
+            f"uploads/{USERNAME}/bench.pdf", USERNAME, "bench.pdf", status="completed"
+        )
+        structure = FakeNoteGenerator().extract_pdf_structure(None)
+        db.create_pdf_structure(pdf_id, structure)
+    finally:
+        db.close()
+
+    return [
+        f"/api/topic_notes/{quote(chapter['name'])}/{quote(topic['name'])}"
+        for chapter in structure["chapters"]
+        for topic in chapter["topics"]
+    ]
+
+
+def app_env(schema: str, workers: int, port: int) -> Dict[str, str]:
+    """Environment pointing a gunicorn run at the benchmark schema."""
+    params = parse_dsn(BENCH_DSN)
+    env = dict(os.environ)
+    env.update(
+        {
+            "SUPABASE_DATABASE": params.get("dbname", ""),
+            "SUPABASE_USER": params.get("user", ""),
+            "SUPABASE_PASSWORD": params.get("password", ""),
+            "SUPABASE_HOST": params.get("host", ""),
+            "SUPABASE_REPLICA_DSNS": "",
+            "PGPORT": params.get("port", env.get("PGPORT", "5432")),
+            "PGOPTIONS": f"-c search_path={schema}",
+            "LLM_BACKEND": "fake",
+            "FAKE_LLM_LATENCY_MS": "0",
+            "WEB_CONCURRENCY": str(workers),
+            "PORT": str(port),
+            "GUNICORN_ACCESS_LOG": "",
+            "GUNICORN_LOG_LEVEL": "warning",
+        }
+    )
+    return env
+
+
+def wait_until_ready(port: int, timeout: float = 60) -> None:
+    """Poll the readiness probe until the app answers 200."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/health/ready")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"App on port {port} did not become ready")
+
+
+def log_in(port: int) -> str:
+    """Log in and return the session cookie."""
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    conn.request(
+        "POST",
+        "/login",
+        body=urlencode(
+            {"login": USERNAME, "password": PASSWORD, "login_method": "username"}
+        ),
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    response = conn.getresponse()
+    response.read()
+    if response.status != 200:
+        raise RuntimeError(f"Login failed with status {response.status}")
+    return response.getheader("set-cookie").split(";", 1)[0]
+
+
+def drive(args: Tuple[int, str, List[str], int, float]) -> Tuple[int, int]:
+    """One client process: threads with keep-alive connections, for a fixed time.
+
+    Returns:
+        (successful requests, failed requests)
+    """
+    port, cookie, paths, threads, seconds = args
+    deadline = time.monotonic() + seconds
+    counts = [0, 0]
+    lock = threading.Lock()
+
+    def run(offset: int) -> None:
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        ok = failed = 0
+        index = offset
+        while time.monotonic() < deadline:
+            conn.request("GET", paths[index % len(paths)], headers={"Cookie": cookie})
+            response = conn.getresponse()
+            response.read()
+            if response.status == 200:
+                ok += 1
+            else:
+                failed += 1
+            index += 1
+        with lock:
+            counts[0] += ok
+            counts[1] += failed
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return counts[0], counts[1]
+
+
+def measure(workers: int, paths: List[str], args) -> Dict[str, float]:
+    """Start gunicorn with the given worker count and time the load."""
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "main:app", "-c", "gunicorn.conf.py"],
+        cwd=ROOT,
+        env=app_env(SCHEMA, workers, args.port),
+    )
+    try:
+        wait_until_ready(args.port)
+        cookie = log_in(args.port)
+
+        # Generate every topic's notes once, then let each worker warm up
+        for path in paths:
+            conn = http.client.HTTPConnection("127.0.0.1", args.port)
+            conn.request("GET", path, headers={"Cookie": cookie})
+            conn.getresponse().read()
+        with multiprocessing.Pool(args.clients) as pool:
+            pool.map(
+                drive, [(args.port, cookie, paths, args.threads, 2)] * args.clients
+            )
+
+        with multiprocessing.Pool(args.clients) as pool:
+            results = pool.map(
+                drive,
+                [(args.port, cookie, paths, args.threads, args.seconds)] * args.clients,
+            )
+    finally:
+        server.terminate()
+        server.wait()
+
+    ok = sum(result[0] for result in results)
+    failed = sum(result[1] for result in results)
+    return {"requests_per_second": ok / args.seconds, "failed": failed}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--threads", type=int, default=8, help="threads per client")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    conn = connect()
+    create_database(conn, SCHEMA)
+    paths = seed(SCHEMA)
+
+    runs = {workers: measure(workers, paths, args) for workers in args.workers}
+    baseline = runs[args.workers[0]]["requests_per_second"] / args.workers[0]
+    for workers, run in runs.items():
+        # 1.0 is perfectly linear scaling from the first worker count
+        run["scaling_efficiency"] = run["requests_per_second"] / (baseline * workers)
+
+    report({"params": vars(args), "cpu_count": os.cpu_count(), "runs": runs})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+-- Base tables as the application queries them, for local benchmark
+-- databases. Production schema changes are applied on top of this by the
+-- files in migrations/.
+
+CREATE TABLE users (
+    userid SERIAL PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    email TEXT UNIQUE,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_login TIMESTAMPTZ
+);
+
+CREATE TABLE pdfs (
+    pdfid SERIAL PRIMARY KEY,
+    pdf_path TEXT NOT NULL,
+    username TEXT NOT NULL,
+    title TEXT,
+    description TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error_message TEXT,
+    gemini_file JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMPTZ
+);
+CREATE INDEX pdfs_username_idx ON pdfs (username);
+
+CREATE TABLE chapters (
+    chapterid SERIAL PRIMARY KEY,
+    pdfid INTEGER NOT NULL REFERENCES pdfs(pdfid) ON DELETE CASCADE,
+    chaptername TEXT NOT NULL
+);
+CREATE INDEX chapters_pdfid_idx ON chapters (pdfid);
+CREATE INDEX chapters_chaptername_idx ON chapters (chaptername);
+
+CREATE TABLE topics (
+    topicid SERIAL PRIMARY KEY,
+    chapterid INTEGER NOT NULL REFERENCES chapters(chapterid) ON DELETE CASCADE,
+    topicname TEXT NOT NULL,
+    notes TEXT,
+    images JSONB,
+    updated_at TIMESTAMPTZ
+);
+CREATE INDEX topics_chapterid_idx ON topics (chapterid);
+
+CREATE TABLE subtopics (
+    subtopicid SERIAL PRIMARY KEY,
+    topicid INTEGER NOT NULL REFERENCES topics(topicid) ON DELETE CASCADE,
+    subtopicname TEXT NOT NULL,
+    parent_subtopicid INTEGER REFERENCES subtopics(subtopicid) ON DELETE CASCADE,
+    notes TEXT,
+    images JSONB,
+    updated_at TIMESTAMPTZ
+);
+CREATE INDEX subtopics_topicid_idx ON subtopics (topicid);
+CREATE INDEX subtopics_parent_idx ON subtopics (parent_subtopicid);
+
+CREATE TABLE quizzes (
+    quizid SERIAL PRIMARY KEY,
+    chapter TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE quiz_questions (
+    questionid SERIAL PRIMARY KEY,
+    quizid INTEGER NOT NULL REFERENCES quizzes(quizid) ON DELETE CASCADE,
+    question_text TEXT NOT NULL,
+    options JSONB NOT NULL,
+    correct_answer TEXT NOT NULL,
+    explanation TEXT
+);
+CREATE INDEX quiz_questions_quizid_idx ON quiz_questions (quizid);
@@ -0,0 +1,90 @@
+"""Startup benchmark: time to import main and to serve the first request.
+
+Each sample runs in a fresh interpreter so module import caches do not carry
+over. Alongside the timings it counts how many connection pools were opened
+(psycopg2.connect calls) and how many Gemini clients were configured.
+
+    python -m benchmarks.startup --samples 5
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from benchmarks.common import report
+
+PROBE = r"""
+import json
+import time
+
+import google.generativeai as genai
+import psycopg2
+
+counts = {"psycopg2_connect": 0, "genai_configure": 0}
+real_connect = psycopg2.connect
+real_configure = genai.configure
+
+
+def counting_connect(*args, **kwargs):
+    counts["psycopg2_connect"] += 1
+    return real_connect(*args, **kwargs)
+
+
+def counting_configure(*args, **kwargs):
+    counts["genai_configure"] += 1
+    return real_configure(*args, **kwargs)
+
+
+psycopg2.connect = counting_connect
+genai.configure = counting_configure
+
+start = time.perf_counter()
+import main
+import_seconds = time.perf_counter() - start
+
+from fastapi.testclient import TestClient
+
+start = time.perf_counter()
+with TestClient(main.app) as client:
+    client.get("/login")
+    first_request_seconds = time.perf_counter() - start
+
+print(json.dumps({
+    "import_seconds": import_seconds,
+    "first_request_seconds": first_request_seconds,
+    **counts,
+}))
+"""
+
+
+def sample() -> dict:
+    """Run the probe in a new interpreter and return its measurements."""
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = [sample() for _ in range(args.samples)]
+    summary = {
+        key: statistics.median(s[key] for s in samples)
+        for key in ("import_seconds", "first_request_seconds")
+    }
+    summary["psycopg2_connect"] = samples[-1]["psycopg2_connect"]
+    summary["genai_configure"] = samples[-1]["genai_configure"]
+
+    report({"params": vars(args), "median": summary, "samples": samples})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import logging
+import os
+import zlib
+from mimetypes import guess_type
+from pathlib import Path
+from typing import List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+# Static files worth storing precompressed copies of
+PRECOMPRESS_SUFFIXES = {".css", ".js", ".html", ".svg", ".json", ".txt"}
+
+
+def accepted_encodings(accept_encoding: str) -> List[str]:
+    """Content codings the client accepts (q > 0), lower-cased."""
+    accepted = []
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.append(coding.lower())
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick brotli when available and accepted, else gzip, else None."""
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    """Incremental gzip or brotli encoder that can flush after every chunk."""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits 16 + MAX_WBITS writes a gzip header and trailer
+            self._zlib = zlib.compressobj(
+                gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        """Compress a chunk, flushing so the client can decode it right away."""
+        if self.encoding == "br":
+            out = self._br.process(data)
+            return out + (self._br.finish() if final else self._br.flush())
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    """Compress text and JSON responses with brotli or gzip.
+
+    Responses smaller than minimum_size, already encoded, partial (206) or of
+    a non-text type go out unchanged. Streaming responses are held back only
+    until minimum_size bytes have arrived, then compressed chunk by chunk and
+    flushed after each one, so clients see data as soon as it is produced.
+    A compressed response's ETag is made weak, since the encoded bodies
+    share the handler's validator.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        buffered = b""
+        compressor: Optional[_Compressor] = None
+
+        async def send_body(body: bytes, more_body: bool) -> None:
+            await send(
+                {"type": "http.response.body", "body": body, "more_body": more_body}
+            )
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, buffered, compressor
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if (
+                    "content-encoding" in headers
+                    or message["status"] in (204, 206, 304)
+                    or not headers.get("content-type", "").startswith(
+                        COMPRESSIBLE_TYPES
+                    )
+                ):
+                    await send(message)
+                else:
+                    # Held back until enough body arrives to decide
+                    start = message
+                return
+            if message["type"] != "http.response.body" or (
+                start is None and compressor is None
+            ):
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is not None:
+                body = compressor.compress(body, final=not more_body)
+                await send_body(body, more_body)
+                return
+
+            # Streamed responses arrive in pieces; buffer up to minimum_size
+            buffered += body
+            if more_body and len(buffered) < self.minimum_size:
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if len(buffered) < self.minimum_size:
+                headers["Content-Length"] = str(len(buffered))
+                await send(start)
+                await send_body(buffered, False)
+                return
+
+            compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+            body = compressor.compress(buffered, final=not more_body)
+            headers["Content-Encoding"] = encoding
+            # A strong validator must differ per content-coding (RFC 9110)
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(body))
+            await send(start)
+            await send_body(body, more_body)
+
+        await self.app(scope, receive, send_compressed)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves a file's .br or .gz sibling when the client accepts it.
+
+    The siblings are written by ``python -m compression`` and are only
+    used while they are at least as new as the original file.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        request_headers = Headers(scope=scope)
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding not in accepted:
+                continue
+            original, original_stat = self.lookup_path(path)
+            encoded, encoded_stat = self.lookup_path(path + suffix)
+            if not (original_stat and encoded_stat):
+                continue
+            if encoded_stat.st_mtime < original_stat.st_mtime:
+                continue
+
+            response = FileResponse(
+                encoded,
+                stat_result=encoded_stat,
+                media_type=guess_type(original)[0] or "text/plain",
+                headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+            )
+            if self.is_not_modified(response.headers, request_headers):
+                return NotModifiedResponse(response.headers)
+            return response
+
+        return await super().get_response(path, scope)
+
+
+def precompress(directory: Path) -> int:
+    """Write .gz (and .br, if brotli is installed) copies of static text files.
+
+    Returns:
+        Number of files written
+    """
+    written = 0
+    for path in sorted(directory.rglob("*")):
+        if not path.is_file() or path.suffix not in PRECOMPRESS_SUFFIXES:
+            continue
+        data = path.read_bytes()
+        gzip = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        outputs = {".gz": gzip.compress(data) + gzip.flush()}
+        if brotli is not None:
+            outputs[".br"] = brotli.compress(data, quality=11)
+        for suffix, encoded in outputs.items():
+            target = path.with_name(path.name + suffix)
+            if len(encoded) >= len(data):
+                target.unlink(missing_ok=True)
+                continue
+            target.write_bytes(encoded)
+            written += 1
+        logger.info(f"Precompressed {path}")
+    return written
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    root = Path(os.getenv("STATIC_DIR", "static"))
+    print(f"Wrote {precompress(root)} precompressed files under {root}")
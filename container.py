@@ -0,0 +1,140 @@
+import logging
+import os
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import Request
+
+from db import DatabaseManager
+from leader import LeaderElection
+from loopmonitor import LoopMonitor
+from passwords import PasswordHasher
+from pdf import NoteGenerator, create_note_generator
+from ratelimit import RateLimiter
+from services import FileService, NoteService, QuizService, UserService
+
+logger = logging.getLogger(__name__)
+
+
+class AppContainer:
+    """Process-wide resources shared by every route, service and background job.
+
+    Owns the single database pool, the single Gemini client and the executors
+    used to keep blocking work off the event loop. Created once in the FastAPI
+    lifespan handler and closed on shutdown.
+
+    The database pool and services are built on first use, so the app starts
+    (and answers liveness probes) even while the database is unreachable.
+    """
+
+    def __init__(
+        self,
+        db: Optional[DatabaseManager] = None,
+        note_generator: Optional[NoteGenerator] = None,
+    ):
+        self._resources: Dict[str, Any] = {}
+        # Reentrant: building a service first builds the database it uses
+        self._lock = threading.RLock()
+        if db is not None:
+            self._resources["db"] = db
+
+        # NoteGenerator imports and configures Gemini on its first call
+        self.note_generator = note_generator or create_note_generator()
+
+        # Gemini calls spend their time waiting on the network
+        self.llm_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("LLM_WORKERS", "8")),
+            thread_name_prefix="llm",
+        )
+        # Image resizing is CPU-bound. Spawned rather than forked, since this
+        # process already runs threads and holds database connections.
+        self.image_executor = ProcessPoolExecutor(
+            max_workers=int(os.getenv("IMAGE_WORKERS", "2")),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+        # bcrypt releases the GIL; the pool size caps the cores it can use
+        self.password_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("PASSWORD_WORKERS", str(os.cpu_count() or 1))),
+            thread_name_prefix="bcrypt",
+        )
+        self.password_hasher = PasswordHasher(self.password_executor)
+
+        # Login attempts allowed per client IP and per account, per minute.
+        # The IP limit is looser since a classroom can share one address.
+        self.login_ip_limiter = RateLimiter(
+            rate=float(os.getenv("LOGIN_IP_ATTEMPTS_PER_MINUTE", "60")) / 60,
+            burst=int(os.getenv("LOGIN_IP_BURST", "30")),
+        )
+        self.login_user_limiter = RateLimiter(
+            rate=float(os.getenv("LOGIN_USER_ATTEMPTS_PER_MINUTE", "10")) / 60,
+            burst=int(os.getenv("LOGIN_USER_BURST", "5")),
+        )
+
+        # Decides which worker process runs the singleton scheduler jobs
+        self.leader = LeaderElection(lambda: self.db.primary)
+
+        # Started by the lifespan handler, which runs on the event loop
+        self.loop_monitor = LoopMonitor()
+
+    def _lazy(self, name: str, factory: Callable[[], Any]) -> Any:
+        """Return a named resource, building it once on first access.
+
+        A factory that raises is retried on the next access.
+        """
+        resource = self._resources.get(name)
+        if resource is None:
+            with self._lock:
+                resource = self._resources.get(name)
+                if resource is None:
+                    resource = factory()
+                    self._resources[name] = resource
+        return resource
+
+    @property
+    def db(self) -> DatabaseManager:
+        return self._lazy("db", DatabaseManager)
+
+    @property
+    def note_service(self) -> NoteService:
+        return self._lazy(
+            "note_service", lambda: NoteService(self.db, self.note_generator)
+        )
+
+    @property
+    def user_service(self) -> UserService:
+        return self._lazy(
+            "user_service", lambda: UserService(self.db, self.password_hasher)
+        )
+
+    @property
+    def file_service(self) -> FileService:
+        return self._lazy(
+            "file_service",
+            lambda: FileService(self.db, self.note_generator, self.image_executor),
+        )
+
+    @property
+    def quiz_service(self) -> QuizService:
+        return self._lazy(
+            "quiz_service",
+            lambda: QuizService(self.db, self.note_service, self.llm_executor),
+        )
+
+    def close(self) -> None:
+        """Stop the executors and close every database connection."""
+        self.llm_executor.shutdown(wait=False, cancel_futures=True)
+        self.image_executor.shutdown(wait=False, cancel_futures=True)
+        self.password_executor.shutdown(wait=False, cancel_futures=True)
+        self.leader.release()
+        db = self._resources.get("db")
+        if db is not None:
+            db.close()
+        logger.info("Application container closed")
+
+
+def get_container(request: Request) -> AppContainer:
+    """Dependency returning the container created at startup."""
+    return request.app.state.container
@@ -1,120 +1,396 @@
-from passlib.context import CryptContext
 import logging
 import json
 from pathlib import Path
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Optional, Tuple, Any, List
+from psycopg2.extras import RealDictCursor, execute_values
+from typing import Callable, Dict, Optional, Tuple, Any, List
 import os
 from dotenv import load_dotenv
-from psycopg2 import pool
 from contextlib import contextmanager
 from psycopg2.pool import SimpleConnectionPool
 from tenacity import retry, stop_after_attempt, wait_exponential
+from contextvars import ContextVar
+import hashlib
+import itertools
+import sys
 import time
 
+from cache import LRUCache
+from metrics import (
+    DB_CHECKOUT_SECONDS,
+    DB_CONNECTIONS_IN_USE,
+    DB_ERRORS,
+    DB_QUERY_SECONDS,
+)
+from querystats import StatsConnection
+from tracing import TracedConnection, is_recording, span
+
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Identifies the caller (the logged-in user) so reads can follow its own writes
+db_session: ContextVar[Optional[str]] = ContextVar("db_session", default=None)
 
-class DatabaseManager:
-    def __init__(self):
-        self.pool = None
-        self.create_pool()
+# Last write time (wall clock) per session, shared by every DatabaseManager
+# in the process. Other worker processes learn about a session's writes
+# through record_session_write, fed from the session cookie.
+_session_writes: Dict[str, float] = {}
 
-    def create_pool(self):
-        """Create a new connection pool."""
+# Called with ("topic" | "subtopic", note id) after notes are stored
+notes_write_listeners: List[Callable[[str, int], None]] = []
+
+# Groupings offered by get_llm_usage_summary, mapped to their columns
+LLM_USAGE_GROUPS = {
+    "user": "username",
+    "pdf": "pdfid",
+    "chapter": "chapter",
+    "endpoint": "endpoint",
+    "model": "model",
+}
+
+
+def note_content_hash(notes: str, images: List[Dict]) -> str:
+    """Stable hash of a note body and its images, used as its version."""
+    payload = notes + json.dumps(images, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _notify_notes_written(kind: str, note_id: int) -> None:
+    """Tell listeners (e.g. response caches) that a note changed."""
+    for listener in notes_write_listeners:
         try:
-            if self.pool:
-                self.pool.closeall()
+            listener(kind, note_id)
+        except Exception as e:
+            logger.error(f"Notes write listener failed: {str(e)}")
+
+
+def session_write_time(session: str) -> Optional[float]:
+    """Wall-clock time of the session's last write seen by this process."""
+    return _session_writes.get(session)
+
+
+def record_session_write(session: str, written_at: float) -> None:
+    """Note a write made by the session, possibly in another worker process."""
+    if written_at > _session_writes.get(session, float("-inf")):
+        _session_writes[session] = written_at
+
+
+class PoolEndpoint:
+    """A Postgres server with its own connection pool and usage counters."""
+
+    def __init__(self, name: str, role: str, dsn: str = "", **connect_kwargs):
+        self.name = name
+        self.role = role
+        self.dsn = dsn
+        self.connect_kwargs = connect_kwargs
+        self.pool: Optional[SimpleConnectionPool] = None
+        self.ejected_until = 0.0
+        self.checkouts = 0
+        self.errors = 0
+        self.ejections = 0
+        self.wait_seconds = 0.0
+        self.in_use = 0
+
+    def create_pool(self) -> None:
+        """Create a new connection pool, closing the old one."""
+        if self.pool:
+            self.pool.closeall()
+
+        self.pool = SimpleConnectionPool(
+            minconn=1,
+            maxconn=10,
+            dsn=self.dsn,
+            # Connection timeout set to 5 minutes (300 seconds)
+            connect_timeout=300,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=5,
+            **self.connect_kwargs,
+        )
+
+    def connect(self):
+        """Open a standalone connection outside the pool."""
+        return psycopg2.connect(dsn=self.dsn, **self.connect_kwargs)
+
+    def is_healthy(self) -> bool:
+        """Whether the endpoint is currently eligible for routing."""
+        return self.pool is not None and time.monotonic() >= self.ejected_until
+
+    def eject(self, seconds: float) -> None:
+        """Take the endpoint out of rotation for a while."""
+        self.ejected_until = time.monotonic() + seconds
+        self.ejections += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        """Snapshot of pool usage for this endpoint."""
+        return {
+            "name": self.name,
+            "role": self.role,
+            "healthy": self.is_healthy(),
+            "ejected_for_seconds": round(
+                max(self.ejected_until - time.monotonic(), 0.0), 1
+            ),
+            "checkouts": self.checkouts,
+            "errors": self.errors,
+            "ejections": self.ejections,
+            "in_use": self.in_use,
+            "idle": len(self.pool._pool) if self.pool else 0,
+            "avg_checkout_ms": (
+                round(1000 * self.wait_seconds / self.checkouts, 2)
+                if self.checkouts
+                else 0.0
+            ),
+        }
 
-            self.pool = SimpleConnectionPool(
-                minconn=1,
-                maxconn=10,
+
+class DatabaseManager:
+    def __init__(
+        self,
+        primary_dsn: Optional[str] = None,
+        replica_dsns: Optional[List[str]] = None,
+    ):
+        """Connect to the primary and any read replicas.
+
+        Args:
+            primary_dsn: libpq connection string for the primary. Defaults to
+                the SUPABASE_* environment variables.
+            replica_dsns: Connection strings for read replicas. Defaults to the
+                comma-separated SUPABASE_REPLICA_DSNS environment variable.
+        """
+        if primary_dsn:
+            self.primary = PoolEndpoint("primary", "primary", primary_dsn)
+        else:
+            self.primary = PoolEndpoint(
+                "primary",
+                "primary",
                 dbname=os.getenv("SUPABASE_DATABASE"),
                 user=os.getenv("SUPABASE_USER"),
                 password=os.getenv("SUPABASE_PASSWORD"),
                 host=os.getenv("SUPABASE_HOST"),
-                # Connection timeout set to 5 minutes (300 seconds)
-                connect_timeout=300,
-                keepalives=1,
-                keepalives_idle=30,
-                keepalives_interval=10,
-                keepalives_count=5,
             )
+
+        if replica_dsns is None:
+            replica_dsns = [
+                dsn.strip()
+                for dsn in os.getenv("SUPABASE_REPLICA_DSNS", "").split(",")
+                if dsn.strip()
+            ]
+        self.replicas = [
+            PoolEndpoint(f"replica-{index}", "replica", dsn)
+            for index, dsn in enumerate(replica_dsns)
+        ]
+
+        # Reads from a session stay on the primary this long after it writes
+        self.read_your_writes_seconds = float(
+            os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5")
+        )
+        # How long a failing replica is kept out of rotation
+        self.replica_ejection_seconds = float(
+            os.getenv("DB_REPLICA_EJECTION_SECONDS", "30")
+        )
+        self._next_replica = itertools.count()
+
+        # Quizzes are immutable once stored, so answers never need invalidating
+        self.quiz_answers_cache = LRUCache(maxsize=512)
+        self.create_pool()
+        for replica in self.replicas:
+            self._create_replica_pool(replica)
+
+    @property
+    def pool(self) -> Optional[SimpleConnectionPool]:
+        """Connection pool of the primary."""
+        return self.primary.pool
+
+    def create_pool(self):
+        """Create a new connection pool."""
+        try:
+            self.primary.create_pool()
             logger.info("Database connection pool established")
         except Exception as e:
             logger.error(f"Error creating connection pool: {str(e)}")
             raise
 
+    def _create_replica_pool(self, replica: PoolEndpoint) -> None:
+        """Create a replica pool, ejecting the replica if it is unreachable."""
+        try:
+            replica.create_pool()
+            logger.info(f"Connection pool established for {replica.name}")
+        except Exception as e:
+            logger.error(f"Error creating pool for {replica.name}: {str(e)}")
+            replica.errors += 1
+            replica.eject(self.replica_ejection_seconds)
+
+    def _route(self, readonly: bool, primary: bool = False) -> PoolEndpoint:
+        """Pick the endpoint for a checkout.
+
+        Writes, reads with no healthy replica, reads that asked for the
+        primary, and reads from a session that wrote within the
+        read-your-writes window all go to the primary. Other reads are
+        spread round-robin over healthy replicas. Only writes count towards
+        the session's read-your-writes window.
+        """
+        session = db_session.get()
+        # Wall clock, since write times are passed between worker processes
+        now = time.time()
+
+        if primary and readonly:
+            return self.primary
+
+        if not readonly:
+            if session:
+                _session_writes[session] = now
+                if len(_session_writes) > 10000:
+                    self._forget_old_writes(now)
+            return self.primary
+
+        if session and (
+            now - _session_writes.get(session, float("-inf"))
+            < self.read_your_writes_seconds
+        ):
+            return self.primary
+
+        healthy = [replica for replica in self.replicas if replica.is_healthy()]
+        if not healthy:
+            return self.primary
+        return healthy[next(self._next_replica) % len(healthy)]
+
+    def _forget_old_writes(self, now: float) -> None:
+        """Drop sessions whose read-your-writes window has passed."""
+        for session, written in list(_session_writes.items()):
+            if now - written >= self.read_your_writes_seconds:
+                _session_writes.pop(session, None)
+
     @retry(
         stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10)
     )
     @contextmanager
-    def get_connection(self):
-        """Get a connection from the pool with retry logic."""
-        if not self.pool:
+    def get_connection(self, readonly: bool = False, primary: bool = False):
+        """Get a connection from the pool with retry logic.
+
+        Args:
+            readonly: The caller only reads, so a replica may serve it
+            primary: Read from the primary anyway, for reads that must not
+                lag behind writes from other sessions
+        """
+        endpoint = self._route(readonly, primary)
+        if not endpoint.pool:
             raise ValueError("Database connection pool not established")
 
-        conn = None
-        try:
-            conn = self.pool.getconn()
+        # The DatabaseManager method that entered the `with` block (frame 1
+        # is the context manager's __enter__), used to label query timings
+        method = sys._getframe(2).f_code.co_name
 
-            # Test if connection is alive
-            with conn.cursor() as cur:
-                cur.execute("SELECT 1")
+        with span(f"db.{method}", **{"db.endpoint": endpoint.name}):
+            conn = None
+            started = time.perf_counter()
+            try:
+                conn = endpoint.pool.getconn()
 
-            yield conn
+                # Test if connection is alive
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
 
-        except Exception as e:
-            logger.error(f"Database connection error: {str(e)}")
-            if conn:
+                checked_out = time.perf_counter()
+                endpoint.checkouts += 1
+                endpoint.wait_seconds += checked_out - started
+                DB_CHECKOUT_SECONDS.labels(endpoint=endpoint.name).observe(
+                    checked_out - started
+                )
+                endpoint.in_use += 1
+                in_use = DB_CONNECTIONS_IN_USE.labels(endpoint=endpoint.name)
+                in_use.inc()
                 try:
-                    self.pool.putconn(conn, close=True)
-                except Exception:
-                    pass  # Ignore errors when closing bad connection
-            conn = None  # Ensure conn is None after handling error
+                    timed_conn = StatsConnection(conn, method)
+                    yield (
+                        TracedConnection(timed_conn) if is_recording() else timed_conn
+                    )
+                finally:
+                    endpoint.in_use -= 1
+                    in_use.dec()
+                    DB_QUERY_SECONDS.labels(method=method).observe(
+                        time.perf_counter() - checked_out
+                    )
 
-            # Recreate pool if connection failed
-            try:
-                self.create_pool()
             except Exception as e:
-                logger.error(f"Failed to recreate connection pool: {str(e)}")
-            raise
-
-        finally:
-            if conn:
+                logger.error(f"Database connection error on {endpoint.name}: {str(e)}")
+                endpoint.errors += 1
+                DB_ERRORS.labels(endpoint=endpoint.name).inc()
+                if conn:
+                    try:
+                        endpoint.pool.putconn(conn, close=True)
+                    except Exception:
+                        pass  # Ignore errors when closing bad connection
+                conn = None  # Ensure conn is None after handling error
+
+                if endpoint.role == "replica":
+                    # Only connectivity failures say anything about replica health
+                    if isinstance(
+                        e, (psycopg2.OperationalError, psycopg2.InterfaceError)
+                    ):
+                        logger.warning(f"Ejecting {endpoint.name} from read rotation")
+                        endpoint.eject(self.replica_ejection_seconds)
+                        self._create_replica_pool(endpoint)
+                    raise
+
+                # Recreate pool if connection failed
                 try:
-                    self.pool.putconn(conn)
+                    self.create_pool()
                 except Exception as e:
-                    logger.error(f"Error returning connection to pool: {str(e)}")
-                    # If we can't return the connection, close the pool and create a new one
+                    logger.error(f"Failed to recreate connection pool: {str(e)}")
+                raise
+
+            finally:
+                if conn:
                     try:
-                        self.create_pool()
-                    except Exception:
-                        pass
+                        endpoint.pool.putconn(conn)
+                    except Exception as e:
+                        logger.error(f"Error returning connection to pool: {str(e)}")
+                        # If we can't return the connection, close the pool and create a new one
+                        try:
+                            if endpoint.role == "replica":
+                                self._create_replica_pool(endpoint)
+                            else:
+                                self.create_pool()
+                        except Exception:
+                            pass
+
+    def pool_metrics(self) -> List[Dict[str, Any]]:
+        """Per-endpoint pool usage, primary first."""
+        return [endpoint.metrics() for endpoint in [self.primary, *self.replicas]]
+
+    def close(self) -> None:
+        """Close the primary and replica connection pools."""
+        for endpoint in [
+            getattr(self, "primary", None),
+            *getattr(self, "replicas", []),
+        ]:
+            if endpoint and endpoint.pool:
+                try:
+                    endpoint.pool.closeall()
+                except Exception as e:
+                    logger.error(f"Error closing connection pool: {str(e)}")
+                endpoint.pool = None
 
     def __del__(self):
         """Clean up the connection pool when the instance is destroyed."""
-        if hasattr(self, "pool") and self.pool:
-            try:
-                self.pool.closeall()
-            except Exception as e:
-                logger.error(f"Error closing connection pool: {str(e)}")
+        self.close()
 
     def get_topic_notes(self, chapter: str, topic: str) -> Optional[Dict]:
         """Get topic notes from database if they exist."""
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
                     """
-                    SELECT t.notes, t.images, p.pdf_path, p.username, p.pdfid, t.topicid
+                    SELECT n.notes, n.images, p.pdf_path, p.username, p.pdfid, t.topicid,
+                        n.notes_html IS NOT NULL AS has_html
                     FROM topics t
                     JOIN chapters c ON t.chapterid = c.chapterid
-                    JOIN pdfs p ON c.pdfid = p.pdfid
+                    JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
+                    LEFT JOIN topic_notes n ON n.topicid = t.topicid
                     WHERE c.chaptername = %s AND t.topicname = %s
                     """,
                     (chapter, topic),
@@ -137,24 +413,75 @@ class DatabaseManager:
             finally:
                 cur.close()
 
-    def store_topic_notes(self, topic_id: int, notes: str, images: list) -> bool:
-        """Store topic notes in database."""
+    def get_topic_notes_version(self, chapter: str, topic: str) -> Optional[Dict]:
+        """Get a topic's id and the content hash of its notes, without the body.
+
+        Returns:
+            Optional[Dict]: ``topicid`` and ``content_hash`` (None until notes
+            exist), or None if the topic does not exist
+        """
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cur.execute(
+                    """
+                    SELECT t.topicid, n.content_hash
+                    FROM topics t
+                    JOIN chapters c ON t.chapterid = c.chapterid
+                    JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
+                    LEFT JOIN topic_notes n ON n.topicid = t.topicid
+                    WHERE c.chaptername = %s AND t.topicname = %s
+                    """,
+                    (chapter, topic),
+                )
+                return cur.fetchone()
+            except Exception as e:
+                logger.error(f"Database error in get_topic_notes_version: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def store_topic_notes(
+        self, topic_id: int, notes: str, images: list, rendered: Optional[Dict] = None
+    ) -> bool:
+        """Store topic notes in database.
+
+        Args:
+            rendered: Optional ``notes_html`` and ``images_html`` from
+                rendering.render_note, stored for inlining into the page
+        """
+        rendered = rendered or {}
         with self.get_connection() as conn:
             cur = conn.cursor()
             try:
                 cur.execute(
                     """
-                    UPDATE topics 
-                    SET notes = %s, 
-                        images = %s::jsonb,
-                        updated_at = CURRENT_TIMESTAMP
+                    INSERT INTO topic_notes
+                        (topicid, notes, images, content_hash, notes_html, images_html)
+                    SELECT topicid, %s, %s::jsonb, %s, %s, %s
+                    FROM topics
                     WHERE topicid = %s
+                    ON CONFLICT (topicid) DO UPDATE
+                    SET notes = EXCLUDED.notes,
+                        images = EXCLUDED.images,
+                        content_hash = EXCLUDED.content_hash,
+                        notes_html = EXCLUDED.notes_html,
+                        images_html = EXCLUDED.images_html,
+                        updated_at = CURRENT_TIMESTAMP
                     RETURNING topicid
                     """,
-                    (notes, json.dumps(images), topic_id),
+                    (
+                        notes,
+                        json.dumps(images),
+                        note_content_hash(notes, images),
+                        rendered.get("notes_html"),
+                        rendered.get("images_html"),
+                        topic_id,
+                    ),
                 )
                 updated = cur.fetchone()
                 conn.commit()
+                _notify_notes_written("topic", topic_id)
                 logger.info(f"Successfully stored notes for topic_id: {topic_id}")
                 return bool(updated)
             except Exception as e:
@@ -168,22 +495,24 @@ class DatabaseManager:
         self, chapter: str, topic: str, subtopic: str
     ) -> Optional[Dict]:
         """Get subtopic notes from database."""
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
                     """
                     SELECT 
-                        s.notes, 
-                        s.images::text, 
+                        n.notes, 
+                        n.images::text as images, 
                         s.subtopicid,
                         p.pdf_path, 
                         p.username, 
-                        p.pdfid
+                        p.pdfid,
+                        n.notes_html IS NOT NULL AS has_html
                     FROM subtopics s
                     JOIN topics t ON s.topicid = t.topicid
                     JOIN chapters c ON t.chapterid = c.chapterid
-                    JOIN pdfs p ON c.pdfid = p.pdfid
+                    JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
+                    LEFT JOIN subtopic_notes n ON n.subtopicid = s.subtopicid
                     WHERE 
                         c.chaptername = %s 
                         AND t.topicname = %s 
@@ -215,28 +544,81 @@ class DatabaseManager:
             finally:
                 cur.close()
 
+    def get_subtopic_notes_version(
+        self, chapter: str, topic: str, subtopic: str
+    ) -> Optional[Dict]:
+        """Get a subtopic's id and the content hash of its notes, without the body.
+
+        Returns:
+            Optional[Dict]: ``subtopicid`` and ``content_hash`` (None until
+            notes exist), or None if the subtopic does not exist
+        """
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cur.execute(
+                    """
+                    SELECT s.subtopicid, n.content_hash
+                    FROM subtopics s
+                    JOIN topics t ON s.topicid = t.topicid
+                    JOIN chapters c ON t.chapterid = c.chapterid
+                    JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
+                    LEFT JOIN subtopic_notes n ON n.subtopicid = s.subtopicid
+                    WHERE 
+                        c.chaptername = %s 
+                        AND t.topicname = %s 
+                        AND s.subtopicname = %s
+                    """,
+                    (chapter, topic, subtopic),
+                )
+                return cur.fetchone()
+            except Exception as e:
+                logger.error(f"Database error in get_subtopic_notes_version: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
     def store_subtopic_notes(
-        self, subtopic_id: int, notes: str, images: List[Dict]
+        self,
+        subtopic_id: int,
+        notes: str,
+        images: List[Dict],
+        rendered: Optional[Dict] = None,
     ) -> None:
-        """Store generated notes for a subtopic."""
+        """Store generated notes for a subtopic.
+
+        Args:
+            rendered: Optional ``notes_html`` and ``images_html`` from
+                rendering.render_note, stored for inlining into the page
+        """
+        rendered = rendered or {}
         with self.get_connection() as conn:
             cur = conn.cursor()
             try:
                 cur.execute(
                     """
-                    UPDATE subtopics 
-                    SET notes = %s, 
-                        images = %s::jsonb,
+                    INSERT INTO subtopic_notes
+                        (subtopicid, notes, images, content_hash, notes_html, images_html)
+                    VALUES (%s, %s, %s::jsonb, %s, %s, %s)
+                    ON CONFLICT (subtopicid) DO UPDATE
+                    SET notes = EXCLUDED.notes,
+                        images = EXCLUDED.images,
+                        content_hash = EXCLUDED.content_hash,
+                        notes_html = EXCLUDED.notes_html,
+                        images_html = EXCLUDED.images_html,
                         updated_at = CURRENT_TIMESTAMP
-                    WHERE subtopicid = %s
                     """,
                     (
-                        notes,
-                        json.dumps(images),
                         subtopic_id,
-                    ),  # Convert images to JSON string
+                        notes,
+                        json.dumps(images),  # Convert images to JSON string
+                        note_content_hash(notes, images),
+                        rendered.get("notes_html"),
+                        rendered.get("images_html"),
+                    ),
                 )
                 conn.commit()
+                _notify_notes_written("subtopic", subtopic_id)
                 logger.info(f"Stored notes for subtopic ID: {subtopic_id}")
 
             except Exception as e:
@@ -246,6 +628,101 @@ class DatabaseManager:
             finally:
                 cur.close()
 
+    def get_topic_notes_html(self, chapter: str, topic: str) -> Optional[Dict]:
+        """Get a topic's pre-rendered notes HTML for its page.
+
+        Returns:
+            Optional[Dict]: ``notes_html`` and ``images_html`` (None until
+            rendered), or None if the topic does not exist
+        """
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cur.execute(
+                    """
+                    SELECT n.notes_html, n.images_html
+                    FROM topics t
+                    JOIN chapters c ON t.chapterid = c.chapterid
+                    JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
+                    LEFT JOIN topic_notes n ON n.topicid = t.topicid
+                    WHERE c.chaptername = %s AND t.topicname = %s
+                    LIMIT 1
+                    """,
+                    (chapter, topic),
+                )
+                return cur.fetchone()
+            except Exception as e:
+                logger.error(f"Database error in get_topic_notes_html: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def get_subtopic_notes_html(
+        self, chapter: str, topic: str, subtopic: str
+    ) -> Optional[Dict]:
+        """Get a subtopic's pre-rendered notes HTML for its page.
+
+        Returns:
+            Optional[Dict]: ``notes_html`` and ``images_html`` (None until
+            rendered), or None if the subtopic does not exist
+        """
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cur.execute(
+                    """
+                    SELECT n.notes_html, n.images_html
+                    FROM subtopics s
+                    JOIN topics t ON s.topicid = t.topicid
+                    JOIN chapters c ON t.chapterid = c.chapterid
+                    JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
+                    LEFT JOIN subtopic_notes n ON n.subtopicid = s.subtopicid
+                    WHERE 
+                        c.chaptername = %s 
+                        AND t.topicname = %s 
+                        AND s.subtopicname = %s
+                    LIMIT 1
+                    """,
+                    (chapter, topic, subtopic),
+                )
+                return cur.fetchone()
+            except Exception as e:
+                logger.error(f"Database error in get_subtopic_notes_html: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def store_notes_html(self, kind: str, note_id: int, rendered: Dict) -> None:
+        """Store pre-rendered HTML for notes that were stored without it.
+
+        Args:
+            kind: "topic" or "subtopic"
+            note_id: topicid or subtopicid
+            rendered: ``notes_html`` and ``images_html`` from rendering.render_note
+        """
+        table, key = {
+            "topic": ("topic_notes", "topicid"),
+            "subtopic": ("subtopic_notes", "subtopicid"),
+        }[kind]
+        with self.get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    f"""
+                    UPDATE {table}
+                    SET notes_html = %s, images_html = %s
+                    WHERE {key} = %s
+                    """,
+                    (rendered["notes_html"], rendered["images_html"], note_id),
+                )
+                conn.commit()
+            except Exception as e:
+                logger.error(f"Database error in store_notes_html: {str(e)}")
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+
     def create_pdf_record(
         self, pdf_path: str, username: str, filename: str, status: str = "pending"
     ) -> int:
@@ -262,6 +739,19 @@ class DatabaseManager:
                     (pdf_path, username, filename, status),
                 )
                 pdf_id = cur.fetchone()[0]
+
+                cur.execute(
+                    """
+                    INSERT INTO user_stats (username, total_pdfs, last_upload)
+                    VALUES (%s, 1, CURRENT_TIMESTAMP)
+                    ON CONFLICT (username) DO UPDATE
+                    SET total_pdfs = user_stats.total_pdfs + 1,
+                        last_upload = CURRENT_TIMESTAMP,
+                        updated_at = CURRENT_TIMESTAMP
+                    """,
+                    (username,),
+                )
+
                 conn.commit()
                 logger.info(f"Created PDF record: {pdf_path} with ID: {pdf_id}")
                 return pdf_id
@@ -272,18 +762,214 @@ class DatabaseManager:
             finally:
                 cur.close()
 
-    def store_gemini_file(
-        self, pdf_path: str, username: str, gemini_file_dict: Dict
+    def record_pdf_usage(
+        self, pdf_id: int, pdf_bytes: int, image_bytes: int, image_files: int
     ) -> None:
+        """Record how much disk a PDF and its extracted images take up."""
+        with self.get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    """
+                    UPDATE pdfs
+                    SET pdf_bytes = %s,
+                        image_bytes = %s,
+                        image_files = %s,
+                        usage_updated_at = CURRENT_TIMESTAMP
+                    WHERE pdfid = %s
+                    """,
+                    (pdf_bytes, image_bytes, image_files, pdf_id),
+                )
+                conn.commit()
+            except Exception as e:
+                logger.error(f"Database error in record_pdf_usage: {str(e)}")
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+    def get_storage_usage(self, username: str) -> Dict:
+        """Disk used by a user's PDFs, as recorded by record_pdf_usage.
+
+        Returns:
+            Dict: ``bytes`` and ``files`` (each PDF counts as one file plus
+            its images)
+        """
+        with self.get_connection(readonly=True, primary=True) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cur.execute(
+                    """
+                    SELECT
+                        COALESCE(SUM(pdf_bytes + image_bytes), 0)::bigint AS bytes,
+                        COALESCE(SUM(1 + image_files), 0)::bigint AS files
+                    FROM pdfs
+                    WHERE username = %s AND deleted_at IS NULL
+                    """,
+                    (username,),
+                )
+                return cur.fetchone()
+            except Exception as e:
+                logger.error(f"Database error in get_storage_usage: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def get_top_storage_users(self, limit: int) -> List[Dict]:
+        """Users using the most disk, largest first."""
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cur.execute(
+                    """
+                    SELECT
+                        username,
+                        COUNT(*) AS pdfs,
+                        SUM(pdf_bytes + image_bytes)::bigint AS bytes,
+                        SUM(1 + image_files)::bigint AS files,
+                        MIN(usage_updated_at) AS oldest_measurement
+                    FROM pdfs
+                    WHERE deleted_at IS NULL
+                    GROUP BY username
+                    ORDER BY bytes DESC
+                    LIMIT %s
+                    """,
+                    (limit,),
+                )
+                return cur.fetchall()
+            except Exception as e:
+                logger.error(f"Database error in get_top_storage_users: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def insert_llm_usage(self, rows: List[Dict]) -> None:
+        """Append a batch of Gemini calls to the usage table.
+
+        Args:
+            rows: Calls as queued by llm_usage.record
+        """
+        with self.get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO llm_usage (
+                        username, pdfid, chapter, endpoint, model,
+                        input_tokens, output_tokens, cached_tokens,
+                        cost_usd, latency_ms, cache_hit, outcome
+                    )
+                    VALUES %s
+                    """,
+                    [
+                        (
+                            row["username"],
+                            row["pdfid"],
+                            row["chapter"],
+                            row["endpoint"],
+                            row["model"],
+                            row["input_tokens"],
+                            row["output_tokens"],
+                            row["cached_tokens"],
+                            row["cost_usd"],
+                            row["latency_ms"],
+                            row["cache_hit"],
+                            row["outcome"],
+                        )
+                        for row in rows
+                    ],
+                    page_size=1000,
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Database error in insert_llm_usage: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def get_llm_spend_today(self, username: str) -> float:
+        """A user's Gemini spend in US dollars since midnight UTC."""
+        # A replica may lag the latest flushes, which adds its lag to the
+        # one-flush-interval overshoot llm_usage.check_budget already allows
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    """
+                    SELECT COALESCE(SUM(cost_usd), 0)::float8
+                    FROM llm_usage
+                    WHERE username = %s
+                        AND created_at >= date_trunc('day', CURRENT_TIMESTAMP AT TIME ZONE 'UTC')
+                            AT TIME ZONE 'UTC'
+                    """,
+                    (username,),
+                )
+                return cur.fetchone()[0]
+            except Exception as e:
+                logger.error(f"Database error in get_llm_spend_today: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def get_llm_usage_summary(
+        self, group_by: str, days: float, limit: int
+    ) -> List[Dict]:
+        """Gemini calls, tokens and spend over the last few days, most expensive first.
+
+        Args:
+            group_by: One of LLM_USAGE_GROUPS
+            days: How far back to look
+            limit: Maximum number of groups returned
+
+        Raises:
+            ValueError: If group_by is not a known grouping
+        """
+        column = LLM_USAGE_GROUPS.get(group_by)
+        if column is None:
+            raise ValueError(f"Unknown usage grouping: {group_by}")
+
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                # column comes from the fixed mapping above, never from input
+                cur.execute(
+                    f"""
+                    SELECT
+                        {column} AS key,
+                        COUNT(*) AS calls,
+                        COUNT(*) FILTER (WHERE outcome <> 'ok') AS errors,
+                        COUNT(*) FILTER (WHERE cache_hit) AS cache_hits,
+                        SUM(input_tokens)::bigint AS input_tokens,
+                        SUM(output_tokens)::bigint AS output_tokens,
+                        SUM(cached_tokens)::bigint AS cached_tokens,
+                        SUM(cost_usd)::float8 AS cost_usd,
+                        AVG(latency_ms)::float8 AS avg_latency_ms
+                    FROM llm_usage
+                    WHERE created_at >= CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    GROUP BY {column}
+                    ORDER BY cost_usd DESC, calls DESC
+                    LIMIT %s
+                    """,
+                    (days * 86400, limit),
+                )
+                return cur.fetchall()
+            except Exception as e:
+                logger.error(f"Database error in get_llm_usage_summary: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def store_gemini_file(self, pdf_id: int, gemini_file_dict: Dict) -> None:
         """Store Gemini file information in database.
 
         Args:
-            pdf_path: Path to the PDF file
-            username: Owner of the PDF
+            pdf_id: ID of the PDF the file was uploaded for
             gemini_file_dict: Dictionary containing Gemini file information
 
         Raises:
-            ValueError: If PDF record is not found
+            ValueError: If PDF record is not found or is deleted
             psycopg2.Error: If there's a database error
         """
         with self.get_connection() as conn:
@@ -292,21 +978,28 @@ class DatabaseManager:
                 cur.execute(
                     """
                     UPDATE pdfs 
-                    SET gemini_file = %s::jsonb,
-                        status = 'completed'
-                    WHERE pdf_path = %s AND username = %s
+                    SET status = 'completed'
+                    WHERE pdfid = %s AND deleted_at IS NULL
                     RETURNING pdfid
                     """,
-                    (json.dumps(gemini_file_dict), pdf_path, username),
+                    (pdf_id,),
+                )
+                if not cur.fetchone():
+                    raise ValueError(f"No PDF found with ID {pdf_id}")
+
+                cur.execute(
+                    """
+                    INSERT INTO pdf_gemini_files (pdfid, gemini_file)
+                    VALUES (%s, %s::jsonb)
+                    ON CONFLICT (pdfid) DO UPDATE
+                    SET gemini_file = EXCLUDED.gemini_file,
+                        updated_at = CURRENT_TIMESTAMP
+                    """,
+                    (pdf_id, json.dumps(gemini_file_dict)),
                 )
-                result = cur.fetchone()
-                if not result:
-                    raise ValueError(
-                        f"No PDF found with path {pdf_path} for user {username}"
-                    )
 
                 conn.commit()
-                logger.info(f"Updated Gemini file for PDF: {pdf_path}")
+                logger.info(f"Updated Gemini file for PDF: {pdf_id}")
 
             except Exception as e:
                 logger.error(f"Error in store_gemini_file: {str(e)}")
@@ -317,11 +1010,11 @@ class DatabaseManager:
 
     def get_gemini_file(self, pdf_id: int) -> Optional[Dict]:
         """Get Gemini file information from database."""
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
-                    "SELECT gemini_file FROM pdfs WHERE pdfid = %s",
+                    "SELECT gemini_file FROM pdf_gemini_files WHERE pdfid = %s",
                     (pdf_id,),
                 )
                 result = cur.fetchone()
@@ -336,7 +1029,7 @@ class DatabaseManager:
 
     def get_user(self, username: str) -> Optional[Dict]:
         """Get user information from database."""
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True, primary=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
@@ -375,6 +1068,17 @@ class DatabaseManager:
                     raise ValueError(f"Failed to create user: {username}")
 
                 user_id = result[0]
+
+                # Start the user's profile counters at zero
+                cur.execute(
+                    """
+                    INSERT INTO user_stats (username)
+                    VALUES (%s)
+                    ON CONFLICT (username) DO NOTHING
+                    """,
+                    (username,),
+                )
+
                 conn.commit()
                 logger.info(f"Created new user: {username} with ID: {user_id}")
                 return user_id
@@ -401,7 +1105,7 @@ class DatabaseManager:
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                with self.get_connection() as conn:
+                with self.get_connection(readonly=True) as conn:
                     with conn.cursor(cursor_factory=RealDictCursor) as cur:
                         cur.execute(
                             """
@@ -409,12 +1113,11 @@ class DatabaseManager:
                                 pdfid,
                                 pdf_path,
                                 username,
-                                gemini_file,
                                 created_at as upload_date,
                                 title,
                                 description
                             FROM pdfs
-                            WHERE username = %s
+                            WHERE username = %s AND deleted_at IS NULL
                             ORDER BY created_at DESC
                             """,
                             (username,),
@@ -534,7 +1237,7 @@ class DatabaseManager:
 
     def get_user_by_email(self, email: str) -> Optional[Dict]:
         """Get user information by email."""
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True, primary=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
@@ -558,6 +1261,10 @@ class DatabaseManager:
         with self.get_connection() as conn:
             cur = conn.cursor()
             try:
+                total_chapters = 0
+                total_topics = 0
+                total_subtopics = 0
+
                 for chapter in structure["chapters"]:
                     # Create chapter
                     cur.execute(
@@ -572,6 +1279,7 @@ class DatabaseManager:
                     if not result:
                         raise ValueError(f"Failed to create chapter: {chapter['name']}")
                     chapter_id = result[0]
+                    total_chapters += 1
 
                     # Process topics
                     if "topics" in chapter:
@@ -591,13 +1299,28 @@ class DatabaseManager:
                                     f"Failed to create topic: {topic['name']}"
                                 )
                             topic_id = result[0]
+                            total_topics += 1
 
                             # Process subtopics recursively
                             if "subtopics" in topic:
-                                self._create_subtopics(
+                                total_subtopics += self._create_subtopics(
                                     cur, topic_id, topic["subtopics"]
                                 )
 
+                # Keep the owner's profile counters in step with the structure
+                cur.execute(
+                    """
+                    UPDATE user_stats s
+                    SET total_chapters = s.total_chapters + %s,
+                        total_topics = s.total_topics + %s,
+                        total_subtopics = s.total_subtopics + %s,
+                        updated_at = CURRENT_TIMESTAMP
+                    FROM pdfs p
+                    WHERE p.pdfid = %s AND s.username = p.username
+                    """,
+                    (total_chapters, total_topics, total_subtopics, pdf_id),
+                )
+
                 conn.commit()
                 logger.info(f"Successfully created structure for PDF {pdf_id}")
 
@@ -614,8 +1337,13 @@ class DatabaseManager:
         topic_id: int,
         subtopics: List[Dict],
         parent_id: Optional[int] = None,
-    ) -> None:
-        """Recursively create subtopics with proper parent-child relationships."""
+    ) -> int:
+        """Recursively create subtopics with proper parent-child relationships.
+
+        Returns:
+            int: Number of subtopic rows inserted, including nested ones
+        """
+        created = 0
         for subtopic in subtopics:
             if isinstance(subtopic, dict):
                 # Create the subtopic
@@ -628,6 +1356,7 @@ class DatabaseManager:
                     (topic_id, subtopic["name"], parent_id),
                 )
                 subtopic_id = cur.fetchone()[0]
+                created += 1
 
                 # Recursively process nested subtopics if they exist
                 if "subtopics" in subtopic and subtopic["subtopics"]:
@@ -640,7 +1369,9 @@ class DatabaseManager:
                         else:
                             nested_subtopics.append(nested)
 
-                    self._create_subtopics(cur, topic_id, nested_subtopics, subtopic_id)
+                    created += self._create_subtopics(
+                        cur, topic_id, nested_subtopics, subtopic_id
+                    )
             elif isinstance(subtopic, str):
                 # Handle string subtopics
                 cur.execute(
@@ -651,17 +1382,20 @@ class DatabaseManager:
                     """,
                     (topic_id, subtopic, parent_id),
                 )
+                created += 1
+
+        return created
 
     def get_pdf_info(self, pdf_id: int) -> Optional[Dict]:
         """Get PDF information."""
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
                     """
                     SELECT pdf_path, username, title
                     FROM pdfs
-                    WHERE pdfid = %s
+                    WHERE pdfid = %s AND deleted_at IS NULL
                     """,
                     (pdf_id,),
                 )
@@ -678,7 +1412,7 @@ class DatabaseManager:
         with self.get_connection() as conn:
             cur = conn.cursor()
             try:
-                cur.execute("DELETE FROM pdfs WHERE pdfid = %s", (pdf_id,))
+                self._delete_pdf_row(cur, pdf_id)
                 conn.commit()
                 logger.info(f"Deleted PDF record with ID: {pdf_id}")
             except Exception as e:
@@ -688,9 +1422,220 @@ class DatabaseManager:
             finally:
                 cur.close()
 
+    def soft_delete_pdf(self, pdf_id: int) -> bool:
+        """Mark a PDF deleted and take its content off the owner's counters.
+
+        The PDF disappears from every query at once; its rows and files are
+        removed later, in batches, by FileService.reclaim_deleted_pdfs.
+
+        Returns:
+            bool: False if the PDF does not exist or is already deleted
+        """
+        with self.get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                counts = self._pdf_counts(cur, pdf_id)
+                if counts is None:
+                    conn.rollback()
+                    return False
+                cur.execute(
+                    "UPDATE pdfs SET deleted_at = CURRENT_TIMESTAMP WHERE pdfid = %s",
+                    (pdf_id,),
+                )
+                self._subtract_pdf_counts(cur, counts)
+                conn.commit()
+                logger.info(f"Marked PDF {pdf_id} deleted")
+                return True
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error soft-deleting PDF: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def get_deleted_pdfs(self, limit: int) -> List[Dict]:
+        """Soft-deleted PDFs waiting for reclamation, oldest first.
+
+        Returns:
+            List[Dict]: ``pdfid``, ``pdf_path``, ``username`` and the stored
+            ``gemini_file`` (or None)
+        """
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cur.execute(
+                    """
+                    SELECT p.pdfid, p.pdf_path, p.username, g.gemini_file
+                    FROM pdfs p
+                    LEFT JOIN pdf_gemini_files g ON g.pdfid = p.pdfid
+                    WHERE p.deleted_at IS NOT NULL
+                    ORDER BY p.deleted_at
+                    LIMIT %s
+                    """,
+                    (limit,),
+                )
+                return cur.fetchall()
+            except Exception as e:
+                logger.error(f"Database error in get_deleted_pdfs: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def get_pdf_paths(self, username: str) -> List[str]:
+        """Paths of a user's PDFs that are not deleted, used to spare their files."""
+        with self.get_connection(readonly=True, primary=True) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    """
+                    SELECT pdf_path
+                    FROM pdfs
+                    WHERE username = %s AND deleted_at IS NULL
+                    """,
+                    (username,),
+                )
+                return [row[0] for row in cur.fetchall()]
+            except Exception as e:
+                logger.error(f"Database error in get_pdf_paths: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def purge_pdf_rows(self, pdf_id: int, batch_size: int) -> int:
+        """Delete a soft-deleted PDF's rows, committing every batch_size rows.
+
+        Subtopics, then topics, then chapters are deleted in separate short
+        transactions (their notes go with them by cascade), so removing a
+        large book never holds locks or builds WAL for one huge transaction.
+        The pdfs row goes last, which makes an interrupted purge resumable.
+
+        Returns:
+            int: Number of rows deleted
+        """
+        batches = [
+            """
+            DELETE FROM subtopics WHERE subtopicid IN (
+                SELECT s.subtopicid
+                FROM subtopics s
+                JOIN topics t ON s.topicid = t.topicid
+                JOIN chapters c ON t.chapterid = c.chapterid
+                WHERE c.pdfid = %s
+                LIMIT %s
+            )
+            """,
+            """
+            DELETE FROM topics WHERE topicid IN (
+                SELECT t.topicid
+                FROM topics t
+                JOIN chapters c ON t.chapterid = c.chapterid
+                WHERE c.pdfid = %s
+                LIMIT %s
+            )
+            """,
+            """
+            DELETE FROM chapters WHERE chapterid IN (
+                SELECT chapterid FROM chapters WHERE pdfid = %s LIMIT %s
+            )
+            """,
+        ]
+        deleted = 0
+        with self.get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                for query in batches:
+                    while True:
+                        cur.execute(query, (pdf_id, batch_size))
+                        count = cur.rowcount
+                        conn.commit()
+                        deleted += count
+                        if count < batch_size:
+                            break
+                cur.execute(
+                    "DELETE FROM pdfs WHERE pdfid = %s AND deleted_at IS NOT NULL",
+                    (pdf_id,),
+                )
+                deleted += cur.rowcount
+                conn.commit()
+                logger.info(f"Purged {deleted} rows of deleted PDF {pdf_id}")
+                return deleted
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error purging PDF rows: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def _delete_pdf_row(self, cur: Any, pdf_id: int) -> None:
+        """Delete a PDF row and subtract its content from the owner's counters.
+
+        A soft-deleted PDF was already subtracted when it was marked deleted.
+        """
+        counts = self._pdf_counts(cur, pdf_id)
+        cur.execute("DELETE FROM pdfs WHERE pdfid = %s", (pdf_id,))
+        if counts:
+            self._subtract_pdf_counts(cur, counts)
+
+    def _pdf_counts(self, cur: Any, pdf_id: int) -> Optional[Tuple]:
+        """Lock a live PDF row and count its content for the owner's counters.
+
+        Returns:
+            Optional[Tuple]: (username, chapters, topics, subtopics), or None
+            if the PDF does not exist or is already deleted
+        """
+        cur.execute(
+            """
+            SELECT
+                p.username,
+                (SELECT COUNT(*) FROM chapters c WHERE c.pdfid = p.pdfid),
+                (
+                    SELECT COUNT(*)
+                    FROM topics t
+                    JOIN chapters c ON t.chapterid = c.chapterid
+                    WHERE c.pdfid = p.pdfid
+                ),
+                (
+                    SELECT COUNT(*)
+                    FROM subtopics s
+                    JOIN topics t ON s.topicid = t.topicid
+                    JOIN chapters c ON t.chapterid = c.chapterid
+                    WHERE c.pdfid = p.pdfid
+                )
+            FROM pdfs p
+            WHERE p.pdfid = %s AND p.deleted_at IS NULL
+            FOR UPDATE
+            """,
+            (pdf_id,),
+        )
+        return cur.fetchone()
+
+    def _subtract_pdf_counts(self, cur: Any, counts: Tuple) -> None:
+        """Take a removed PDF's content off its owner's counters.
+
+        Quiz counts are left to reconcile_user_stats, since quizzes are keyed
+        by chapter name and may still match another of the user's books.
+        """
+        username, chapters, topics, subtopics = counts
+        cur.execute(
+            """
+            UPDATE user_stats
+            SET total_pdfs = GREATEST(total_pdfs - 1, 0),
+                total_chapters = GREATEST(total_chapters - %s, 0),
+                total_topics = GREATEST(total_topics - %s, 0),
+                total_subtopics = GREATEST(total_subtopics - %s, 0),
+                last_upload = (
+                    SELECT MAX(created_at)
+                    FROM pdfs
+                    WHERE username = %s AND deleted_at IS NULL
+                ),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE username = %s
+            """,
+            (chapters, topics, subtopics, username, username),
+        )
+
     def get_chapter_content(self, chapter_name: str) -> Optional[Dict]:
         """Get all content for a chapter including topics and subtopics."""
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
@@ -700,7 +1645,7 @@ class DatabaseManager:
                         json_agg(
                             json_build_object(
                                 'topic', t.topicname,
-                                'notes', t.notes,
+                                'notes', n.notes,
                                 'subtopics', (
                                     SELECT json_agg(s.subtopicname)
                                     FROM subtopics s
@@ -709,7 +1654,9 @@ class DatabaseManager:
                             )
                         ) as topics
                     FROM chapters c
+                    JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
                     LEFT JOIN topics t ON c.chapterid = t.chapterid
+                    LEFT JOIN topic_notes n ON n.topicid = t.topicid
                     WHERE c.chaptername = %s
                     GROUP BY c.chapterid, c.chaptername
                 """,
@@ -726,7 +1673,7 @@ class DatabaseManager:
 
     def get_chapter_info(self, chapter_name: str) -> Optional[Dict]:
         """Get chapter information including PDF path."""
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
@@ -735,9 +1682,10 @@ class DatabaseManager:
                         c.chapterid,
                         c.chaptername,
                         p.pdf_path,
-                        p.pdfid
+                        p.pdfid,
+                        p.username
                     FROM chapters c
-                    JOIN pdfs p ON c.pdfid = p.pdfid
+                    JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
                     WHERE c.chaptername = %s
                 """,
                     (chapter_name,),
@@ -753,7 +1701,7 @@ class DatabaseManager:
 
     def get_pdf_structure(self, pdf_id: int) -> Dict:
         """Get complete PDF structure with properly nested subtopics."""
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
@@ -883,56 +1831,260 @@ class DatabaseManager:
         with self.get_connection() as conn:
             cur = conn.cursor()
             try:
-                cur.execute("DELETE FROM pdfs WHERE pdf_path = %s", (pdf_path,))
+                cur.execute("SELECT pdfid FROM pdfs WHERE pdf_path = %s", (pdf_path,))
+                for (pdf_id,) in cur.fetchall():
+                    self._delete_pdf_row(cur, pdf_id)
                 conn.commit()
                 logger.info(f"Deleted PDF record for {pdf_path}")
             finally:
                 cur.close()
 
-    def store_quiz_questions(self, chapter: str, questions: List[Dict]) -> int:
-        """Store quiz questions and return quiz ID."""
+    def store_quiz_questions(
+        self, chapter: str, questions: List[Dict], pooled: bool = False
+    ) -> int:
+        """Store quiz questions and return quiz ID.
+
+        Args:
+            chapter: Chapter name the quiz belongs to
+            questions: Generated questions with options, answer and explanation
+            pooled: Keep the quiz in the chapter's pool of unserved variants
+
+        Returns:
+            int: ID of the new quiz
+        """
         with self.get_connection() as conn:
             cur = conn.cursor()
             try:
                 # First create a quiz record
                 cur.execute(
                     """
-                    INSERT INTO quizzes (chapter, created_at)
-                    VALUES (%s, CURRENT_TIMESTAMP)
+                    INSERT INTO quizzes (chapter, created_at, pooled)
+                    VALUES (%s, CURRENT_TIMESTAMP, %s)
                     RETURNING quizid
                     """,
-                    (chapter,),
+                    (chapter, pooled),
                 )
                 quiz_id = cur.fetchone()[0]
 
-                # Store each question
-                for question in questions:
-                    cur.execute(
-                        """
-                        INSERT INTO quiz_questions 
-                        (quizid, question_text, options, correct_answer, explanation)
-                        VALUES (%s, %s, %s, %s, %s)
-                        """,
+                # Store all questions in a single multi-row insert
+                stored = execute_values(
+                    cur,
+                    """
+                    INSERT INTO quiz_questions 
+                    (quizid, question_text, options, correct_answer, explanation)
+                    VALUES %s
+                    RETURNING questionid, correct_answer, explanation
+                    """,
+                    [
                         (
                             quiz_id,
                             question["question"],
                             json.dumps(question["options"]),
                             question["correct_answer"],
                             question.get("explanation", ""),
-                        ),
-                    )
+                        )
+                        for question in questions
+                    ],
+                    fetch=True,
+                )
+
+                # Every generated question also feeds the chapter's question bank
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO question_bank
+                    (chapter, difficulty, question_text, options, correct_answer, explanation)
+                    VALUES %s
+                    ON CONFLICT (chapter, question_text) DO NOTHING
+                    """,
+                    [
+                        (
+                            chapter,
+                            question.get("difficulty", "medium"),
+                            question["question"],
+                            json.dumps(question["options"]),
+                            question["correct_answer"],
+                            question.get("explanation", ""),
+                        )
+                        for question in questions
+                    ],
+                )
+
+                # Pooled variants are counted when they are served
+                if not pooled:
+                    self._count_quiz_for_owners(cur, chapter)
 
                 conn.commit()
+
+                self.quiz_answers_cache.set(
+                    quiz_id,
+                    [
+                        {
+                            "questionid": questionid,
+                            "correct_answer": correct_answer,
+                            "explanation": explanation,
+                        }
+                        for questionid, correct_answer, explanation in sorted(stored)
+                    ],
+                )
                 return quiz_id
 
             except Exception as e:
                 conn.rollback()
                 logger.error(f"Error storing quiz: {str(e)}")
                 raise
+            finally:
+                cur.close()
+
+    def _count_quiz_for_owners(self, cur: Any, chapter: str) -> None:
+        """Count a served quiz towards every user owning a chapter of that name."""
+        cur.execute(
+            """
+            UPDATE user_stats
+            SET total_quizzes = total_quizzes + 1,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE username IN (
+                SELECT p.username
+                FROM chapters c
+                JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
+                WHERE c.chaptername = %s
+            )
+            """,
+            (chapter,),
+        )
+
+    def pop_pooled_quiz(self, chapter: str) -> Optional[Dict]:
+        """Take the oldest pre-generated quiz out of a chapter's pool.
+
+        The quiz becomes the chapter's latest quiz. Concurrent callers never
+        receive the same variant.
+
+        Returns:
+            Optional[Dict]: ``quizid`` and its ``questions`` (without answers),
+            or None if the pool is empty
+        """
+        with self.get_connection() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cur.execute(
+                    """
+                    WITH popped AS (
+                        UPDATE quizzes
+                        SET pooled = FALSE,
+                            created_at = CURRENT_TIMESTAMP
+                        WHERE quizid = (
+                            SELECT quizid
+                            FROM quizzes
+                            WHERE chapter = %s AND pooled
+                            ORDER BY created_at
+                            LIMIT 1
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING quizid
+                    )
+                    SELECT 
+                        p.quizid,
+                        COALESCE(
+                            (
+                                SELECT json_agg(
+                                    json_build_object(
+                                        'questionid', qq.questionid,
+                                        'question', qq.question_text,
+                                        'options', qq.options::json
+                                    ) ORDER BY qq.questionid
+                                )
+                                FROM quiz_questions qq
+                                WHERE qq.quizid = p.quizid
+                            ),
+                            '[]'::json
+                        ) as questions
+                    FROM popped p
+                    """,
+                    (chapter,),
+                )
+                quiz = cur.fetchone()
+                if quiz:
+                    self._count_quiz_for_owners(cur, chapter)
+                conn.commit()
+                return quiz
+
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error popping pooled quiz: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def count_pooled_quizzes(self, chapter: str) -> int:
+        """Count unserved pre-generated quizzes for a chapter."""
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    "SELECT COUNT(*) FROM quizzes WHERE chapter = %s AND pooled",
+                    (chapter,),
+                )
+                return cur.fetchone()[0]
+            except Exception as e:
+                logger.error(f"Error counting pooled quizzes: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
+    def sample_question_bank(
+        self, chapter: str, per_level: int
+    ) -> Optional[List[Dict]]:
+        """Randomly sample stored questions for a chapter, per_level per difficulty.
+
+        Returns:
+            Optional[List[Dict]]: Questions ordered easy, medium, hard, or None
+            if the bank does not hold enough questions at every level
+        """
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cur.execute(
+                    """
+                    SELECT 
+                        question_text as question,
+                        options::json as options,
+                        correct_answer,
+                        explanation,
+                        difficulty
+                    FROM (
+                        SELECT 
+                            b.*,
+                            ROW_NUMBER() OVER (
+                                PARTITION BY b.difficulty ORDER BY random()
+                            ) as pick
+                        FROM question_bank b
+                        WHERE b.chapter = %s
+                    ) sampled
+                    WHERE pick <= %s
+                    ORDER BY 
+                        CASE difficulty
+                            WHEN 'easy' THEN 1
+                            WHEN 'medium' THEN 2
+                            ELSE 3
+                        END,
+                        pick
+                    """,
+                    (chapter, per_level),
+                )
+                questions = cur.fetchall()
+                if len(questions) < 3 * per_level:
+                    return None
+                return questions
+
+            except Exception as e:
+                logger.error(f"Error sampling question bank: {str(e)}")
+                raise
+            finally:
+                cur.close()
 
     def get_quiz_questions(self, quiz_id: int) -> List[Dict]:
         """Get quiz questions without answers."""
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
@@ -949,10 +2101,16 @@ class DatabaseManager:
             except Exception as e:
                 logger.error(f"Error getting quiz questions: {str(e)}")
                 raise
+            finally:
+                cur.close()
 
     def get_quiz_answers(self, quiz_id: int) -> List[Dict]:
         """Get quiz answers and explanations."""
-        with self.get_connection() as conn:
+        cached = self.quiz_answers_cache.get(quiz_id)
+        if cached is not None:
+            return cached
+
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
@@ -964,22 +2122,28 @@ class DatabaseManager:
                     """,
                     (quiz_id,),
                 )
-                return cur.fetchall()
+                answers = [dict(row) for row in cur.fetchall()]
+                # An unknown quiz id may still be in the middle of being stored
+                if answers:
+                    self.quiz_answers_cache.set(quiz_id, answers)
+                return answers
 
             except Exception as e:
                 logger.error(f"Error getting quiz answers: {str(e)}")
                 raise
+            finally:
+                cur.close()
 
     def get_latest_quiz(self, chapter: str) -> Optional[Dict]:
         """Get the most recent quiz for a chapter."""
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
                     """
                     SELECT q.quizid, q.created_at
                     FROM quizzes q
-                    WHERE q.chapter = %s
+                    WHERE q.chapter = %s AND NOT q.pooled
                     ORDER BY q.created_at DESC
                     LIMIT 1
                     """,
@@ -989,9 +2153,56 @@ class DatabaseManager:
             except Exception as e:
                 logger.error(f"Error getting latest quiz: {str(e)}")
                 raise
+            finally:
+                cur.close()
+
+    def get_latest_quiz_with_questions(self, chapter: str) -> Optional[Dict]:
+        """Get the most recent quiz for a chapter together with its questions.
+
+        Returns:
+            Optional[Dict]: ``quizid`` and a ``questions`` list (without
+            answers), or None if the chapter has no quiz yet
+        """
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cur.execute(
+                    """
+                    SELECT 
+                        q.quizid,
+                        COALESCE(
+                            (
+                                SELECT json_agg(
+                                    json_build_object(
+                                        'questionid', qq.questionid,
+                                        'question', qq.question_text,
+                                        'options', qq.options::json
+                                    ) ORDER BY qq.questionid
+                                )
+                                FROM quiz_questions qq
+                                WHERE qq.quizid = q.quizid
+                            ),
+                            '[]'::json
+                        ) as questions
+                    FROM quizzes q
+                    WHERE q.chapter = %s AND NOT q.pooled
+                    ORDER BY q.created_at DESC
+                    LIMIT 1
+                    """,
+                    (chapter,),
+                )
+                return cur.fetchone()
+            except Exception as e:
+                logger.error(f"Error getting latest quiz with questions: {str(e)}")
+                raise
+            finally:
+                cur.close()
 
     def check_connection_health(self):
         """Check if connection pool is healthy and reconnect if needed."""
+        for replica in self.replicas:
+            self._check_replica_health(replica)
+
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
@@ -1005,9 +2216,42 @@ class DatabaseManager:
                 logger.error(f"Failed to recreate pool during health check: {str(e)}")
             return False
 
+    def _check_replica_health(self, replica: PoolEndpoint) -> None:
+        """Probe a replica, ejecting it on failure and re-admitting it on success."""
+        if not replica.pool:
+            self._create_replica_pool(replica)
+            return
+
+        conn = None
+        try:
+            conn = replica.pool.getconn()
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            if replica.ejected_until:
+                logger.info(f"Re-admitting {replica.name} to read rotation")
+            replica.ejected_until = 0.0
+        except Exception as e:
+            logger.error(f"Health check failed for {replica.name}: {str(e)}")
+            replica.errors += 1
+            if conn:
+                try:
+                    replica.pool.putconn(conn, close=True)
+                except Exception:
+                    pass
+                conn = None
+            replica.eject(self.replica_ejection_seconds)
+            self._create_replica_pool(replica)
+        finally:
+            if conn:
+                replica.pool.putconn(conn)
+
     def get_user_profile(self, username: str) -> Dict:
-        """Get detailed user profile information."""
-        with self.get_connection() as conn:
+        """Get detailed user profile information.
+
+        Counters come from the user_stats row, so this is a single
+        primary-key lookup regardless of library size.
+        """
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
@@ -1018,17 +2262,15 @@ class DatabaseManager:
                         u.email,
                         u.created_at,
                         u.last_login,
-                        COUNT(DISTINCT p.pdfid) as total_pdfs,
-                        COUNT(DISTINCT c.chapterid) as total_chapters,
-                        COUNT(DISTINCT t.topicid) as total_topics,
-                        COUNT(DISTINCT s.subtopicid) as total_subtopics
+                        COALESCE(s.total_pdfs, 0) as total_pdfs,
+                        COALESCE(s.total_chapters, 0) as total_chapters,
+                        COALESCE(s.total_topics, 0) as total_topics,
+                        COALESCE(s.total_subtopics, 0) as total_subtopics,
+                        COALESCE(s.total_quizzes, 0) as total_quizzes,
+                        s.last_upload
                     FROM users u
-                    LEFT JOIN pdfs p ON u.username = p.username
-                    LEFT JOIN chapters c ON p.pdfid = c.pdfid
-                    LEFT JOIN topics t ON c.chapterid = t.chapterid
-                    LEFT JOIN subtopics s ON t.topicid = s.topicid
+                    LEFT JOIN user_stats s ON s.username = u.username
                     WHERE u.username = %s
-                    GROUP BY u.userid, u.username, u.email, u.created_at, u.last_login
                     """,
                     (username,),
                 )
@@ -1038,40 +2280,123 @@ class DatabaseManager:
 
     def get_user_detailed_statistics(self, username: str) -> Dict:
         """Get detailed user activity statistics."""
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 cur.execute(
                     """
-                    WITH pdf_stats AS (
-                        SELECT 
-                            COUNT(*) as total_pdfs,
-                            MAX(created_at) as last_upload
-                        FROM pdfs
-                        WHERE username = %s
-                    ),
-                    quiz_stats AS (
-                        SELECT 
-                            COUNT(DISTINCT q.quizid) as total_quizzes
-                        FROM quizzes q
-                        WHERE q.chapter IN (
-                            SELECT DISTINCT c.chaptername 
-                            FROM chapters c 
-                            JOIN pdfs p ON c.pdfid = p.pdfid 
-                            WHERE p.username = %s
-                        )
-                    )
                     SELECT 
-                        pdf_stats.*,
-                        quiz_stats.*
-                    FROM pdf_stats, quiz_stats
+                        COALESCE(MAX(s.total_pdfs), 0) as total_pdfs,
+                        MAX(s.last_upload) as last_upload,
+                        COALESCE(MAX(s.total_quizzes), 0) as total_quizzes
+                    FROM user_stats s
+                    WHERE s.username = %s
                     """,
-                    (username, username),
+                    (username,),
                 )
                 return cur.fetchone()
             finally:
                 cur.close()
 
+    def reconcile_user_stats(self) -> int:
+        """Recompute every user's counters from the source tables.
+
+        Repairs drift in user_stats left by failed writes, manual edits or
+        the chapter-name based quiz attribution.
+
+        Returns:
+            int: Number of user_stats rows that were corrected
+        """
+        with self.get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    INSERT INTO user_stats (
+                        username, total_pdfs, total_chapters, total_topics,
+                        total_subtopics, total_quizzes, last_upload, updated_at
+                    )
+                    SELECT
+                        u.username,
+                        COALESCE(p.total_pdfs, 0),
+                        COALESCE(c.total_chapters, 0),
+                        COALESCE(t.total_topics, 0),
+                        COALESCE(s.total_subtopics, 0),
+                        COALESCE(q.total_quizzes, 0),
+                        p.last_upload,
+                        CURRENT_TIMESTAMP
+                    FROM users u
+                    LEFT JOIN (
+                        SELECT username, COUNT(*) AS total_pdfs,
+                               MAX(created_at) AS last_upload
+                        FROM pdfs
+                        WHERE deleted_at IS NULL
+                        GROUP BY username
+                    ) p ON p.username = u.username
+                    LEFT JOIN (
+                        SELECT p.username, COUNT(*) AS total_chapters
+                        FROM chapters c
+                        JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
+                        GROUP BY p.username
+                    ) c ON c.username = u.username
+                    LEFT JOIN (
+                        SELECT p.username, COUNT(*) AS total_topics
+                        FROM topics t
+                        JOIN chapters c ON t.chapterid = c.chapterid
+                        JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
+                        GROUP BY p.username
+                    ) t ON t.username = u.username
+                    LEFT JOIN (
+                        SELECT p.username, COUNT(*) AS total_subtopics
+                        FROM subtopics s
+                        JOIN topics t ON s.topicid = t.topicid
+                        JOIN chapters c ON t.chapterid = c.chapterid
+                        JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
+                        GROUP BY p.username
+                    ) s ON s.username = u.username
+                    LEFT JOIN (
+                        SELECT p.username, COUNT(DISTINCT q.quizid) AS total_quizzes
+                        FROM quizzes q
+                        JOIN chapters c ON q.chapter = c.chaptername
+                        JOIN pdfs p ON c.pdfid = p.pdfid AND p.deleted_at IS NULL
+                        WHERE NOT q.pooled
+                        GROUP BY p.username
+                    ) q ON q.username = u.username
+                    ON CONFLICT (username) DO UPDATE
+                    SET total_pdfs = EXCLUDED.total_pdfs,
+                        total_chapters = EXCLUDED.total_chapters,
+                        total_topics = EXCLUDED.total_topics,
+                        total_subtopics = EXCLUDED.total_subtopics,
+                        total_quizzes = EXCLUDED.total_quizzes,
+                        last_upload = EXCLUDED.last_upload,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE (
+                        user_stats.total_pdfs,
+                        user_stats.total_chapters,
+                        user_stats.total_topics,
+                        user_stats.total_subtopics,
+                        user_stats.total_quizzes,
+                        user_stats.last_upload
+                    ) IS DISTINCT FROM (
+                        EXCLUDED.total_pdfs,
+                        EXCLUDED.total_chapters,
+                        EXCLUDED.total_topics,
+                        EXCLUDED.total_subtopics,
+                        EXCLUDED.total_quizzes,
+                        EXCLUDED.last_upload
+                    )
+                    """)
+                repaired = cur.rowcount
+                conn.commit()
+                if repaired:
+                    logger.warning(f"Reconciled user_stats for {repaired} users")
+                return repaired
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error reconciling user stats: {str(e)}")
+                raise
+            finally:
+                cur.close()
+
     def update_user_profile(self, username: str, updates: Dict) -> None:
         """Update user profile information."""
         with self.get_connection() as conn:
@@ -1095,17 +2420,3 @@ class DatabaseManager:
                 raise
             finally:
                 cur.close()
-
-
-# Password hashing settings
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
-# Function to hash password
-def hash_password(password: str):
-    return pwd_context.hash(password)
-
-
-# Function to verify hashed password
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
@@ -1,29 +1,46 @@
 import logging
+import re
 from pathlib import Path
 from typing import List, Optional
 import shutil
 import os
+import uuid
 from fastapi import UploadFile
+from storage import QuotaExceededError, archived_folders, use_folder
+from tracing import traced
 
 logger = logging.getLogger(__name__)
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
+
+@traced()
 async def save_uploaded_file(
-    upload_file: UploadFile, username: str, filename: str
+    upload_file: UploadFile,
+    username: str,
+    filename: str,
+    max_bytes: Optional[int] = None,
 ) -> Path:
     """Save uploaded file to disk.
 
+    The upload is written to a temporary file beside the destination and
+    moved into place only once complete, so an existing file of the same
+    name is left untouched if the upload fails.
+
     Args:
         upload_file: The uploaded file from FastAPI
         username: Username for creating user directory
         filename: Name to save the file as
+        max_bytes: Stop and discard the upload once it grows past this size
 
     Returns:
         Path: Path where the file was saved
 
     Raises:
+        QuotaExceededError: If the file is larger than max_bytes
         ValueError: If file saving fails
     """
+    tmp_path = None
     try:
         # Create user directory if it doesn't exist
         upload_dir = Path("uploads") / username
@@ -31,28 +48,62 @@ async def save_uploaded_file(
 
         # Create file path
         file_path = upload_dir / filename
-
-        # Read file content
-        content = await upload_file.read()
-
-        # Write to disk
-        with open(file_path, "wb") as f:
-            f.write(content)
+        tmp_path = upload_dir / f".{filename}.{uuid.uuid4().hex}.part"
+
+        # Copy in chunks so large uploads are never held in memory at once
+        written = 0
+        with open(tmp_path, "wb") as f:
+            while chunk := await upload_file.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if max_bytes is not None and written > max_bytes:
+                    raise QuotaExceededError(
+                        f"Storage quota exceeded: upload is larger than the "
+                        f"{max_bytes} bytes left"
+                    )
+                f.write(chunk)
+        os.replace(tmp_path, file_path)
 
         logger.info(f"Saved file: {file_path}")
         return file_path
 
+    except QuotaExceededError:
+        tmp_path.unlink(missing_ok=True)
+        raise
     except Exception as e:
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
         logger.error(f"Error saving file: {str(e)}")
         raise ValueError(f"Failed to save file: {str(e)}")
 
 
+def image_folders(username: str, base_folder: str) -> List[Path]:
+    """Extracted-image folders of a user's PDF.
+
+    Images are written to uploads/<user>/images/<pdf stem>_<8 hex digits>.
+    The suffix is matched exactly so that e.g. "book" does not also pick up
+    the folders of "book_20240101_120000".
+    """
+    user_images_path = Path("uploads") / username / "images"
+    if not user_images_path.is_dir():
+        return []
+    pattern = re.compile(rf"{re.escape(base_folder)}_[0-9a-f]{{8}}")
+    return sorted(
+        folder
+        for folder in user_images_path.iterdir()
+        if folder.is_dir() and pattern.fullmatch(folder.name)
+    )
+
+
+@traced()
 def get_image_files(
     username: str, pdf_path: Path, base_folder: str
 ) -> Optional[List[str]]:
     """Get list of image files for a PDF."""
-    user_images_path = Path("uploads") / username / "images"
-    matching_folders = list(user_images_path.glob(f"{base_folder}_*"))
+    matching_folders = image_folders(username, base_folder) or [
+        folder
+        for folder in archived_folders(username, base_folder)
+        if use_folder(folder)
+    ]
 
     if not matching_folders:
         logger.warning(f"No image folder found for PDF: {pdf_path}")
@@ -0,0 +1,55 @@
+"""Gunicorn settings for serving the app with several worker processes.
+
+    gunicorn main:app -c gunicorn.conf.py
+
+Every value can be overridden from the environment. Each worker builds its
+own AppContainer (database pool, Gemini client, executors) after the fork,
+and the per-process caches are only ever used as validated copies, so no
+state needs to be shared between workers beyond Postgres and the session
+cookie.
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Requests can wait on Gemini for a long time
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Restart a worker after this many requests (0 never restarts)
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+
+# Not preloaded: each worker must open its own connections after the fork
+preload_app = False
+
+# "-" logs requests to stdout, an empty value turns the access log off
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-") or None
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+# Workers write metrics samples here so any worker can serve /metrics for all
+# of them. Set before the workers import prometheus_client.
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "prometheus")
+)
+
+
+def on_starting(server):
+    """Start with no samples left over from a previous run."""
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges from /metrics."""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
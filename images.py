@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIR = Path("uploads")
+
+# Rendition widths in pixels; requests for any other width are rejected
+RENDITION_WIDTHS = tuple(
+    sorted(
+        int(width)
+        for width in os.getenv("IMAGE_RENDITION_WIDTHS", "320,960").split(",")
+        if width.strip()
+    )
+)
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg"}
+
+# Source content hash keyed by (path, mtime, size), so files are hashed once
+_source_hashes = LRUCache(maxsize=4096)
+
+
+def source_hash(path: Path) -> str:
+    """Short content hash of an extracted image, used to version its renditions."""
+    stat = path.stat()
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    digest = _source_hashes.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()[:16]
+        _source_hashes.set(key, digest)
+    return digest
+
+
+def source_path(username: str, folder: str, filename: str) -> Optional[Path]:
+    """Path of an extracted image, or None if the parts escape the uploads dir."""
+    parts = (username, folder, filename)
+    if any(part.startswith(".") or "/" in part for part in parts):
+        return None
+    return UPLOADS_DIR / username / "images" / folder / filename
+
+
+def rendition_path(source: Path, digest: str, width: int) -> Path:
+    """Where the rendition of a source image at a given width is stored."""
+    return source.parent / ".renditions" / f"{source.stem}.{digest}.{width}.jpg"
+
+
+def rendition_url(
+    username: str, folder: str, filename: str, digest: str, width: int
+) -> str:
+    """Content-addressed URL of a rendition; safe to cache forever."""
+    return f"/renditions/{username}/{folder}/{width}/{digest}/{filename}"
+
+
+def render(source: Path, width: int, destination: Path) -> Path:
+    """Write a JPEG copy of source scaled down to at most width pixels wide.
+
+    Runs in the image process pool. Images already narrower than width are
+    re-encoded at their own size rather than upscaled.
+    """
+    import fitz  # PyMuPDF
+
+    pix = fitz.Pixmap(str(source))
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.colorspace is None or pix.colorspace.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    if pix.width > width:
+        pix = fitz.Pixmap(pix, width, round(pix.height * width / pix.width), None)
+
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename so a concurrent reader never sees a partial file
+    partial = destination.with_name(f"{destination.name}.{os.getpid()}.tmp")
+    partial.write_bytes(pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY))
+    partial.replace(destination)
+    return destination
+
+
+def create_renditions(folder: Path) -> int:
+    """Render every width for every image in an extracted-images folder.
+
+    Runs in the image process pool after extraction. Images that fail to
+    render are logged and left to lazy generation.
+
+    Returns:
+        Number of renditions written
+    """
+    written = 0
+    for source in sorted(folder.iterdir()):
+        if source.suffix.lower() not in IMAGE_SUFFIXES:
+            continue
+        try:
+            digest = source_hash(source)
+            for width in RENDITION_WIDTHS:
+                destination = rendition_path(source, digest, width)
+                if not destination.exists():
+                    render(source, width, destination)
+                    written += 1
+        except Exception as e:
+            logger.error(f"Error rendering {source}: {str(e)}")
+    logger.info(f"Wrote {written} image renditions in {folder}")
+    return written
+
+
+def image_links(username: str, folder: str, images: List[Dict]) -> List[Dict]:
+    """Add rendition URLs to the images attached to a note.
+
+    Each image gets "src" (the largest rendition), "thumb" (the smallest),
+    "srcset" and "original". Images whose file is missing are returned as-is.
+    """
+    linked = []
+    for image in images:
+        filename = image.get("filename") if isinstance(image, dict) else None
+        source = source_path(username, folder, filename) if filename else None
+        if source is None or not source.is_file():
+            linked.append(image)
+            continue
+
+        digest = source_hash(source)
+        urls: List[Tuple[int, str]] = [
+            (width, rendition_url(username, folder, filename, digest, width))
+            for width in RENDITION_WIDTHS
+        ]
+        linked.append(
+            {
+                **image,
+                "src": urls[-1][1],
+                "thumb": urls[0][1],
+                "srcset": ", ".join(f"{url} {width}w" for width, url in urls),
+                "original": f"/images/{username}/images/{folder}/{filename}",
+            }
+        )
+    return linked
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range "bytes=" Range header into inclusive offsets.
+
+    Returns:
+        (start, end), or None when the header asks for several ranges or is
+        malformed, in which case the whole file is sent
+
+    Raises:
+        ValueError: If the range cannot be satisfied (416)
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    first, _, last = spec.strip().partition("-")
+    if not (first + last).isdigit():
+        return None
+
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, end
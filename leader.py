@@ -0,0 +1,82 @@
+import logging
+import threading
+from typing import Callable
+
+from db import PoolEndpoint
+
+logger = logging.getLogger(__name__)
+
+# pg advisory lock key shared by every worker of the app ("tbai")
+SCHEDULER_LOCK_ID = 0x74626169
+
+
+class LeaderElection:
+    """Elect one worker process to run singleton jobs, via a Postgres advisory lock.
+
+    The leader holds a session-level advisory lock on a dedicated connection
+    for as long as that connection lives. If the leader exits or loses its
+    connection, Postgres releases the lock and the next worker to call
+    is_leader() takes over.
+    """
+
+    def __init__(
+        self,
+        endpoint: Callable[[], PoolEndpoint],
+        lock_id: int = SCHEDULER_LOCK_ID,
+    ):
+        """
+        Args:
+            endpoint: Returns the primary endpoint; called on each election so
+                the database is only contacted once elections start
+            lock_id: Advisory lock key, the same in every worker
+        """
+        self.endpoint = endpoint
+        self.lock_id = lock_id
+        self.conn = None
+        self._lock = threading.Lock()
+
+    def is_leader(self) -> bool:
+        """Check that this worker still holds the lock, trying to take it if not."""
+        with self._lock:
+            if self.conn is not None:
+                try:
+                    with self.conn.cursor() as cur:
+                        cur.execute("SELECT 1")
+                    return True
+                except Exception as e:
+                    logger.error(f"Lost scheduler leadership: {str(e)}")
+                    self._close()
+
+            conn = None
+            try:
+                conn = self.endpoint().connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_try_advisory_lock(%s)", (self.lock_id,))
+                    acquired = cur.fetchone()[0]
+            except Exception as e:
+                logger.error(f"Scheduler leader election failed: {str(e)}")
+                acquired = False
+
+            if not acquired:
+                if conn is not None:
+                    conn.close()
+                return False
+
+            logger.info("This worker is now the scheduler leader")
+            self.conn = conn
+            return True
+
+    def _close(self) -> None:
+        """Drop the connection, releasing the lock if it is still held."""
+        conn, self.conn = self.conn, None
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def release(self) -> None:
+        """Give up leadership, e.g. on shutdown."""
+        with self._lock:
+            if self.conn is not None:
+                self._close()
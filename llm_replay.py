@@ -0,0 +1,170 @@
+"""Record Gemini responses to a corpus file and replay them offline.
+
+With LLM_BACKEND=record, every Gemini call is made as usual and appended to
+LLM_CORPUS as one JSON line: the operation, model, a hash of the request,
+the response text, its latency and its token usage. With LLM_BACKEND=replay
+the same requests are answered from the corpus after their recorded
+latency (scaled by LLM_REPLAY_SPEED; 0 answers at once), without network
+access or an API key, so parser, validation and database code can be
+benchmarked and checked against real model output deterministically.
+
+Requests are matched on their text and on the files they refer to, which
+are identified by name and size since Gemini gives every upload a new id.
+When a request was recorded more than once, replay serves its responses
+in the order they were recorded, starting over after the last.
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from pdf import NoteGenerator
+
+logger = logging.getLogger(__name__)
+
+# Multiplier on recorded latencies when replaying; 0 replays without waiting
+LLM_REPLAY_SPEED = float(os.getenv("LLM_REPLAY_SPEED", "1.0"))
+
+
+class ReplayMissError(LookupError):
+    """A request has no recorded response in the corpus."""
+
+
+def request_key(operation: str, model_name: str, contents: List[Any]) -> str:
+    """Hash identifying a Gemini request across runs.
+
+    Text parts are hashed as they are. Files are hashed by display name and
+    size, which survive re-uploads and reconstruction from the database.
+    """
+    parts = [
+        (
+            part
+            if isinstance(part, str)
+            else {
+                "file": getattr(part, "display_name", None),
+                "size": int(getattr(part, "size_bytes", 0) or 0),
+            }
+        )
+        for part in contents
+    ]
+    payload = json.dumps(
+        [operation, model_name.removeprefix("models/"), parts], sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def read_corpus(path: Union[str, Path]) -> Iterator[Dict[str, Any]]:
+    """The recorded entries of a corpus file, in recording order."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class RecordingNoteGenerator(NoteGenerator):
+    """Calls Gemini and appends every request and response to a corpus file."""
+
+    def __init__(self, corpus: Union[str, Path]):
+        self.corpus = Path(corpus)
+        self._lock = threading.Lock()
+
+    def _call_model(self, operation: str, model, contents: List[Any], **kwargs):
+        started = time.perf_counter()
+        response = model.generate_content(contents, **kwargs)
+        latency = time.perf_counter() - started
+        try:
+            text = response.text
+        except ValueError as e:  # blocked or empty; nothing worth replaying
+            logger.warning(f"Not recording {operation} response: {str(e)}")
+            return response
+
+        usage = getattr(response, "usage_metadata", None)
+        entry = {
+            "key": request_key(operation, model.model_name, contents),
+            "operation": operation,
+            "model": model.model_name.removeprefix("models/"),
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+            "latency_ms": round(latency * 1000, 1),
+            "usage": {
+                "prompt_token_count": getattr(usage, "prompt_token_count", 0) or 0,
+                "candidates_token_count": getattr(usage, "candidates_token_count", 0)
+                or 0,
+                "cached_content_token_count": getattr(
+                    usage, "cached_content_token_count", 0
+                )
+                or 0,
+            },
+            "output": text,
+        }
+        try:
+            with self._lock, open(self.corpus, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            logger.error(f"Error recording {operation} response: {str(e)}")
+        return response
+
+
+class ReplayNoteGenerator(NoteGenerator):
+    """Answers Gemini requests from a recorded corpus, with their original timing.
+
+    Uploads, file reconstruction and deletion never reach Gemini either.
+    """
+
+    def __init__(self, corpus: Union[str, Path], speed: float = LLM_REPLAY_SPEED):
+        self.speed = speed
+        self.entries: Dict[str, List[Dict[str, Any]]] = {}
+        for entry in read_corpus(corpus):
+            self.entries.setdefault(entry["key"], []).append(entry)
+        self._next = {
+            key: itertools.cycle(found) for key, found in self.entries.items()
+        }
+        self._lock = threading.Lock()
+        logger.info(
+            f"Replaying {sum(map(len, self.entries.values()))} recorded responses "
+            f"for {len(self.entries)} requests from {corpus}"
+        )
+
+    def _call_model(self, operation: str, model, contents: List[Any], **kwargs):
+        key = request_key(operation, model.model_name, contents)
+        with self._lock:
+            responses = self._next.get(key)
+            entry: Optional[Dict[str, Any]] = next(responses) if responses else None
+        if entry is None:
+            raise ReplayMissError(f"No recorded {operation} response for {key}")
+        if self.speed:
+            time.sleep(entry["latency_ms"] / 1000 * self.speed)
+        return SimpleNamespace(
+            text=entry["output"], usage_metadata=SimpleNamespace(**entry["usage"])
+        )
+
+    def upload_to_gemini(self, path: Path, mime_type: Optional[str] = None):
+        """A file object with the name and size replayed requests are keyed on."""
+        path = Path(path)
+        now = datetime.now(timezone.utc)
+        return SimpleNamespace(
+            name=f"files/replay-{path.stem}",
+            display_name=path.name,
+            mime_type=mime_type or "application/pdf",
+            sha256_hash="",
+            size_bytes=path.stat().st_size,
+            state="ACTIVE",
+            uri=f"replay://{path.name}",
+            create_time=now,
+            expiration_time=now + timedelta(hours=48),
+            update_time=now,
+        )
+
+    def reconstruct_gemini_file(self, stored_file: Dict):
+        """Rebuild a replay file object from stored data."""
+        return SimpleNamespace(**stored_file)
+
+    def delete_gemini_file(self, name: str) -> None:
+        """Nothing was uploaded, so there is nothing to delete."""
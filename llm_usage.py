@@ -0,0 +1,148 @@
+import logging
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    from db import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Per-user spend allowed per UTC day, in US dollars; 0 disables budgets
+LLM_DAILY_BUDGET_USD = float(os.getenv("LLM_DAILY_BUDGET_USD", "0"))
+
+# Calls held in memory between flushes; the oldest are dropped beyond this
+MAX_PENDING = int(os.getenv("LLM_USAGE_MAX_PENDING", "10000"))
+
+# US dollars per million tokens (input, output) at the prompt sizes we send
+MODEL_PRICES = {
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+}
+
+# Who a Gemini call is made for; set by the services around each call
+llm_attribution: ContextVar[Dict[str, Any]] = ContextVar("llm_attribution", default={})
+
+_pending: deque = deque(maxlen=MAX_PENDING)
+_pending_lock = threading.Lock()
+
+
+class BudgetExceededError(RuntimeError):
+    """A user has spent their daily Gemini budget."""
+
+
+@contextmanager
+def attribute(**fields: Any) -> Iterator[None]:
+    """Attribute the Gemini calls made in the block to a user, PDF or chapter.
+
+    Carried into executor threads along with the rest of the context.
+    """
+    token = llm_attribution.set({**llm_attribution.get(), **fields})
+    try:
+        yield
+    finally:
+        llm_attribution.reset(token)
+
+
+def cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """Price of a call in US dollars; 0 for models without a known price."""
+    input_price, output_price = MODEL_PRICES.get(
+        model.removeprefix("models/"), (0.0, 0.0)
+    )
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def record(
+    endpoint: str,
+    model: str,
+    usage: Optional[Any],
+    latency_seconds: float,
+    outcome: str,
+) -> None:
+    """Queue one Gemini call for the next flush.
+
+    Args:
+        endpoint: What the call was for, e.g. "topic_notes"
+        model: Model name as reported by the client
+        usage: The response's usage_metadata, if there was a response
+        latency_seconds: Time the call took
+        outcome: "ok", or "error" if the call raised
+    """
+    input_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+    attribution = llm_attribution.get()
+    row = {
+        "username": attribution.get("username"),
+        "pdfid": attribution.get("pdfid"),
+        "chapter": attribution.get("chapter"),
+        "endpoint": endpoint,
+        "model": model.removeprefix("models/"),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cached_tokens": cached_tokens,
+        "cost_usd": cost(model, input_tokens, output_tokens),
+        "latency_ms": round(latency_seconds * 1000),
+        "cache_hit": cached_tokens > 0,
+        "outcome": outcome,
+    }
+    with _pending_lock:
+        if len(_pending) == MAX_PENDING:
+            logger.warning("LLM usage buffer full; dropping the oldest record")
+        _pending.append(row)
+
+
+def pending() -> int:
+    """Number of calls waiting for the next flush."""
+    return len(_pending)
+
+
+def pending_cost(username: str) -> float:
+    """Spend by a user in this process that has not been flushed yet."""
+    with _pending_lock:
+        return sum(row["cost_usd"] for row in _pending if row["username"] == username)
+
+
+def flush(db: "DatabaseManager") -> int:
+    """Write the queued calls to the llm_usage table in one batch.
+
+    On failure the calls are put back to be retried by the next flush.
+
+    Returns:
+        int: Number of calls written
+    """
+    with _pending_lock:
+        rows: List[Dict] = list(_pending)
+        _pending.clear()
+    if not rows:
+        return 0
+    try:
+        db.insert_llm_usage(rows)
+    except Exception:
+        with _pending_lock:
+            # Calls queued in the meantime win if the buffer is short of room
+            room = MAX_PENDING - len(_pending)
+            if room > 0:
+                _pending.extendleft(reversed(rows[-room:]))
+        raise
+    return len(rows)
+
+
+def check_budget(db: "DatabaseManager", username: Optional[str]) -> None:
+    """Raise BudgetExceededError if a user has no budget left today.
+
+    Calls still buffered in other workers are not counted, and the spend is
+    read from a replica, so a user can overshoot by what they spend within
+    one flush interval plus the replica's lag.
+    """
+    if not LLM_DAILY_BUDGET_USD or not username:
+        return
+    spent = db.get_llm_spend_today(username) + pending_cost(username)
+    if spent >= LLM_DAILY_BUDGET_USD:
+        raise BudgetExceededError(
+            f"Daily generation budget used up: ${spent:.2f} of "
+            f"${LLM_DAILY_BUDGET_USD:.2f}"
+        )
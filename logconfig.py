@@ -0,0 +1,235 @@
+"""Structured logging off the request path.
+
+setup_logging() routes every log record through a bounded queue to a
+background thread that does the writing, so a burst of logging never blocks
+the event loop on stderr. Records are written as one JSON object per line
+(LOG_FORMAT=json, the default) or as plain text (LOG_FORMAT=text), each
+tagged with the id of the request that produced it and, when tracing, the
+trace and span ids.
+
+Messages longer than LOG_MAX_CHARS are truncated; use truncate() to shorten
+payloads before formatting them into a message. Records of a noisy kind can
+be sampled by passing ``extra={"log_type": ...}``: only one in every
+1 / rate of them is written, with the rate taken from LOG_SAMPLE_RATES
+(e.g. ``pdf.image_saved=0.01``). Warnings and errors are never sampled.
+"""
+
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from metrics import LOG_RECORDS_DROPPED
+from tracing import current_ids
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Longest message written, in characters
+LOG_MAX_CHARS = int(os.getenv("LOG_MAX_CHARS", "2000"))
+# Records waiting for the writer thread; later ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Share of records written per log_type, overridden by LOG_SAMPLE_RATES
+DEFAULT_SAMPLE_RATES = {
+    "pdf.image_saved": 0.01,
+}
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+
+# Incoming X-Request-ID values kept as they are; others are replaced
+_REQUEST_ID = re.compile(r"^[\w.\-]{1,64}$")
+
+# Correlates the log records of one request, including those from executors
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_listener: Optional[QueueListener] = None
+
+
+def truncate(value: Any, limit: int = LOG_MAX_CHARS) -> str:
+    """str(value), cut to `limit` characters with a note of what was left out."""
+    text = str(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+def sample_rates() -> Dict[str, float]:
+    """DEFAULT_SAMPLE_RATES updated from LOG_SAMPLE_RATES (type=rate,...)."""
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    for item in os.getenv("LOG_SAMPLE_RATES", "").split(","):
+        if "=" in item:
+            log_type, rate = item.split("=", 1)
+            rates[log_type.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Write one in every 1 / rate records of each sampled log_type."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # A rate of 0 drops every record of the type
+        self.every = {
+            log_type: max(1, round(1 / rate)) if rate > 0 else 0
+            for log_type, rate in rates.items()
+            if rate < 1
+        }
+        self.counters: Dict[str, Any] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        log_type = getattr(record, "log_type", None)
+        every = self.every.get(log_type)
+        if every is None or record.levelno >= logging.WARNING:
+            return True
+        counter = self.counters.setdefault(log_type, itertools.count())
+        # next() on itertools.count is atomic, so threads share it safely
+        if every and next(counter) % every == 0:
+            record.sample_every = every
+            return True
+        LOG_RECORDS_DROPPED.labels(reason="sampled").inc()
+        return False
+
+
+class ContextFilter(logging.Filter):
+    """Tag records with the request and trace ids, and truncate the message.
+
+    Runs in the thread that logged, before the record is queued.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get() or "-"
+        ids = current_ids()
+        record.trace_id, record.span_id = ids if ids else (None, None)
+        record.msg = truncate(record.getMessage())
+        record.args = None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "trace_id": getattr(record, "trace_id", None),
+            "span_id": getattr(record, "span_id", None),
+            "log_type": getattr(record, "log_type", None),
+            "sample_every": getattr(record, "sample_every", None),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(
+            {key: value for key, value in entry.items() if value not in (None, "-")},
+            default=str,
+        )
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Queue handler that drops records rather than block when the queue is full."""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels(reason="queue_full").inc()
+
+
+def setup_logging() -> None:
+    """Replace the root logger's handlers with the queued, structured one.
+
+    Safe to call more than once; only the first call has an effect.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    writer = logging.StreamHandler(sys.stderr)
+    # Records arrive already formatted by the queue handler
+    writer.setFormatter(logging.Formatter("%(message)s"))
+
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = _DroppingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_rates()))
+    handler.addFilter(ContextFilter())
+    handler.setFormatter(
+        JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    )
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = QueueListener(log_queue, writer)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Write out the queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIdMiddleware:
+    """Give each request an id for its log records, echoed as X-Request-ID.
+
+    An incoming X-Request-ID (e.g. from a load balancer) is kept if it looks
+    like an id.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = next(
+            (
+                value.decode("latin-1")
+                for key, value in scope.get("headers", [])
+                if key == b"x-request-id"
+            ),
+            "",
+        )
+        current = incoming if _REQUEST_ID.match(incoming) else uuid.uuid4().hex
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-request-id", current.encode("latin-1")),
+                ]
+            await send(message)
+
+        token = request_id.set(current)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
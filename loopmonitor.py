@@ -0,0 +1,189 @@
+"""Event-loop lag monitoring and blocking-call detection.
+
+Each worker runs a ticker task that sleeps LOOP_LAG_INTERVAL_MS and records
+how late it wakes up: the time some callback kept the loop from running
+anything else. The lag goes to the ``event_loop_lag_seconds`` histogram and
+to the recent samples shown at /admin/event-loop.
+
+Setting LOOP_BLOCK_THRESHOLD_MS turns on the blocking-call detector, meant
+for debugging and load tests. A watchdog thread pings the loop, and when a
+ping is not answered within the threshold it captures the loop thread's
+stack, so the report names the DatabaseManager, NoteGenerator or bcrypt
+call that was running rather than only how long the loop stalled.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from types import FrameType
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from metrics import EVENT_LOOP_BLOCK_SECONDS, EVENT_LOOP_BLOCKS, EVENT_LOOP_LAG_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# How often the ticker measures lag
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+
+# Loop stalls longer than this get their stack recorded; 0 turns detection off
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "0"))
+
+# Lag samples kept for /admin/event-loop (a minute at the default interval)
+LAG_SAMPLES_KEPT = 600
+# Blocking calls kept for /admin/event-loop
+BLOCKS_KEPT = 50
+# Innermost frames kept from a blocked stack
+MAX_STACK_FRAMES = 30
+
+_APP_ROOT = Path(__file__).resolve().parent
+
+
+class LoopMonitor:
+    """Lag ticker and optional blocking-call watchdog for one event loop."""
+
+    def __init__(
+        self,
+        interval: float = LOOP_LAG_INTERVAL_MS / 1000,
+        block_threshold: float = LOOP_BLOCK_THRESHOLD_MS / 1000,
+    ):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.lag: Deque[float] = deque(maxlen=LAG_SAMPLES_KEPT)
+        self.blocks: Deque[Dict[str, Any]] = deque(maxlen=BLOCKS_KEPT)
+        self.blocks_total = 0
+        self._ticker: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def start(self) -> None:
+        """Start measuring the running loop. Call from a coroutine on it."""
+        loop = asyncio.get_running_loop()
+        self._stopping.clear()
+        self._ticker = loop.create_task(self._tick())
+        if self.block_threshold > 0:
+            self._watchdog = threading.Thread(
+                target=self._watch,
+                args=(loop, threading.get_ident()),
+                name="loop-watchdog",
+                daemon=True,
+            )
+            self._watchdog.start()
+            logger.info(
+                f"Recording event loop stalls over {self.block_threshold * 1000:.0f} ms"
+            )
+
+    async def stop(self) -> None:
+        """Stop the ticker and the watchdog."""
+        self._stopping.set()
+        if self._ticker is not None:
+            self._ticker.cancel()
+            try:
+                await self._ticker
+            except asyncio.CancelledError:
+                pass
+            self._ticker = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _tick(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.lag.append(lag)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+
+    def _watch(self, loop: asyncio.AbstractEventLoop, loop_thread: int) -> None:
+        """Ping the loop from another thread and catch it when it does not answer."""
+        while not self._stopping.is_set():
+            answered = threading.Event()
+            sent = time.perf_counter()
+            try:
+                loop.call_soon_threadsafe(answered.set)
+            except RuntimeError:  # the loop has closed
+                return
+            if not answered.wait(self.block_threshold):
+                frame = sys._current_frames().get(loop_thread)
+                stack = _stack(frame) if frame is not None else []
+                while not answered.wait(0.1):
+                    if self._stopping.is_set():
+                        return
+                self._record_block(stack, time.perf_counter() - sent)
+            self._stopping.wait(self.block_threshold / 2)
+
+    def _record_block(self, stack: List[Tuple[str, int, str]], seconds: float) -> None:
+        function = _blamed_function(stack)
+        EVENT_LOOP_BLOCKS.labels(function=function).inc()
+        EVENT_LOOP_BLOCK_SECONDS.observe(seconds)
+        self.blocks_total += 1
+        self.blocks.append(
+            {
+                "at": time.time(),
+                "duration_ms": round(seconds * 1000, 1),
+                "function": function,
+                "stack": [f"{path}:{line} in {name}" for path, line, name in stack],
+            }
+        )
+        logger.warning(f"Event loop blocked for {seconds * 1000:.0f} ms in {function}")
+
+    def report(self) -> Dict[str, Any]:
+        """Recent lag percentiles and blocking calls of this worker."""
+        ordered = sorted(self.lag)
+
+        def ms(fraction: float) -> Optional[float]:
+            if not ordered:
+                return None
+            index = min(len(ordered) - 1, int(len(ordered) * fraction))
+            return round(ordered[index] * 1000, 2)
+
+        return {
+            "pid": os.getpid(),
+            "interval_ms": self.interval * 1000,
+            "lag": {
+                "samples": len(ordered),
+                "last_ms": round(self.lag[-1] * 1000, 2) if self.lag else None,
+                "p50_ms": ms(0.50),
+                "p99_ms": ms(0.99),
+                "max_ms": ms(1.0),
+            },
+            "blocking": {
+                "threshold_ms": self.block_threshold * 1000 or None,
+                "total": self.blocks_total,
+                "recent": list(reversed(self.blocks)),
+            },
+        }
+
+
+def _stack(frame: Optional[FrameType]) -> List[Tuple[str, int, str]]:
+    """(path, line, qualified name) of a frame and its callers, innermost last."""
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_FRAMES:
+        code = frame.f_code
+        path = Path(code.co_filename)
+        if path.is_relative_to(_APP_ROOT):
+            path = path.relative_to(_APP_ROOT)
+        stack.append(
+            (str(path), frame.f_lineno, getattr(code, "co_qualname", code.co_name))
+        )
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _blamed_function(stack: List[Tuple[str, int, str]]) -> str:
+    """The innermost frame in the app's own code, e.g. ``db.py:DatabaseManager.get_user``."""
+    for path, _, name in reversed(stack):
+        if (
+            not Path(path).is_absolute()
+            and not path.startswith("<")
+            and "site-packages" not in path
+            and path != Path(__file__).name
+        ):
+            return f"{path}:{name}"
+    return "unknown"
@@ -1,4 +1,9 @@
+import asyncio
+import importlib.util
 import logging
+import math
+import os
+import secrets
 from fastapi import (
     FastAPI,
     Request,
@@ -10,46 +15,304 @@ from fastapi import (
     Depends,
     BackgroundTasks,
 )
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 from pathlib import Path
-from typing import Optional
+from contextlib import asynccontextmanager
+from functools import wraps
+from typing import Awaitable, Callable, Dict, Optional, Tuple
 from dotenv import load_dotenv
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-import bcrypt
 
-from pdf import NoteGenerator
-from services import NoteService, UserService, FileService
-from file_utils import save_uploaded_file
-from db import DatabaseManager
+from container import AppContainer, get_container
+from db import (
+    db_session,
+    note_content_hash,
+    notes_write_listeners,
+    record_session_write,
+    session_write_time,
+)
+from cache import LRUCache
+from compression import CompressionMiddleware, PrecompressedStaticFiles
+from images import (
+    RENDITION_WIDTHS,
+    image_links,
+    parse_range,
+    render,
+    rendition_path,
+    rendition_url,
+    source_hash,
+    source_path,
+)
+import llm_usage
+from logconfig import RequestIdMiddleware, setup_logging
+import profiling
+import querystats
+from metrics import MetricsMiddleware, render_metrics
+from profiling import ProfilerBusyError, ProfilingMiddleware
+from tracing import TracingMiddleware, setup_tracing, shutdown_tracing, span
+from prometheus_client import CONTENT_TYPE_LATEST
+from storage import (
+    STORAGE_QUOTA_BYTES,
+    STORAGE_QUOTA_FILES,
+    ArchivedImagesStaticFiles,
+    touch,
+    use_folder,
+)
+
+# orjson is optional; without it responses use the stdlib encoder
+if importlib.util.find_spec("orjson") is not None:
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+else:
+    FastJSONResponse = JSONResponse
 
 # Setup logging
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
+# Usernames allowed to use the /admin endpoints
+ADMIN_USERS = {
+    name.strip() for name in os.getenv("ADMIN_USERS", "").split(",") if name.strip()
+}
+
+# Bearer token required to scrape /metrics; empty leaves it open
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Deleted PDFs are removed in the background, rows in batches of this size
+PDF_RECLAIM_INTERVAL_SECONDS = int(os.getenv("PDF_RECLAIM_INTERVAL_SECONDS", "60"))
+PDF_RECLAIM_BATCH_SIZE = int(os.getenv("PDF_RECLAIM_BATCH_SIZE", "500"))
+
+# Files under uploads/ with no PDF row are deleted once older than the grace period
+UPLOAD_GC_INTERVAL_SECONDS = int(os.getenv("UPLOAD_GC_INTERVAL_SECONDS", "3600"))
+UPLOAD_GC_GRACE_SECONDS = int(os.getenv("UPLOAD_GC_GRACE_SECONDS", "86400"))
+
+# Disk usage is re-measured, and cold image folders archived, this often
+STORAGE_REFRESH_INTERVAL_SECONDS = int(
+    os.getenv("STORAGE_REFRESH_INTERVAL_SECONDS", "21600")
+)
+
+# Each worker writes its buffered Gemini usage records this often
+LLM_USAGE_FLUSH_SECONDS = float(os.getenv("LLM_USAGE_FLUSH_SECONDS", "5"))
+
+
+async def bind_db_session(request: Request, call_next):
+    """Route this request's database reads by user for read-your-writes.
+
+    The time of the user's last write travels in the session cookie, so a
+    worker process also honours writes that another worker handled.
+    """
+    username = request.session.get("username")
+    db_session.set(username)
+    if username and "db_written_at" in request.session:
+        record_session_write(username, request.session["db_written_at"])
+
+    response = await call_next(request)
+
+    # The session cookie is serialized when the response is sent
+    written_at = session_write_time(username) if username else None
+    if (
+        written_at
+        and request.session.get("username") == username
+        and written_at != request.session.get("db_written_at")
+    ):
+        request.session["db_written_at"] = written_at
+    return response
+
+
+# Initialize scheduler
+scheduler = AsyncIOScheduler()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the shared resources on startup and release them on shutdown."""
+    # After gunicorn forks, so each worker has its own export thread
+    setup_tracing()
+    container = AppContainer()
+    app.state.container = container
+    container.loop_monitor.start()
+
+    # Every worker checks its own pool
+    scheduler.add_job(
+        check_db_connection,
+        "interval",
+        args=[container],
+        minutes=2,  # Check every 2 minutes
+        max_instances=1,  # Prevent overlapping executions
+        coalesce=True,
+    )  # Combine missed executions
+    scheduler.add_job(
+        flush_llm_usage,
+        "interval",
+        args=[container],
+        seconds=LLM_USAGE_FLUSH_SECONDS,
+        max_instances=1,
+        coalesce=True,
+    )
+    # Database-wide jobs run only in the elected leader worker
+    scheduler.add_job(
+        leader_only(reconcile_user_stats),
+        "interval",
+        args=[container],
+        hours=1,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        leader_only(reclaim_deleted_pdfs),
+        "interval",
+        args=[container],
+        seconds=PDF_RECLAIM_INTERVAL_SECONDS,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        leader_only(refresh_storage),
+        "interval",
+        args=[container],
+        seconds=STORAGE_REFRESH_INTERVAL_SECONDS,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        leader_only(collect_upload_garbage),
+        "interval",
+        args=[container],
+        seconds=UPLOAD_GC_INTERVAL_SECONDS,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.start()
+
+    yield
+
+    scheduler.shutdown()
+    await container.loop_monitor.stop()
+    await flush_llm_usage(container)
+    container.close()
+    shutdown_tracing()
+
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+# Registered before SessionMiddleware so it runs inside it and sees the session
+app.middleware("http")(bind_db_session)
 app.add_middleware(SessionMiddleware, secret_key="your-secret-key")
+# Compresses every response including error pages
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+    gzip_level=int(os.getenv("GZIP_LEVEL", "6")),
+    brotli_quality=int(os.getenv("BROTLI_QUALITY", "4")),
+)
+# Samples threads while a request picked by /admin/profile/requests runs
+app.add_middleware(ProfilingMiddleware)
+# Near the outside, so request timings include every other middleware
+app.add_middleware(TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
+# Outside tracing, so the request id is set for every log record
+app.add_middleware(RequestIdMiddleware)
 
 # Mount static files and templates
-app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/images", StaticFiles(directory="uploads"), name="images")
+app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
+Path("uploads").mkdir(exist_ok=True)
+app.mount("/images", ArchivedImagesStaticFiles(directory="uploads"), name="images")
 templates = Jinja2Templates(directory="templates")
 
-# Initialize services
-note_service = NoteService()
-user_service = UserService()
-file_service = FileService()
-db = DatabaseManager()
-note_generator = NoteGenerator()
+# Cache-Control per endpoint. Notes are revalidated against their ETag,
+# quiz answers never change once a quiz is stored, and image renditions
+# have the source image's content hash in their URL.
+NOTES_CACHE_CONTROL = "private, max-age=300, must-revalidate"
+QUIZ_ANSWERS_CACHE_CONTROL = "private, max-age=31536000, immutable"
+RENDITION_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Serialized notes responses keyed by ("topic" | "subtopic", note id)
+notes_response_cache = LRUCache(
+    maxsize=int(os.getenv("NOTES_RESPONSE_CACHE_SIZE", "256"))
+)
 
-# Initialize scheduler
-scheduler = AsyncIOScheduler()
+
+def invalidate_notes_response(kind: str, note_id: int) -> None:
+    """Drop a cached notes response after its notes are rewritten."""
+    notes_response_cache.pop((kind, note_id))
+
+
+notes_write_listeners.append(invalidate_notes_response)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check If-None-Match against an ETag (weak comparison, per RFC 9110)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in candidates
+
+
+async def cached_notes_response(
+    request: Request,
+    kind: str,
+    version: Optional[Dict],
+    load: Callable[[], Awaitable[Tuple[Dict, int]]],
+) -> Response:
+    """Serve notes with an ETag, answering from the LRU or with 304 if possible.
+
+    Args:
+        kind: "topic" or "subtopic"
+        version: Note id and content hash from the *_notes_version lookup
+        load: Loads (or generates) the notes when they cannot be served from cache
+    """
+    note_key = (kind, version[f"{kind}id"]) if version else None
+    content_hash = version["content_hash"] if version else None
+
+    if content_hash:
+        etag = f'"{content_hash}"'
+        headers = {"ETag": etag, "Cache-Control": NOTES_CACHE_CONTROL}
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+
+        cached = notes_response_cache.get(note_key)
+        if cached and cached[0] == content_hash:
+            return Response(
+                content=cached[1], media_type="application/json", headers=headers
+            )
+
+    response, status_code = await load()
+    if status_code != 200:
+        return JSONResponse(
+            content=response,
+            status_code=status_code,
+            headers={"Cache-Control": "no-store"},
+        )
+
+    if not content_hash:
+        # Notes were generated by this request
+        content_hash = note_content_hash(response["notes"], response["images"])
+
+    if response.get("username") and response.get("pdf_folder"):
+        response["images"] = await run_in_threadpool(
+            image_links,
+            response["username"],
+            response["pdf_folder"],
+            response["images"] or [],
+        )
+
+    body = FastJSONResponse(content=response).body
+    if note_key:
+        notes_response_cache.set(note_key, (content_hash, body))
+
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": f'"{content_hash}"', "Cache-Control": NOTES_CACHE_CONTROL},
+    )
 
 
 async def get_current_user(request: Request) -> Optional[str]:
@@ -66,15 +329,45 @@ async def require_auth(request: Request, username: str = Depends(get_current_use
     return username
 
 
+async def require_admin(username: str = Depends(require_auth)):
+    """Dependency to require an administrator listed in ADMIN_USERS."""
+    if username not in ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+    return username
+
+
+def throttle_login(
+    request: Request, container: AppContainer, account: Optional[str] = None
+) -> Optional[JSONResponse]:
+    """Rate-limit password checks per client IP and per account.
+
+    Bounds the CPU an attacker (or a class logging in at once) can spend on
+    bcrypt. Returns a 429 response when over the limit, None otherwise.
+    """
+    client = request.client.host if request.client else "unknown"
+    retry_after = container.login_ip_limiter.acquire(client)
+    if retry_after is None and account:
+        retry_after = container.login_user_limiter.acquire(account.lower())
+    if retry_after is None:
+        return None
+
+    logger.warning(f"Throttled login attempt from {client} for {account}")
+    return JSONResponse(
+        content={"error": "Too many attempts, please try again later"},
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
+async def home(request: Request, container: AppContainer = Depends(get_container)):
     """Render home page with user data."""
     username = request.session.get("username")
     pdfs = []
 
     if username:
         # Get user's PDFs if logged in
-        response, _ = await file_service.get_user_pdfs(username)
+        response, _ = await container.file_service.get_user_pdfs(username)
         pdfs = response.get("pdfs", [])
 
     return templates.TemplateResponse(
@@ -84,29 +377,33 @@ async def home(request: Request):
 
 @app.get("/topic/{chapter}/{topic}", response_class=HTMLResponse)
 async def get_topic_page(
-    request: Request, chapter: str, topic: str, username: str = Depends(require_auth)
+    request: Request,
+    chapter: str,
+    topic: str,
+    username: str = Depends(require_auth),
+    container: AppContainer = Depends(get_container),
 ):
-    """Render topic page."""
+    """Render topic page, inlining the notes when they are pre-rendered."""
     try:
-        # Get existing notes if available
-        result = db.get_topic_notes(chapter, topic)
-        if not result:
+        rendered = container.db.get_topic_notes_html(chapter, topic)
+        if rendered is None:
             raise HTTPException(status_code=404, detail="Topic not found")
 
-        # Always return empty notes if they don't exist or are empty
-        # This will trigger the frontend to fetch them via API
-        existing_notes = None
-
+        # Without pre-rendered HTML (notes not generated yet, or stored before
+        # server rendering) notes is None and the frontend fetches them via API
         return templates.TemplateResponse(
             "topic.html",
             {
                 "request": request,
                 "chapter": chapter,
                 "topic": topic,
-                "notes": existing_notes,  # Always None to trigger frontend fetch
+                "notes": rendered["notes_html"],
+                "images": rendered["images_html"],
                 "username": username,
             },
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error rendering topic page: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -119,10 +416,14 @@ async def get_subtopic_page(
     topic: str,
     subtopic: str,
     username: str = Depends(require_auth),
+    container: AppContainer = Depends(get_container),
 ):
-    """Render subtopic page."""
+    """Render subtopic page, inlining the notes when they are pre-rendered."""
     try:
-        # Always return empty notes to trigger frontend fetch
+        rendered = container.db.get_subtopic_notes_html(chapter, topic, subtopic)
+        if rendered is None:
+            raise HTTPException(status_code=404, detail="Subtopic not found")
+
         return templates.TemplateResponse(
             "subtopic.html",
             {
@@ -130,10 +431,13 @@ async def get_subtopic_page(
                 "chapter": chapter,
                 "topic": topic,
                 "subtopic": subtopic,
-                "notes": None,  # Always None to trigger frontend fetch
+                "notes": rendered["notes_html"],
+                "images": rendered["images_html"],
                 "username": username,
             },
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error rendering subtopic page: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -141,11 +445,19 @@ async def get_subtopic_page(
 
 @app.get("/api/topic_notes/{chapter}/{topic}")
 async def get_topic_notes_api(
-    request: Request, chapter: str, topic: str, username: str = Depends(require_auth)
+    request: Request,
+    chapter: str,
+    topic: str,
+    username: str = Depends(require_auth),
+    container: AppContainer = Depends(get_container),
 ):
     """API endpoint for topic notes."""
-    response, status_code = await note_service.get_topic_notes(chapter, topic)
-    return JSONResponse(content=response, status_code=status_code)
+    return await cached_notes_response(
+        request,
+        "topic",
+        container.db.get_topic_notes_version(chapter, topic),
+        lambda: container.note_service.get_topic_notes(chapter, topic),
+    )
 
 
 @app.get("/api/notes/{chapter}/{topic}/{subtopic}")
@@ -155,16 +467,101 @@ async def get_notes_api(
     topic: str,
     subtopic: str,
     username: str = Depends(require_auth),
+    container: AppContainer = Depends(get_container),
 ):
     """API endpoint for subtopic notes."""
-    response, status_code = await note_service.get_subtopic_notes(
-        chapter, topic, subtopic
+    return await cached_notes_response(
+        request,
+        "subtopic",
+        container.db.get_subtopic_notes_version(chapter, topic, subtopic),
+        lambda: container.note_service.get_subtopic_notes(chapter, topic, subtopic),
     )
-    return JSONResponse(content=response, status_code=status_code)
+
+
+@app.get("/renditions/{username}/{folder}/{width}/{digest}/{filename}")
+async def get_image_rendition(
+    request: Request,
+    username: str,
+    folder: str,
+    width: int,
+    digest: str,
+    filename: str,
+    container: AppContainer = Depends(get_container),
+):
+    """Serve a resized copy of an extracted image, rendering it if needed.
+
+    Supports If-None-Match and single byte ranges (Range / If-Range).
+    """
+    source = source_path(username, folder, filename)
+    if width not in RENDITION_WIDTHS or source is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if not source.is_file():
+        # Cold books' images are archived; re-inflate them on first request
+        await run_in_threadpool(use_folder, source.parent)
+    if not source.is_file():
+        raise HTTPException(status_code=404, detail="Image not found")
+    touch(source.parent)
+
+    current = await run_in_threadpool(source_hash, source)
+    if digest != current:
+        # The image was replaced since the URL was handed out
+        return RedirectResponse(
+            url=rendition_url(username, folder, filename, current, width),
+            status_code=status.HTTP_301_MOVED_PERMANENTLY,
+        )
+
+    etag = f'"{digest}-{width}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": RENDITION_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    path = rendition_path(source, digest, width)
+    if not path.exists():
+        # Images extracted before renditions existed are rendered on first use
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                container.image_executor, render, source, width, path
+            )
+        except Exception as e:
+            logger.error(f"Error rendering {source}: {str(e)}")
+            raise HTTPException(status_code=500, detail="Could not render image")
+
+    data = await run_in_threadpool(path.read_bytes)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, len(data))
+        except ValueError:
+            return Response(
+                status_code=416,
+                headers={**headers, "Content-Range": f"bytes */{len(data)}"},
+            )
+        if byte_range:
+            start, end = byte_range
+            return Response(
+                content=data[start : end + 1],
+                status_code=206,
+                media_type="image/jpeg",
+                headers={
+                    **headers,
+                    "Content-Range": f"bytes {start}-{end}/{len(data)}",
+                },
+            )
+
+    return Response(content=data, media_type="image/jpeg", headers=headers)
 
 
 @app.post("/upload_pdf/")
-async def upload_pdf(request: Request, file: UploadFile = FastAPIFile(...)):
+async def upload_pdf(
+    request: Request,
+    file: UploadFile = FastAPIFile(...),
+    container: AppContainer = Depends(get_container),
+):
     """Handle PDF upload."""
     try:
         # Get username from session
@@ -175,7 +572,9 @@ async def upload_pdf(request: Request, file: UploadFile = FastAPIFile(...)):
             )
 
         # Process the uploaded file
-        response, status_code = await file_service.process_pdf_upload(file, username)
+        response, status_code = await container.file_service.process_pdf_upload(
+            file, username
+        )
         return JSONResponse(content=response, status_code=status_code)
     except Exception as e:
         logger.error(f"Error uploading PDF: {str(e)}")
@@ -200,16 +599,23 @@ async def login(
     login: str = Form(...),  # Changed from username to login to match form
     password: str = Form(...),
     login_method: str = Form(...),  # Added to handle email/username login
+    container: AppContainer = Depends(get_container),
 ):
     """Handle user login."""
+    limited = throttle_login(request, container, login)
+    if limited:
+        return limited
+
     try:
         # Determine if login is email or username
         if login_method == "email":
-            response, status_code = await user_service.login_user_by_email(
+            response, status_code = await container.user_service.login_user_by_email(
                 login, password
             )
         else:
-            response, status_code = await user_service.login_user(login, password)
+            response, status_code = await container.user_service.login_user(
+                login, password
+            )
 
         if status_code == 200:
             request.session["username"] = response.get(
@@ -223,18 +629,20 @@ async def login(
 
 
 @app.get("/logout")
-async def logout(request: Request):
+async def logout(request: Request, container: AppContainer = Depends(get_container)):
     """Handle user logout."""
     try:
         request.session.clear()
-        return await home(request)
+        return await home(request, container)
     except Exception as e:
         logger.error(f"Error during logout: {str(e)}")
         return JSONResponse(content={"error": "Internal server error"}, status_code=500)
 
 
 @app.get("/api/user_pdfs")
-async def get_user_pdfs(request: Request):
+async def get_user_pdfs(
+    request: Request, container: AppContainer = Depends(get_container)
+):
     """Get list of user's PDFs."""
     try:
         username = request.session.get("username")
@@ -243,8 +651,8 @@ async def get_user_pdfs(request: Request):
                 content={"error": "User not authenticated"}, status_code=401
             )
 
-        response, status_code = await file_service.get_user_pdfs(username)
-        return JSONResponse(content=response, status_code=status_code)
+        response, status_code = await container.file_service.get_user_pdfs(username)
+        return FastJSONResponse(content=response, status_code=status_code)
     except Exception as e:
         logger.error(f"Error getting user PDFs: {str(e)}")
         return JSONResponse(content={"error": "Internal server error"}, status_code=500)
@@ -271,17 +679,22 @@ async def signup(
     email: str = Form(...),
     username: str = Form(...),
     password: str = Form(...),
+    container: AppContainer = Depends(get_container),
 ):
     """Handle user signup."""
+    limited = throttle_login(request, container)
+    if limited:
+        return limited
+
     try:
         # First check if email exists
-        if await user_service.email_exists(email):
+        if await container.user_service.email_exists(email):
             return JSONResponse(
                 content={"error": "Email already exists"}, status_code=400
             )
 
         # Then try to register the user
-        response, status_code = await user_service.register_user(
+        response, status_code = await container.user_service.register_user(
             username=username, password=password, email=email
         )
         return JSONResponse(content=response, status_code=status_code)
@@ -291,7 +704,9 @@ async def signup(
 
 
 @app.delete("/delete_pdf/{pdf_id}")
-async def delete_pdf(request: Request, pdf_id: int):
+async def delete_pdf(
+    request: Request, pdf_id: int, container: AppContainer = Depends(get_container)
+):
     """Delete a PDF and its associated data."""
     try:
         # Get username from session
@@ -302,7 +717,9 @@ async def delete_pdf(request: Request, pdf_id: int):
             )
 
         # Delete the PDF using FileService
-        response, status_code = await file_service.delete_pdf(pdf_id, username)
+        response, status_code = await container.file_service.delete_pdf(
+            pdf_id, username
+        )
         return JSONResponse(content=response, status_code=status_code)
 
     except Exception as e:
@@ -319,7 +736,13 @@ async def quiz_page(request: Request, chapter: str):
 
 
 @app.get("/api/quiz/{chapter}")
-async def get_quiz(request: Request, chapter: str, new: bool = False):
+async def get_quiz(
+    request: Request,
+    chapter: str,
+    background_tasks: BackgroundTasks,
+    new: bool = False,
+    container: AppContainer = Depends(get_container),
+):
     """Get quiz questions for a chapter."""
     try:
         username = request.session.get("username")
@@ -328,44 +751,14 @@ async def get_quiz(request: Request, chapter: str, new: bool = False):
                 content={"error": "User not authenticated"}, status_code=401
             )
 
-        # Check if a quiz already exists and we're not forcing a new one
-        if not new:
-            existing_quiz = db.get_latest_quiz(chapter)
-            if existing_quiz:
-                questions = db.get_quiz_questions(existing_quiz["quizid"])
-                if questions:
-                    return JSONResponse(
-                        content={
-                            "quiz_id": existing_quiz["quizid"],
-                            "questions": questions,
-                        },
-                        status_code=200,
-                    )
-
-        # If no quiz exists, generate a new one
-        chapter_info = db.get_chapter_info(chapter)
-        if not chapter_info:
-            return JSONResponse(content={"error": "Chapter not found"}, status_code=404)
-
-        # Get the PDF file and upload to Gemini
-        pdf_path = Path(chapter_info["pdf_path"])
-        gemini_file = note_generator.upload_to_gemini(pdf_path)
-
-        # Generate quiz questions
-        questions = note_generator.generate_quiz_questions(gemini_file, chapter)
-
-        # Store quiz in database
-        quiz_id = db.store_quiz_questions(chapter, questions)
-
-        # Return only questions and options (no answers)
-        questions_only = [
-            {"questionid": i + 1, "question": q["question"], "options": q["options"]}
-            for i, q in enumerate(questions)
-        ]
+        response, status_code = await container.quiz_service.get_quiz(chapter, new)
 
-        return JSONResponse(
-            content={"quiz_id": quiz_id, "questions": questions_only}, status_code=200
-        )
+        # Only requests for a new variant draw on the pool, so only they top it
+        # up, once the response is sent; plain views never cost a Gemini call
+        if new and status_code == 200:
+            background_tasks.add_task(container.quiz_service.refill_pool, chapter)
+
+        return FastJSONResponse(content=response, status_code=status_code)
 
     except Exception as e:
         logger.error(f"Error generating quiz: {str(e)}")
@@ -375,7 +768,9 @@ async def get_quiz(request: Request, chapter: str, new: bool = False):
 
 
 @app.get("/api/quiz/{quiz_id}/answers")
-async def get_quiz_answers(request: Request, quiz_id: int):
+async def get_quiz_answers(
+    request: Request, quiz_id: int, container: AppContainer = Depends(get_container)
+):
     """Get answers for a completed quiz."""
     try:
         username = request.session.get("username")
@@ -384,8 +779,15 @@ async def get_quiz_answers(request: Request, quiz_id: int):
                 content={"error": "User not authenticated"}, status_code=401
             )
 
-        answers = db.get_quiz_answers(quiz_id)
-        return JSONResponse(content={"answers": answers}, status_code=200)
+        answers = container.db.get_quiz_answers(quiz_id)
+        if not answers:
+            return JSONResponse(content={"answers": answers}, status_code=200)
+
+        return FastJSONResponse(
+            content={"answers": answers},
+            status_code=200,
+            headers={"Cache-Control": QUIZ_ANSWERS_CACHE_CONTROL},
+        )
 
     except Exception as e:
         logger.error(f"Error getting quiz answers: {str(e)}")
@@ -395,7 +797,9 @@ async def get_quiz_answers(request: Request, quiz_id: int):
 
 
 @app.get("/book/{pdf_id}", response_class=HTMLResponse)
-async def book_page(request: Request, pdf_id: int):
+async def book_page(
+    request: Request, pdf_id: int, container: AppContainer = Depends(get_container)
+):
     """Render book structure page."""
     try:
         username = request.session.get("username")
@@ -403,14 +807,14 @@ async def book_page(request: Request, pdf_id: int):
             raise HTTPException(status_code=401, detail="User not authenticated")
 
         # Get PDF info and structure
-        pdf_info = db.get_pdf_info(pdf_id)
+        pdf_info = container.db.get_pdf_info(pdf_id)
         if not pdf_info:
             raise HTTPException(status_code=404, detail="PDF not found")
 
         if pdf_info["username"] != username:
             raise HTTPException(status_code=403, detail="Unauthorized")
 
-        structure = db.get_pdf_structure(pdf_id)
+        structure = container.db.get_pdf_structure(pdf_id)
 
         return templates.TemplateResponse(
             "book.html",
@@ -427,11 +831,13 @@ async def book_page(request: Request, pdf_id: int):
 
 
 @app.get("/api/book/{pdf_id}")
-async def get_book_structure(pdf_id: int):
+async def get_book_structure(
+    pdf_id: int, container: AppContainer = Depends(get_container)
+):
     """Get book structure."""
     try:
-        structure = db.get_pdf_structure(pdf_id)
-        return JSONResponse(content={"structure": structure})
+        structure = container.db.get_pdf_structure(pdf_id)
+        return FastJSONResponse(content={"structure": structure})
     except Exception as e:
         logger.error(f"Error getting book structure: {str(e)}")
         return JSONResponse(
@@ -440,20 +846,21 @@ async def get_book_structure(pdf_id: int):
 
 
 @app.get("/profile", response_class=HTMLResponse)
-async def profile_page(request: Request):
+async def profile_page(
+    request: Request, container: AppContainer = Depends(get_container)
+):
     """Render user profile page."""
     try:
         username = request.session.get("username")
         if not username:
             return RedirectResponse(url="/login", status_code=303)
 
-        # Get user profile data and detailed statistics
-        user_data = db.get_user_profile(username)
+        # Profile row already carries the maintained user_stats counters
+        user_data = container.db.get_user_profile(username)
         if not user_data:
             raise HTTPException(status_code=404, detail="User not found")
 
-        # Get detailed user statistics
-        stats = db.get_user_detailed_statistics(username)
+        stats = user_data
 
         return templates.TemplateResponse(
             "profile.html",
@@ -469,25 +876,13 @@ async def profile_page(request: Request):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-def hash_password(password: str) -> str:
-    """Hash a password using bcrypt."""
-    salt = bcrypt.gensalt(rounds=12)
-    return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash."""
-    return bcrypt.checkpw(
-        plain_password.encode("utf-8"), hashed_password.encode("utf-8")
-    )
-
-
 @app.post("/update-profile")
 async def update_profile(
     request: Request,
     email: str = Form(...),
     current_password: str = Form(None),
     new_password: str = Form(None),
+    container: AppContainer = Depends(get_container),
 ):
     """Update user profile information."""
     try:
@@ -502,8 +897,14 @@ async def update_profile(
                     content={"error": "Current password required"}, status_code=400
                 )
 
-            user = db.get_user(username)
-            if not user or not verify_password(current_password, user["password_hash"]):
+            limited = throttle_login(request, container, username)
+            if limited:
+                return limited
+
+            user = container.db.get_user(username)
+            if not user or not await container.password_hasher.verify(
+                current_password, user["password_hash"]
+            ):
                 return JSONResponse(
                     content={"error": "Invalid current password"}, status_code=400
                 )
@@ -511,9 +912,11 @@ async def update_profile(
         # Update profile
         updates = {"email": email}
         if new_password:
-            updates["password_hash"] = hash_password(new_password)
+            updates["password_hash"] = await container.password_hasher.hash(
+                new_password
+            )
 
-        db.update_user_profile(username, updates)
+        container.db.update_user_profile(username, updates)
 
         return JSONResponse(content={"message": "Profile updated successfully"})
 
@@ -524,36 +927,292 @@ async def update_profile(
         )
 
 
-async def check_db_connection():
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    """Prometheus metrics for every worker process.
+
+    Open unless METRICS_TOKEN is set, in which case scrapers must send it as
+    a bearer token.
+    """
+    if METRICS_TOKEN and not secrets.compare_digest(
+        request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    body = await run_in_threadpool(render_metrics)
+    return Response(content=body, media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up, whatever the state of the database."""
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+def readiness(container: AppContainer = Depends(get_container)):
+    """Readiness probe: 503 until the database can be reached."""
+    try:
+        ready = container.db.check_connection_health()
+    except Exception as e:
+        logger.error(f"Readiness check failed: {str(e)}")
+        ready = False
+
+    if not ready:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "unavailable"},
+        )
+    return {"status": "ok"}
+
+
+@app.get("/admin/db/pools")
+async def get_db_pool_metrics(
+    username: str = Depends(require_admin),
+    container: AppContainer = Depends(get_container),
+):
+    """Per-endpoint connection pool usage for the primary and read replicas."""
+    return JSONResponse(content={"endpoints": container.db.pool_metrics()})
+
+
+@app.get("/admin/db/queries")
+async def query_stats_report(
+    order_by: str = "total",
+    limit: int = 20,
+    _: str = Depends(require_admin),
+):
+    """The statements costing this worker the most, with their latency percentiles.
+
+    order_by is total, mean, p99, max, calls or rows. Plans are included for
+    statements that have been slower than SLOW_QUERY_MS.
+    """
+    try:
+        report = await run_in_threadpool(querystats.top, order_by, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(content=report)
+
+
+@app.get("/admin/event-loop")
+async def event_loop_report(
+    _: str = Depends(require_admin),
+    container: AppContainer = Depends(get_container),
+):
+    """Recent event loop lag and blocking calls of the worker answering.
+
+    Each gunicorn worker has its own loop; /metrics has all of them.
+    """
+    return FastJSONResponse(content=container.loop_monitor.report())
+
+
+def profile_response(profile: "profiling.Profile", output: str) -> Response:
+    """A profile as folded stacks (for flame graph tools) or as JSON."""
+    if output == "json":
+        return FastJSONResponse(content=profile.summary())
+    return Response(
+        content=profile.folded(),
+        media_type="text/plain",
+        headers={
+            "X-Profile-Samples": str(profile.samples),
+            "X-Profile-Requests": str(profile.requests),
+        },
+    )
+
+
+@app.post("/admin/profile")
+async def profile_worker(
+    seconds: float = 10,
+    interval_ms: float = profiling.PROFILE_INTERVAL_MS,
+    idle: bool = False,
+    output: str = "folded",
+    _: str = Depends(require_admin),
+):
+    """Sample the stacks of every thread of the worker answering for some seconds.
+
+    Returns folded stacks for flamegraph.pl, inferno or speedscope, or a
+    JSON summary with output=json. idle=true keeps threads waiting for work.
+    """
+    if output not in ("folded", "json"):
+        raise HTTPException(status_code=400, detail="output must be folded or json")
+    try:
+        profile = await profiling.profile_for(
+            seconds, max(interval_ms, 1) / 1000, include_idle=idle
+        )
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profile_response(profile, output)
+
+
+@app.post("/admin/profile/requests")
+async def profile_next_requests(
+    route: str,
+    count: int = 1,
+    timeout: float = 60,
+    interval_ms: float = profiling.PROFILE_INTERVAL_MS,
+    idle: bool = False,
+    output: str = "folded",
+    _: str = Depends(require_admin),
+):
+    """Sample every thread while the next `count` requests whose path matches
+    the `route` regular expression are handled by the worker answering.
+
+    Returns once they complete, or after `timeout` seconds with what was
+    collected; X-Profile-Requests says how many were profiled.
+    """
+    if output not in ("folded", "json"):
+        raise HTTPException(status_code=400, detail="output must be folded or json")
+    try:
+        profile = await profiling.profile_requests(
+            route, count, timeout, max(interval_ms, 1) / 1000, include_idle=idle
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profile_response(profile, output)
+
+
+@app.post("/admin/memory/snapshot")
+async def memory_snapshot(
+    group_by: str = "lineno",
+    limit: int = 25,
+    _: str = Depends(require_admin),
+):
+    """Top allocations of the worker answering, and growth since its last snapshot.
+
+    The first snapshot starts tracemalloc, which slows allocation down until
+    DELETE /admin/memory/snapshot stops it.
+    """
+    try:
+        report = await run_in_threadpool(profiling.memory_snapshot, group_by, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(content=report)
+
+
+@app.delete("/admin/memory/snapshot")
+async def stop_memory_tracing(_: str = Depends(require_admin)):
+    """Stop tracemalloc in the worker answering."""
+    profiling.stop_memory_tracing()
+    return {"status": "stopped"}
+
+
+@app.get("/admin/storage")
+async def storage_report(
+    limit: int = 20,
+    _: str = Depends(require_admin),
+    container: AppContainer = Depends(get_container),
+):
+    """The users taking up the most disk under uploads/, with the quotas."""
+    users = await run_in_threadpool(container.db.get_top_storage_users, limit)
+    return FastJSONResponse(
+        content={
+            "quota": {"bytes": STORAGE_QUOTA_BYTES, "files": STORAGE_QUOTA_FILES},
+            "users": [
+                {
+                    **user,
+                    "oldest_measurement": (
+                        user["oldest_measurement"].isoformat()
+                        if user["oldest_measurement"]
+                        else None
+                    ),
+                }
+                for user in users
+            ],
+        }
+    )
+
+
+@app.get("/admin/llm-usage")
+async def llm_usage_report(
+    group_by: str = "user",
+    days: float = 1,
+    limit: int = 50,
+    _: str = Depends(require_admin),
+    container: AppContainer = Depends(get_container),
+):
+    """Gemini calls, tokens and spend grouped by user, pdf, chapter, endpoint or model."""
+    try:
+        groups = await run_in_threadpool(
+            container.db.get_llm_usage_summary, group_by, days, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(
+        content={
+            "group_by": group_by,
+            "days": days,
+            "daily_budget_usd": llm_usage.LLM_DAILY_BUDGET_USD or None,
+            "groups": groups,
+        }
+    )
+
+
+async def check_db_connection(container: AppContainer):
     """Background task to check database connection."""
     try:
-        db.check_connection_health()
+        container.db.check_connection_health()
     except Exception as e:
         logger.error(f"Database health check failed: {str(e)}")
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Start the scheduler on app startup."""
-    # More frequent checks during development
-    scheduler.add_job(
-        check_db_connection,
-        "interval",
-        minutes=2,  # Check every 2 minutes
-        max_instances=1,  # Prevent overlapping executions
-        coalesce=True,
-    )  # Combine missed executions
-    scheduler.start()
+def leader_only(job):
+    """Wrap a scheduler job so it only runs in the scheduler leader worker."""
 
+    @wraps(job)
+    async def run_if_leader(container: AppContainer):
+        if await run_in_threadpool(container.leader.is_leader):
+            with span(f"job.{job.__name__}"):
+                await job(container)
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on app shutdown."""
-    scheduler.shutdown()
-    if hasattr(db, "pool"):
-        if not db.pool:
-            raise ValueError("Database connection pool not established")
-        db.pool.closeall()
+    return run_if_leader
+
+
+async def flush_llm_usage(container: AppContainer):
+    """Background task to write this worker's buffered Gemini usage records."""
+    if not llm_usage.pending():
+        return
+    try:
+        # container.db connects on first use, which blocks
+        await run_in_threadpool(lambda: llm_usage.flush(container.db))
+    except Exception as e:
+        logger.error(f"LLM usage flush failed: {str(e)}")
+
+
+async def reconcile_user_stats(container: AppContainer):
+    """Background task to repair drift in the per-user profile counters."""
+    try:
+        container.db.reconcile_user_stats()
+    except Exception as e:
+        logger.error(f"User stats reconciliation failed: {str(e)}")
+
+
+async def reclaim_deleted_pdfs(container: AppContainer):
+    """Background task to remove the rows and files of deleted PDFs."""
+    try:
+        await run_in_threadpool(
+            container.file_service.reclaim_deleted_pdfs,
+            batch_size=PDF_RECLAIM_BATCH_SIZE,
+        )
+    except Exception as e:
+        logger.error(f"Deleted PDF reclamation failed: {str(e)}")
+
+
+async def refresh_storage(container: AppContainer):
+    """Background task to archive cold image folders and re-measure disk usage."""
+    try:
+        await run_in_threadpool(container.file_service.refresh_storage)
+    except Exception as e:
+        logger.error(f"Storage refresh failed: {str(e)}")
+
+
+async def collect_upload_garbage(container: AppContainer):
+    """Background task to delete uploaded files no PDF row refers to."""
+    try:
+        await run_in_threadpool(
+            container.file_service.collect_garbage, UPLOAD_GC_GRACE_SECONDS
+        )
+    except Exception as e:
+        logger.error(f"Upload garbage collection failed: {str(e)}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+"""Prometheus metrics for HTTP routes, the database, Gemini calls, PDF processing
+and the event loop.
+
+Served at /metrics. Under gunicorn every worker writes its samples to files
+in PROMETHEUS_MULTIPROC_DIR (set up by gunicorn.conf.py), and the worker
+answering a scrape aggregates all of them. Recording a sample is a few
+microseconds, so instrumentation stays on in production.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Seconds; covers cache hits (~1 ms) up to slow Gemini calls
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time to produce a response, by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests being handled",
+    multiprocess_mode="livesum",
+)
+
+DB_CHECKOUT_SECONDS = Histogram(
+    "db_checkout_seconds",
+    "Time to get a tested connection from the pool",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds",
+    "Time a DatabaseManager method held its connection",
+    ["method"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_CONNECTIONS_IN_USE = Gauge(
+    "db_connections_in_use",
+    "Connections checked out of the pool",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+DB_ERRORS = Counter(
+    "db_connection_errors_total", "Failed connection checkouts", ["endpoint"]
+)
+
+LLM_REQUEST_SECONDS = Histogram(
+    "llm_request_seconds",
+    "Gemini call latency, by operation",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_PARSE_SECONDS = Histogram(
+    "llm_parse_seconds",
+    "Time to parse a Gemini response",
+    ["parser"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "Tokens used by Gemini calls", ["operation", "kind"]
+)
+LLM_ERRORS = Counter("llm_errors_total", "Failed Gemini calls", ["operation"])
+LLM_IN_FLIGHT = Gauge(
+    "llm_requests_in_flight",
+    "Gemini calls waiting for a response",
+    multiprocess_mode="livesum",
+)
+
+PDF_STAGE_SECONDS = Histogram(
+    "pdf_upload_stage_seconds",
+    "Time spent in each stage of processing an uploaded PDF",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop ran a timer, sampled by each worker",
+    buckets=LATENCY_BUCKETS,
+)
+EVENT_LOOP_BLOCKS = Counter(
+    "event_loop_blocks_total",
+    "Event loop stalls over LOOP_BLOCK_THRESHOLD_MS, by the app function running",
+    ["function"],
+)
+EVENT_LOOP_BLOCK_SECONDS = Histogram(
+    "event_loop_block_seconds",
+    "Length of event loop stalls over LOOP_BLOCK_THRESHOLD_MS",
+    buckets=LATENCY_BUCKETS,
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Log records not written, sampled out or with the log queue full",
+    ["reason"],
+)
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels: str) -> Iterator[None]:
+    """Observe the time spent in the block, whether or not it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def llm_call(operation: str) -> Iterator[None]:
+    """Record latency, errors and concurrency of a Gemini call."""
+    LLM_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        LLM_ERRORS.labels(operation=operation).inc()
+        raise
+    finally:
+        LLM_IN_FLIGHT.dec()
+        LLM_REQUEST_SECONDS.labels(operation=operation).observe(
+            time.perf_counter() - started
+        )
+
+
+def record_llm_tokens(operation: str, usage: Optional[Any]) -> None:
+    """Count the tokens reported in a Gemini response's usage_metadata."""
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_token_count", 0) or 0
+    response = getattr(usage, "candidates_token_count", 0) or 0
+    if prompt:
+        LLM_TOKENS.labels(operation=operation, kind="prompt").inc(prompt)
+    if response:
+        LLM_TOKENS.labels(operation=operation, kind="response").inc(response)
+
+
+def route_name(scope: Scope) -> str:
+    """Route template of a handled request, keeping label values bounded."""
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    # Mounted apps (/static, /images) are reported by their mount point
+    if scope.get("root_path"):
+        return scope["root_path"]
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Record the latency and status of every HTTP request by route template."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            HTTP_REQUEST_SECONDS.labels(
+                method=scope["method"], route=route_name(scope), status=str(status)
+            ).observe(time.perf_counter() - started)
+
+
+def render_metrics() -> bytes:
+    """Exposition-format text for every metric, across all worker processes."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
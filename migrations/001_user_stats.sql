@@ -0,0 +1,66 @@
+-- Per-user counters read by the /profile page.
+--
+-- The counters are maintained incrementally by DatabaseManager
+-- (create_user, create_pdf_record, create_pdf_structure, delete_pdf,
+-- store_quiz_questions) and repaired periodically by
+-- DatabaseManager.reconcile_user_stats.
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    username TEXT PRIMARY KEY,
+    total_pdfs INTEGER NOT NULL DEFAULT 0,
+    total_chapters INTEGER NOT NULL DEFAULT 0,
+    total_topics INTEGER NOT NULL DEFAULT 0,
+    total_subtopics INTEGER NOT NULL DEFAULT 0,
+    total_quizzes INTEGER NOT NULL DEFAULT 0,
+    last_upload TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Backfill counters for existing users.
+INSERT INTO user_stats (
+    username, total_pdfs, total_chapters, total_topics,
+    total_subtopics, total_quizzes, last_upload
+)
+SELECT
+    u.username,
+    COALESCE(p.total_pdfs, 0),
+    COALESCE(c.total_chapters, 0),
+    COALESCE(t.total_topics, 0),
+    COALESCE(s.total_subtopics, 0),
+    COALESCE(q.total_quizzes, 0),
+    p.last_upload
+FROM users u
+LEFT JOIN (
+    SELECT username, COUNT(*) AS total_pdfs, MAX(created_at) AS last_upload
+    FROM pdfs
+    GROUP BY username
+) p ON p.username = u.username
+LEFT JOIN (
+    SELECT p.username, COUNT(*) AS total_chapters
+    FROM chapters c
+    JOIN pdfs p ON c.pdfid = p.pdfid
+    GROUP BY p.username
+) c ON c.username = u.username
+LEFT JOIN (
+    SELECT p.username, COUNT(*) AS total_topics
+    FROM topics t
+    JOIN chapters c ON t.chapterid = c.chapterid
+    JOIN pdfs p ON c.pdfid = p.pdfid
+    GROUP BY p.username
+) t ON t.username = u.username
+LEFT JOIN (
+    SELECT p.username, COUNT(*) AS total_subtopics
+    FROM subtopics s
+    JOIN topics t ON s.topicid = t.topicid
+    JOIN chapters c ON t.chapterid = c.chapterid
+    JOIN pdfs p ON c.pdfid = p.pdfid
+    GROUP BY p.username
+) s ON s.username = u.username
+LEFT JOIN (
+    SELECT p.username, COUNT(DISTINCT q.quizid) AS total_quizzes
+    FROM quizzes q
+    JOIN chapters c ON q.chapter = c.chaptername
+    JOIN pdfs p ON c.pdfid = p.pdfid
+    GROUP BY p.username
+) q ON q.username = u.username
+ON CONFLICT (username) DO NOTHING;
@@ -0,0 +1,49 @@
+-- Pre-generated quiz variants and a per-chapter question bank.
+--
+-- Pooled quizzes are generated ahead of time and stay hidden from
+-- "latest quiz" lookups until /api/quiz/{chapter}?new=true serves one.
+
+ALTER TABLE quizzes ADD COLUMN IF NOT EXISTS pooled BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE INDEX IF NOT EXISTS quizzes_chapter_pooled_created_idx
+    ON quizzes (chapter, pooled, created_at);
+
+CREATE TABLE IF NOT EXISTS question_bank (
+    questionid SERIAL PRIMARY KEY,
+    chapter TEXT NOT NULL,
+    difficulty TEXT NOT NULL CHECK (difficulty IN ('easy', 'medium', 'hard')),
+    question_text TEXT NOT NULL,
+    options JSONB NOT NULL,
+    correct_answer TEXT NOT NULL,
+    explanation TEXT NOT NULL DEFAULT '',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (chapter, question_text)
+);
+
+CREATE INDEX IF NOT EXISTS question_bank_chapter_difficulty_idx
+    ON question_bank (chapter, difficulty);
+
+-- Seed the bank from existing quizzes. Quizzes were generated as five easy,
+-- five medium and five hard questions in that order.
+INSERT INTO question_bank (
+    chapter, difficulty, question_text, options, correct_answer, explanation
+)
+SELECT
+    q.chapter,
+    CASE
+        WHEN qq.position <= 5 THEN 'easy'
+        WHEN qq.position <= 10 THEN 'medium'
+        ELSE 'hard'
+    END,
+    qq.question_text,
+    qq.options::jsonb,
+    qq.correct_answer,
+    COALESCE(qq.explanation, '')
+FROM (
+    SELECT
+        quiz_questions.*,
+        ROW_NUMBER() OVER (PARTITION BY quizid ORDER BY questionid) AS position
+    FROM quiz_questions
+) qq
+JOIN quizzes q ON q.quizid = qq.quizid
+ON CONFLICT (chapter, question_text) DO NOTHING;
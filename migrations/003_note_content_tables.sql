@@ -0,0 +1,59 @@
+-- Move generated note bodies and Gemini file metadata out of the rows that
+-- structure, listing and join queries scan.
+--
+-- Notes live in topic_notes / subtopic_notes keyed by the owning row's id and
+-- are read only by the note endpoints. Gemini upload metadata moves to
+-- pdf_gemini_files. The old columns are emptied but kept so this can be
+-- rolled back; afterwards run
+--     VACUUM (FULL, ANALYZE) topics, subtopics, pdfs;
+-- during a quiet period to reclaim the space.
+
+CREATE TABLE IF NOT EXISTS topic_notes (
+    topicid INTEGER PRIMARY KEY REFERENCES topics(topicid) ON DELETE CASCADE,
+    notes TEXT NOT NULL,
+    images JSONB NOT NULL DEFAULT '[]'::jsonb,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS subtopic_notes (
+    subtopicid INTEGER PRIMARY KEY REFERENCES subtopics(subtopicid) ON DELETE CASCADE,
+    notes TEXT NOT NULL,
+    images JSONB NOT NULL DEFAULT '[]'::jsonb,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS pdf_gemini_files (
+    pdfid INTEGER PRIMARY KEY REFERENCES pdfs(pdfid) ON DELETE CASCADE,
+    gemini_file JSONB NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+BEGIN;
+
+INSERT INTO topic_notes (topicid, notes, images)
+SELECT topicid, notes, COALESCE(images, '[]'::jsonb)
+FROM topics
+WHERE notes IS NOT NULL AND btrim(notes) <> ''
+ON CONFLICT (topicid) DO NOTHING;
+
+UPDATE topics SET notes = NULL, images = NULL
+WHERE notes IS NOT NULL OR images IS NOT NULL;
+
+INSERT INTO subtopic_notes (subtopicid, notes, images)
+SELECT subtopicid, notes, COALESCE(images, '[]'::jsonb)
+FROM subtopics
+WHERE notes IS NOT NULL AND btrim(notes) <> ''
+ON CONFLICT (subtopicid) DO NOTHING;
+
+UPDATE subtopics SET notes = NULL, images = NULL
+WHERE notes IS NOT NULL OR images IS NOT NULL;
+
+INSERT INTO pdf_gemini_files (pdfid, gemini_file)
+SELECT pdfid, gemini_file
+FROM pdfs
+WHERE gemini_file IS NOT NULL
+ON CONFLICT (pdfid) DO NOTHING;
+
+UPDATE pdfs SET gemini_file = NULL WHERE gemini_file IS NOT NULL;
+
+COMMIT;
@@ -0,0 +1,12 @@
+-- Version tag for generated notes, served as the notes endpoints' ETag.
+
+ALTER TABLE topic_notes ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE subtopic_notes ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+UPDATE topic_notes
+SET content_hash = encode(sha256(convert_to(notes || images::text, 'UTF8')), 'hex')
+WHERE content_hash IS NULL;
+
+UPDATE subtopic_notes
+SET content_hash = encode(sha256(convert_to(notes || images::text, 'UTF8')), 'hex')
+WHERE content_hash IS NULL;
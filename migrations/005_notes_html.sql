@@ -0,0 +1,8 @@
+-- Server-rendered HTML of generated notes, inlined into the topic and
+-- subtopic pages on first paint. Written when notes are stored; notes
+-- stored before this migration get theirs the next time they are read.
+
+ALTER TABLE topic_notes ADD COLUMN IF NOT EXISTS notes_html TEXT;
+ALTER TABLE topic_notes ADD COLUMN IF NOT EXISTS images_html TEXT;
+ALTER TABLE subtopic_notes ADD COLUMN IF NOT EXISTS notes_html TEXT;
+ALTER TABLE subtopic_notes ADD COLUMN IF NOT EXISTS images_html TEXT;
@@ -0,0 +1,8 @@
+-- Deleting a PDF marks it deleted; a background job removes its rows in
+-- batches and its files afterwards.
+
+ALTER TABLE pdfs ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS pdfs_deleted_at_idx
+    ON pdfs (deleted_at)
+    WHERE deleted_at IS NOT NULL;
@@ -0,0 +1,8 @@
+-- Disk usage of each PDF under uploads/: the PDF file plus its extracted
+-- images (or their archive). Summed per user for quotas and the
+-- /admin/storage report.
+
+ALTER TABLE pdfs ADD COLUMN IF NOT EXISTS pdf_bytes BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE pdfs ADD COLUMN IF NOT EXISTS image_bytes BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE pdfs ADD COLUMN IF NOT EXISTS image_files INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE pdfs ADD COLUMN IF NOT EXISTS usage_updated_at TIMESTAMPTZ;
@@ -0,0 +1,25 @@
+-- One row per Gemini call: who it was for, what it consumed and how it
+-- went. Append-only; rows are written in batches by each worker and summed
+-- for daily budgets and the /admin/llm-usage report.
+
+CREATE TABLE IF NOT EXISTS llm_usage (
+    id BIGSERIAL PRIMARY KEY,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    username TEXT,
+    pdfid INTEGER,
+    chapter TEXT,
+    endpoint TEXT NOT NULL,
+    model TEXT NOT NULL,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    cost_usd NUMERIC(12, 6) NOT NULL DEFAULT 0,
+    latency_ms INTEGER NOT NULL,
+    cache_hit BOOLEAN NOT NULL DEFAULT FALSE,
+    outcome TEXT NOT NULL
+);
+
+-- Daily budget checks sum one user's rows since midnight
+CREATE INDEX IF NOT EXISTS idx_llm_usage_username_created
+    ON llm_usage (username, created_at);
+CREATE INDEX IF NOT EXISTS idx_llm_usage_created ON llm_usage (created_at);
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import os
+import re
+from concurrent.futures import Executor
+from typing import Optional
+
+import bcrypt
+
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+# bcrypt cost factor for new hashes. Existing hashes with another cost are
+# upgraded the next time their owner logs in.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# bcrypt only uses the first 72 bytes; passlib truncated silently, so do the
+# same to keep verifying hashes it created
+MAX_PASSWORD_BYTES = 72
+
+_COST = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    """Hash a password with bcrypt. CPU-bound; call through PasswordHasher."""
+    secret = password.encode("utf-8")[:MAX_PASSWORD_BYTES]
+    return bcrypt.hashpw(secret, bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Check a password against a bcrypt hash. CPU-bound; call through PasswordHasher."""
+    secret = plain_password.encode("utf-8")[:MAX_PASSWORD_BYTES]
+    try:
+        return bcrypt.checkpw(secret, hashed_password.encode("utf-8"))
+    except ValueError:
+        # Not a bcrypt hash
+        return False
+
+
+def hash_cost(hashed_password: str) -> Optional[int]:
+    """The cost factor a bcrypt hash was made with, or None if unrecognized."""
+    match = _COST.match(hashed_password)
+    return int(match.group(1)) if match else None
+
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated executor so logins never block the event loop.
+
+    The executor's size bounds how many cores bcrypt can occupy at once;
+    pyca/bcrypt releases the GIL, so a thread pool is enough.
+    """
+
+    def __init__(self, executor: Executor, rounds: int = BCRYPT_ROUNDS):
+        self.executor = executor
+        self.rounds = rounds
+
+    @traced()
+    async def hash(self, password: str) -> str:
+        """Hash a password at the configured cost."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, hash_password, password, self.rounds
+        )
+
+    @traced()
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        """Check a password against its stored hash."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, verify_password, password, hashed_password
+        )
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        """Whether a hash was made with a different cost than configured."""
+        return hash_cost(hashed_password) != self.rounds
@@ -2,17 +2,28 @@ import json
 import os
 import re
 import logging
+import time
+from functools import cached_property
 from pathlib import Path
-from typing import Dict, Optional, List, Any, TypedDict, Union
-import google.generativeai as genai
-from google.generativeai.types import GenerationConfig
-from google.generativeai.types.file_types import File as GeminiFile
-from datetime import datetime, timezone
-from google.generativeai import protos
-import fitz  # PyMuPDF
+from types import ModuleType, SimpleNamespace
+from typing import TYPE_CHECKING, Dict, Optional, List, Any, TypedDict, Union
+from datetime import datetime, timedelta, timezone
+
+import llm_usage
+from logconfig import truncate
+from metrics import LLM_PARSE_SECONDS, llm_call, record_llm_tokens, timed
+from tracing import set_attributes, span, traced
+
+# google.generativeai and PyMuPDF take over half a second to import, so they
+# are only loaded when notes are first generated or a PDF is first processed
+if TYPE_CHECKING:
+    from google.generativeai.types.file_types import File as GeminiFile
 
 logger = logging.getLogger(__name__)
 
+# Recorded Gemini responses, written by LLM_BACKEND=record and served by replay
+LLM_CORPUS = os.getenv("LLM_CORPUS", "llm_corpus.jsonl")
+
 
 class SubtopicDict(TypedDict):
     name: str
@@ -34,12 +45,21 @@ class PDFStructure(TypedDict):
 
 
 class NoteGenerator:
-    def __init__(self):
+    @cached_property
+    def genai(self) -> ModuleType:
+        """The Gemini SDK, imported and configured on first use."""
+        import google.generativeai as genai
+
         # Configure the API key for Google Gemini
         genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-        self.model = genai.GenerativeModel(
+        return genai
+
+    @cached_property
+    def model(self):
+        """Default notes model, built on first use."""
+        return self.genai.GenerativeModel(
             model_name="gemini-1.5-flash",
-            generation_config=GenerationConfig(
+            generation_config=self.genai.GenerationConfig(
                 temperature=0.3,
                 top_p=0.8,
                 top_k=40,
@@ -72,26 +92,84 @@ class NoteGenerator:
 
     def upload_to_gemini(
         self, path: Path, mime_type: Optional[str] = None
-    ) -> GeminiFile:
+    ) -> "GeminiFile":
         """Uploads file to Gemini."""
         try:
-            file = genai.upload_file(path, mime_type=mime_type)
+            with span("gemini.upload", **{"file.size": path.stat().st_size}), llm_call(
+                "upload"
+            ):
+                file = self.genai.upload_file(path, mime_type=mime_type)
             logger.info(f"Uploaded file '{file.display_name}' to Gemini")
             return file
         except Exception as e:
             logger.error(f"Error uploading file to Gemini: {str(e)}")
             raise
 
+    def delete_gemini_file(self, name: str) -> None:
+        """Delete an uploaded file from Gemini before it expires on its own."""
+        self.genai.delete_file(name)
+        logger.info(f"Deleted Gemini file '{name}'")
+
+    def _generate(self, operation: str, contents: List[Any], model=None, **kwargs):
+        """Call Gemini, recording latency, token usage and calls in flight.
+
+        Every call is also queued for the llm_usage table, attributed to the
+        user, PDF and chapter set with llm_usage.attribute.
+
+        Args:
+            operation: Label for metrics, e.g. "topic_notes"
+            contents: Files and prompt text to send
+            model: Model to use instead of the default notes model
+        """
+        model = model or self.model
+        response = None
+        started = time.perf_counter()
+        try:
+            with span(
+                f"gemini.{operation}", **{"gen_ai.request.model": model.model_name}
+            ) as current, llm_call(operation):
+                response = self._call_model(operation, model, contents, **kwargs)
+                usage = getattr(response, "usage_metadata", None)
+                set_attributes(
+                    current,
+                    **{
+                        "gen_ai.usage.input_tokens": getattr(
+                            usage, "prompt_token_count", None
+                        ),
+                        "gen_ai.usage.output_tokens": getattr(
+                            usage, "candidates_token_count", None
+                        ),
+                    },
+                )
+        finally:
+            usage = getattr(response, "usage_metadata", None)
+            llm_usage.record(
+                operation,
+                model.model_name,
+                usage,
+                time.perf_counter() - started,
+                "ok" if response is not None else "error",
+            )
+        record_llm_tokens(operation, usage)
+        return response
+
+    def _call_model(self, operation: str, model, contents: List[Any], **kwargs):
+        """Send one request to Gemini; overridden to record or replay responses."""
+        return model.generate_content(contents, **kwargs)
+
     def generate_topic_notes(
-        self, gemini_file: GeminiFile, chapter: str, topic: str, image_files: List[str]
+        self,
+        gemini_file: "GeminiFile",
+        chapter: str,
+        topic: str,
+        image_files: List[str],
     ) -> Dict:
         """Generate comprehensive notes for a topic."""
         try:
-            print(f"gemini_file: {gemini_file}")
-            print(f"chapter: {chapter}")
-            print(f"topic: {topic}")
-            print(f"image_files: {image_files}")
-            logger.info(f"Generating notes for topic: {chapter}/{topic}")
+            logger.info(
+                f"Generating notes for topic: {chapter}/{topic} "
+                f"({len(image_files)} images available)"
+            )
 
             prompt = f"""Analyze the PDF content and generate comprehensive notes for the topic '{topic}' 
             from chapter '{chapter}'.
@@ -122,7 +200,7 @@ class NoteGenerator:
             Make the notes clear, well-structured, and easy to understand. properly format the output in JSON.
             """
 
-            response = self.model.generate_content([gemini_file, prompt]).text
+            response = self._generate("topic_notes", [gemini_file, prompt]).text
             return self._parse_json_response(response)
         except Exception as e:
             logger.error(f"Error generating topic notes: {str(e)}")
@@ -130,7 +208,7 @@ class NoteGenerator:
 
     def generate_subtopic_notes(
         self,
-        gemini_file: GeminiFile,
+        gemini_file: "GeminiFile",
         chapter: str,
         topic: str,
         subtopic: str,
@@ -167,9 +245,10 @@ class NoteGenerator:
             4. Do not include any explanation text outside the JSON structure
             """
 
-            response = self.model.generate_content(
+            response = self._generate(
+                "subtopic_notes",
                 [gemini_file, prompt],
-                generation_config=GenerationConfig(
+                generation_config=self.genai.GenerationConfig(
                     temperature=0.3,
                     top_p=0.8,
                     top_k=40,
@@ -187,6 +266,11 @@ class NoteGenerator:
 
     def _clean_json_response(self, response: str) -> str:
         """Clean the response to ensure valid JSON."""
+        with timed(LLM_PARSE_SECONDS, parser="clean_json"):
+            return self._clean_json(response)
+
+    def _clean_json(self, response: str) -> str:
+        """Extract and validate the JSON object in a response."""
         try:
             # Find the first { and last } to extract the JSON object
             start = response.find("{")
@@ -207,12 +291,12 @@ class NoteGenerator:
             logger.error(f"Error cleaning JSON response: {str(e)}")
             raise
 
-    def extract_pdf_structure(self, gemini_file: GeminiFile) -> Dict[str, Any]:
+    def extract_pdf_structure(self, gemini_file: "GeminiFile") -> Dict[str, Any]:
         """Extract the structure of chapters and topics from the PDF."""
         try:
-            model = genai.GenerativeModel(
+            model = self.genai.GenerativeModel(
                 model_name="gemini-1.5-pro",
-                generation_config=GenerationConfig(
+                generation_config=self.genai.GenerationConfig(
                     temperature=0.3,
                     top_p=0.8,
                     top_k=40,
@@ -271,14 +355,17 @@ class NoteGenerator:
                 20. Give me the proper reasoning for the subtopics and topics you created outside the JSON structure.
                 """,
             )
-            response = model.generate_content(
+            response = self._generate(
+                "structure",
                 [
                     gemini_file,
                     "Give me chapters, topics, and subtopics from this book.Make sure topics and subtopics are not created if there is no context in the book. And Make sure to follow the instructions strictly.",
-                ]
+                ],
+                model=model,
             )
 
-            print(f"response: {response.text}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Structure response: {truncate(response.text)}")
 
             # Parse and validate the structure
             structure = self._parse_json_response(response.text)
@@ -393,7 +480,7 @@ class NoteGenerator:
             }}
             ```
             """
-            response = self.model.generate_content([prompt]).text
+            response = self._generate("fix_structure", [prompt]).text
             json_structure = self._parse_json_response(response)
 
             # Create a basic valid structure if the response is invalid
@@ -431,7 +518,7 @@ class NoteGenerator:
             return PDFStructure(chapters=[])
 
     def generate_quiz_questions(
-        self, gemini_file: GeminiFile, chapter: str
+        self, gemini_file: "GeminiFile", chapter: str
     ) -> List[Dict]:
         """Generate quiz questions for a chapter."""
         try:
@@ -474,7 +561,8 @@ class NoteGenerator:
                         "D. Fourth option"
                     ],
                     "correct_answer": "A",
-                    "explanation": "Explanation of the correct answer"
+                    "explanation": "Explanation of the correct answer",
+                    "difficulty": "easy"
                 }}
             ]
 
@@ -483,17 +571,27 @@ class NoteGenerator:
             2. Has exactly 4 options labeled A through D
             3. Has one clear correct answer
             4. Includes an explanation for the correct answer
-            5. A total of fifteen questions only.
-            6. Give me the proper explanation on why you chose those fifteen questions outside the JSON structure.
+            5. Has a "difficulty" of "easy", "medium" or "hard" matching its level
+            6. A total of fifteen questions only.
+            7. Give me the proper explanation on why you chose those fifteen questions outside the JSON structure.
             """
 
-            response = self.model.generate_content([gemini_file, prompt]).text
+            response = self._generate("quiz", [gemini_file, prompt]).text
             questions = self._parse_json_response(response)
 
             # Validate that we got a list of questions
             if not isinstance(questions, list):
                 raise ValueError("Invalid quiz format: expected list of questions")
 
+            # Fall back to the prompt's ordering (5 easy, 5 medium, 5 hard)
+            levels = ["easy", "medium", "hard"]
+            for index, question in enumerate(questions):
+                difficulty = str(question.get("difficulty", "")).lower()
+                if difficulty not in levels:
+                    question["difficulty"] = levels[min(index // 5, 2)]
+                else:
+                    question["difficulty"] = difficulty
+
             return questions
 
         except Exception as e:
@@ -502,6 +600,11 @@ class NoteGenerator:
 
     def _parse_json_response(self, response: str) -> Dict:
         """Parse JSON response from Gemini."""
+        with timed(LLM_PARSE_SECONDS, parser="json"):
+            return self._parse_json(response)
+
+    def _parse_json(self, response: str) -> Dict:
+        """Parse the JSON in a response, preferring a fenced code block."""
         try:
             # First try to find JSON within code blocks
             match = re.search(r"```(?:json)?\n(.*?)\n```", response, re.DOTALL)
@@ -517,15 +620,16 @@ class NoteGenerator:
             # Parse JSON
             result = json.loads(json_str)
 
-            logger.info(f"Successfully parsed JSON structure: {result}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Parsed JSON response: {truncate(result)}")
             return result
 
         except json.JSONDecodeError as e:
             logger.error(f"Error parsing JSON response: {str(e)}")
-            logger.error(f"Raw response: {response}")
+            logger.error(f"Raw response: {truncate(response)}")
             raise ValueError(f"Failed to parse JSON response: {str(e)}")
 
-    def create_gemini_file_dict(self, gemini_file: GeminiFile) -> Dict:
+    def create_gemini_file_dict(self, gemini_file: "GeminiFile") -> Dict:
         """Create a dictionary of Gemini file information for storage."""
         return {
             "name": gemini_file.name,
@@ -552,10 +656,12 @@ class NoteGenerator:
             ),
         }
 
-    def reconstruct_gemini_file(self, stored_file: Dict) -> GeminiFile:
+    def reconstruct_gemini_file(self, stored_file: Dict) -> "GeminiFile":
         """Reconstruct a Gemini file object from stored data."""
+        from google.generativeai.types.file_types import File as GeminiFile
+
         try:
-            file_proto = protos.File(
+            file_proto = self.genai.protos.File(
                 name=stored_file["name"],
                 display_name=stored_file["display_name"],
                 mime_type=stored_file["mime_type"],
@@ -572,12 +678,29 @@ class NoteGenerator:
             logger.error(f"Error reconstructing Gemini file: {str(e)}")
             raise
 
-    def extract_images_from_pdf(self, pdf_path: Path, output_folder: Path) -> List[str]:
-        """Extract images from PDF and save them."""
+    @traced()
+    def extract_images_from_pdf(
+        self,
+        pdf_path: Path,
+        output_folder: Path,
+        max_files: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ) -> List[str]:
+        """Extract images from PDF and save them.
+
+        Args:
+            pdf_path: PDF to extract from
+            output_folder: Folder to write the images to
+            max_files: Stop after writing this many images
+            max_bytes: Stop before the images written exceed this many bytes
+        """
+        import fitz  # PyMuPDF
+
         doc = None  # Initialize doc outside try block
         try:
             doc = fitz.open(pdf_path)
             image_files = []
+            written_bytes = 0
 
             for page_num in range(len(doc)):
                 page = doc[page_num]
@@ -592,6 +715,18 @@ class NoteGenerator:
                             image_bytes = base_image["image"]
                             image_ext = base_image["ext"]
 
+                            if (
+                                max_files is not None and len(image_files) >= max_files
+                            ) or (
+                                max_bytes is not None
+                                and written_bytes + len(image_bytes) > max_bytes
+                            ):
+                                logger.warning(
+                                    f"Storage quota reached; stopped extracting images "
+                                    f"from {pdf_path} after {len(image_files)}"
+                                )
+                                return image_files
+
                             # Generate a unique name for each image
                             image_name = (
                                 f"image_{page_num + 1}_{img_index + 1}.{image_ext}"
@@ -602,8 +737,12 @@ class NoteGenerator:
                             with open(image_path, "wb") as f:
                                 f.write(image_bytes)
 
-                            logger.info(f"Saved image: {image_name}")
+                            logger.info(
+                                f"Saved image: {image_name}",
+                                extra={"log_type": "pdf.image_saved"},
+                            )
                             image_files.append(image_name)
+                            written_bytes += len(image_bytes)
 
                     except Exception as e:
                         logger.warning(
@@ -623,3 +762,132 @@ class NoteGenerator:
         finally:
             if doc is not None:  # Check if doc was initialized
                 doc.close()
+
+
+class FakeNoteGenerator(NoteGenerator):
+    """Offline stand-in for Gemini, for load tests and local development.
+
+    Returns deterministic notes, structures and quizzes after sleeping
+    FAKE_LLM_LATENCY_MS, so request handling can be measured without API
+    keys, quotas or network variance. Image extraction still uses PyMuPDF.
+    """
+
+    def __init__(self):
+        self.latency = int(os.getenv("FAKE_LLM_LATENCY_MS", "200")) / 1000
+
+    def _wait(self, operation: str) -> None:
+        """Block like a Gemini call would, recorded in the same metrics and usage."""
+        with span(f"gemini.{operation}", **{"gen_ai.request.model": "fake"}), llm_call(
+            operation
+        ):
+            time.sleep(self.latency)
+        if operation != "upload":
+            llm_usage.record(operation, "fake", None, self.latency, "ok")
+
+    def upload_to_gemini(self, path: Path, mime_type: Optional[str] = None):
+        """Pretend to upload a file, returning an object shaped like a Gemini file."""
+        self._wait("upload")
+        now = datetime.now(timezone.utc)
+        return SimpleNamespace(
+            name=f"files/fake-{Path(path).stem}",
+            display_name=Path(path).name,
+            mime_type=mime_type or "application/pdf",
+            sha256_hash="",
+            size_bytes=0,
+            state="ACTIVE",
+            uri=f"fake://{Path(path).name}",
+            create_time=now,
+            expiration_time=now + timedelta(hours=48),
+            update_time=now,
+        )
+
+    def reconstruct_gemini_file(self, stored_file: Dict):
+        """Rebuild a fake file object from stored data."""
+        return SimpleNamespace(**stored_file)
+
+    def delete_gemini_file(self, name: str) -> None:
+        """Nothing was uploaded, so there is nothing to delete."""
+
+    def generate_topic_notes(
+        self, gemini_file, chapter: str, topic: str, image_files: List[str]
+    ) -> Dict:
+        """Canned markdown notes for a topic."""
+        self._wait("topic_notes")
+        return {
+            "notes": f"## {topic}\n\nNotes for *{topic}* from {chapter}.\n\n"
+            "- First key point\n- Second key point\n",
+            "images": [],
+        }
+
+    def generate_subtopic_notes(
+        self,
+        gemini_file,
+        chapter: str,
+        topic: str,
+        subtopic: str,
+        image_files: List[str],
+    ) -> Dict:
+        """Canned markdown notes for a subtopic."""
+        self._wait("subtopic_notes")
+        return {
+            "notes": f"### {subtopic}\n\nNotes for *{subtopic}* in {topic}.\n",
+            "images": [],
+        }
+
+    def extract_pdf_structure(self, gemini_file) -> Dict[str, Any]:
+        """A fixed three-chapter structure."""
+        self._wait("structure")
+        return {
+            "chapters": [
+                {
+                    "name": f"Chapter {chapter}",
+                    "topics": [
+                        {
+                            "name": f"Topic {chapter}.{topic}",
+                            "subtopics": [
+                                {"name": f"Subtopic {chapter}.{topic}.{subtopic}"}
+                                for subtopic in range(1, 3)
+                            ],
+                        }
+                        for topic in range(1, 4)
+                    ],
+                }
+                for chapter in range(1, 4)
+            ]
+        }
+
+    def generate_quiz_questions(self, gemini_file, chapter: str) -> List[Dict]:
+        """Fifteen placeholder questions, five per difficulty level."""
+        self._wait("quiz")
+        levels = ["easy", "medium", "hard"]
+        return [
+            {
+                "question": f"{chapter}: question {index + 1}?",
+                "options": ["A. First", "B. Second", "C. Third", "D. Fourth"],
+                "correct_answer": "ABCD"[index % 4],
+                "explanation": "Placeholder explanation.",
+                "difficulty": levels[index // 5],
+            }
+            for index in range(15)
+        ]
+
+
+def create_note_generator() -> NoteGenerator:
+    """Build the note generator selected by LLM_BACKEND.
+
+    "gemini" (the default) calls Gemini, "fake" returns canned content,
+    "record" calls Gemini and appends every response to LLM_CORPUS, and
+    "replay" serves the responses in LLM_CORPUS instead of calling Gemini.
+    """
+    backend = os.getenv("LLM_BACKEND", "gemini").lower()
+    if backend == "fake":
+        logger.info("Using the fake LLM backend")
+        return FakeNoteGenerator()
+    if backend in ("record", "replay"):
+        from llm_replay import RecordingNoteGenerator, ReplayNoteGenerator
+
+        logger.info(f"Using the {backend} LLM backend with {LLM_CORPUS}")
+        if backend == "record":
+            return RecordingNoteGenerator(LLM_CORPUS)
+        return ReplayNoteGenerator(LLM_CORPUS)
+    return NoteGenerator()
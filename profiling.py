@@ -0,0 +1,385 @@
+"""On-demand CPU and memory profiling of a live worker.
+
+The sampling profiler is a thread that reads every other thread's stack
+(the event loop, the Gemini, bcrypt and AnyIO executor threads) every
+PROFILE_INTERVAL_MS, and counts the stacks in the folded format read by
+flamegraph.pl, inferno and speedscope: one line per distinct stack, frames
+separated by ``;``, rooted at the thread pool's name, then the count.
+Threads waiting for work are left out unless asked for. At the default
+100 Hz a sample costs well under a millisecond, so it can run against live
+traffic.
+
+A profile covers either a fixed number of seconds, or the next requests
+whose path matches a pattern: sampling is then on only while one of them
+is in flight.
+
+Memory is profiled with tracemalloc, started by the first snapshot and
+stopped on request, since tracing every allocation slows the worker down.
+Each snapshot is diffed against the previous one, e.g. taken before and
+after extract_images_from_pdf runs or while the caches fill.
+
+Profiles and snapshots cover the worker that answers the admin request.
+"""
+
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+from typing import Any, Dict, List, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Time between samples
+PROFILE_INTERVAL_MS = 10
+# Longest profile, and longest wait for matching requests
+PROFILE_MAX_SECONDS = 300
+# Deeper stacks are cut at the root end
+MAX_STACK_DEPTH = 128
+
+# Frames tracemalloc keeps per allocation; more frames cost more memory
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+
+# Ways memory snapshots can be grouped, as tracemalloc names them
+MEMORY_GROUPS = ("lineno", "filename", "traceback")
+
+# Innermost frames of threads waiting for work rather than doing it
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+# Pool members share a name: llm_3 is shown as llm
+_THREAD_NUMBER = re.compile(r"[-_]\d+(?:_\d+)?$")
+
+_APP_ROOT = Path(__file__).resolve().parent
+
+
+class ProfilerBusyError(RuntimeError):
+    """A profile is already running in this worker."""
+
+
+class Profile:
+    """Stack counts gathered by a SamplingProfiler."""
+
+    def __init__(self, stacks: Counter, samples: int, seconds: float, interval: float):
+        self.stacks = stacks
+        self.samples = samples
+        self.seconds = seconds
+        self.interval = interval
+        self.requests = 0
+
+    def folded(self) -> str:
+        """The stacks in folded format, most frequent first."""
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def summary(self, limit: int = 50) -> Dict[str, Any]:
+        """Sampling details and the most frequent stacks, for JSON."""
+        return {
+            "samples": self.samples,
+            "seconds": round(self.seconds, 3),
+            "interval_ms": self.interval * 1000,
+            "requests": self.requests,
+            "stacks": [
+                {"stack": stack.split(";"), "count": count}
+                for stack, count in self.stacks.most_common(limit)
+            ],
+        }
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread but its own from a background thread."""
+
+    def __init__(self, interval: float, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        # Request captures pause sampling while no matching request runs
+        self.paused = False
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._sampled_seconds = 0.0
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Profile:
+        """Stop sampling and return what was collected."""
+        self._stopping.set()
+        self._thread.join()
+        return Profile(
+            self._stacks, self._samples, self._sampled_seconds, self.interval
+        )
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stopping.wait(self.interval):
+            now = time.perf_counter()
+            if not self.paused:
+                self._sampled_seconds += now - last
+                self._sample(own)
+            last = now
+
+    def _sample(self, own: int) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            frames = _frames(frame)
+            if not frames:
+                continue
+            if not self.include_idle and _is_idle(frame):
+                continue
+            thread = _THREAD_NUMBER.sub("", names.get(ident, "unknown"))
+            self._stacks[";".join([thread, *frames])] += 1
+        self._samples += 1
+
+
+class RequestCapture:
+    """Profiles the next requests whose path matches a pattern.
+
+    Only touched from the event loop, so it needs no lock.
+    """
+
+    def __init__(self, pattern: "re.Pattern", count: int, profiler: SamplingProfiler):
+        self.pattern = pattern
+        self.remaining = count
+        self.in_flight = 0
+        self.finished = 0
+        self.profiler = profiler
+        self.done = asyncio.Event()
+
+    def begin(self, path: str) -> bool:
+        """Whether a request is one to profile; if so, sampling runs until it ends."""
+        if self.remaining <= 0 or not self.pattern.search(path):
+            return False
+        self.remaining -= 1
+        self.in_flight += 1
+        self.profiler.paused = False
+        return True
+
+    def end(self) -> None:
+        self.in_flight -= 1
+        self.finished += 1
+        if not self.in_flight:
+            self.profiler.paused = True
+            if not self.remaining:
+                self.done.set()
+
+
+_busy = threading.Lock()
+_capture: Optional[RequestCapture] = None
+_baseline: Optional[tracemalloc.Snapshot] = None
+_baseline_taken = 0.0
+
+
+async def profile_for(
+    seconds: float,
+    interval: float = PROFILE_INTERVAL_MS / 1000,
+    include_idle: bool = False,
+) -> Profile:
+    """Sample every thread for a number of seconds.
+
+    Raises:
+        ProfilerBusyError: If another profile is running
+    """
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running in this worker")
+    try:
+        profiler = SamplingProfiler(interval, include_idle)
+        profiler.start()
+        try:
+            await asyncio.sleep(min(seconds, PROFILE_MAX_SECONDS))
+        finally:
+            profile = await asyncio.to_thread(profiler.stop)
+        return profile
+    finally:
+        _busy.release()
+
+
+async def profile_requests(
+    pattern: str,
+    count: int,
+    timeout: float,
+    interval: float = PROFILE_INTERVAL_MS / 1000,
+    include_idle: bool = False,
+) -> Profile:
+    """Sample every thread while the next `count` matching requests are handled.
+
+    Returns after the last of them completes, or after `timeout` seconds
+    with whatever was collected.
+
+    Raises:
+        ValueError: If the pattern is not a valid regular expression, or
+            count is not positive
+        ProfilerBusyError: If another profile is running
+    """
+    global _capture
+    if count < 1:
+        raise ValueError("count must be at least 1")
+    try:
+        compiled = re.compile(pattern)
+    except re.error as e:
+        raise ValueError(f"Invalid route pattern: {str(e)}")
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running in this worker")
+    try:
+        profiler = SamplingProfiler(interval, include_idle)
+        profiler.paused = True
+        capture = RequestCapture(compiled, count, profiler)
+        profiler.start()
+        _capture = capture
+        try:
+            await asyncio.wait_for(
+                capture.done.wait(), timeout=min(timeout, PROFILE_MAX_SECONDS)
+            )
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            _capture = None
+            profile = await asyncio.to_thread(profiler.stop)
+        profile.requests = capture.finished
+        return profile
+    finally:
+        _busy.release()
+
+
+class ProfilingMiddleware:
+    """Turns sampling on while a request picked by profile_requests is handled."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        capture = _capture
+        if (
+            capture is None
+            or scope["type"] != "http"
+            or not capture.begin(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            capture.end()
+
+
+def memory_snapshot(group_by: str = "lineno", limit: int = 25) -> Dict[str, Any]:
+    """Snapshot traced memory and diff it against the previous snapshot.
+
+    The first call starts tracemalloc, so it only sees allocations made
+    from then on; call it again later to see what grew in between.
+
+    Raises:
+        ValueError: For a group_by not in MEMORY_GROUPS
+    """
+    global _baseline, _baseline_taken
+    if group_by not in MEMORY_GROUPS:
+        raise ValueError(
+            f"group_by must be one of {', '.join(MEMORY_GROUPS)}, not {group_by!r}"
+        )
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [
+            # Including the snapshotting itself
+            tracemalloc.Filter(False, tracemalloc.__file__, all_frames=True),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ]
+    )
+    current, peak = tracemalloc.get_traced_memory()
+    now = time.monotonic()
+    result = {
+        "traced_bytes": current,
+        "peak_bytes": peak,
+        "tracemalloc_overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+        "top": [
+            {
+                "where": _where(stat.traceback, group_by),
+                "size_bytes": stat.size,
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics(group_by)[:limit]
+        ],
+        "growth": None,
+    }
+    if _baseline is not None:
+        result["growth"] = {
+            "since_seconds": round(now - _baseline_taken, 1),
+            "top": [
+                {
+                    "where": _where(stat.traceback, group_by),
+                    "size_diff_bytes": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                    "size_bytes": stat.size,
+                }
+                for stat in snapshot.compare_to(_baseline, group_by)[:limit]
+            ],
+        }
+    _baseline, _baseline_taken = snapshot, now
+    return result
+
+
+def stop_memory_tracing() -> None:
+    """Stop tracemalloc and forget the last snapshot."""
+    global _baseline
+    _baseline = None
+    tracemalloc.stop()
+
+
+def _frames(frame: Optional[FrameType]) -> List[str]:
+    """Labels of a frame and its callers, root first."""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        labels.append(
+            f"{_short_path(code.co_filename)}:"
+            f"{getattr(code, 'co_qualname', code.co_name)}"
+        )
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def _is_idle(frame: FrameType) -> bool:
+    """Whether a thread's innermost frame is one of waiting for work."""
+    return (Path(frame.f_code.co_filename).name, frame.f_code.co_name) in _IDLE_FRAMES
+
+
+def _short_path(filename: str) -> str:
+    """App files relative to the app, library files from their package on."""
+    path = Path(filename)
+    if path.is_relative_to(_APP_ROOT) and "site-packages" not in path.parts:
+        return str(path.relative_to(_APP_ROOT))
+    parts = path.parts
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            return "/".join(parts[parts.index(marker) + 1 :])
+    # The standard library, e.g. asyncio/base_events.py
+    return "/".join(parts[-2:]) if len(parts) > 1 else filename
+
+
+def _where(traceback: tracemalloc.Traceback, group_by: str) -> List[str]:
+    """Allocation site(s) of a statistic, innermost first."""
+    # tracemalloc lists frames oldest first
+    innermost_first = list(reversed(traceback))
+    if group_by == "filename":
+        return [_short_path(innermost_first[0].filename)]
+    if group_by == "lineno":
+        innermost_first = innermost_first[:1]
+    return [
+        f"{_short_path(frame.filename)}:{frame.lineno}" for frame in innermost_first
+    ]
@@ -0,0 +1,282 @@
+"""Per-statement query statistics and the slow-query log.
+
+Every statement run through DatabaseManager is fingerprinted (literals,
+placeholders and value lists normalized by tracing.sanitize_sql) and its
+calls, rows and latency are accumulated in process, per fingerprint. The
+table is served, per worker, at /admin/db/queries.
+
+Statements slower than SLOW_QUERY_MS are logged with the DatabaseManager
+method that ran them. The first time a fingerprint is slow its plan is
+captured with EXPLAIN (without ANALYZE, so nothing runs twice) and logged
+too, and kept with its statistics.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from tracing import sanitize_sql
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are logged; 0 turns the slow-query log off
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+# Capture the plan of a statement the first time it is slow
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() == "true"
+
+# Distinct statements tracked per worker; later ones are only counted
+MAX_FINGERPRINTS = int(os.getenv("QUERY_STATS_MAX_FINGERPRINTS", "1000"))
+
+# Latest latencies kept per statement for percentiles
+SAMPLES_KEPT = 500
+
+# Orderings offered by top(), mapped to the statistic they sort by
+QUERY_ORDERS = {
+    "total": "total_ms",
+    "mean": "mean_ms",
+    "p99": "p99_ms",
+    "max": "max_ms",
+    "calls": "calls",
+    "rows": "rows",
+}
+
+# Statements EXPLAIN accepts
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+class _QueryStats:
+    """Accumulated statistics of one fingerprint."""
+
+    def __init__(self, statement: str, method: str):
+        self.statement = statement
+        self.method = method
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.slow_calls = 0
+        self.samples: Deque[float] = deque(maxlen=SAMPLES_KEPT)
+        self.plan: Optional[str] = None
+        self.explained = False
+
+
+_stats: Dict[str, _QueryStats] = {}
+_stats_lock = threading.Lock()
+_untracked_calls = 0
+
+
+def fingerprint(statement: str) -> str:
+    """Short stable id of a sanitized statement."""
+    return hashlib.sha1(statement.encode()).hexdigest()[:16]
+
+
+def record(
+    statement: str, method: str, seconds: float, rows: int, failed: bool
+) -> Optional[_QueryStats]:
+    """Add one execution of a sanitized statement to its fingerprint.
+
+    Returns:
+        The fingerprint's statistics, or None if the table is full
+    """
+    global _untracked_calls
+    key = fingerprint(statement)
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            if len(_stats) >= MAX_FINGERPRINTS:
+                _untracked_calls += 1
+                return None
+            stats = _stats[key] = _QueryStats(statement, method)
+        stats.calls += 1
+        stats.errors += failed
+        stats.rows += max(rows, 0)
+        stats.total_seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        stats.samples.append(seconds)
+        if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+            stats.slow_calls += 1
+    return stats
+
+
+def top(order_by: str = "total", limit: int = 20) -> Dict[str, Any]:
+    """The statements of this worker that cost the most.
+
+    Args:
+        order_by: One of QUERY_ORDERS
+        limit: Number of statements returned
+
+    Raises:
+        ValueError: For an unknown ordering
+    """
+    if order_by not in QUERY_ORDERS:
+        raise ValueError(
+            f"order_by must be one of {', '.join(QUERY_ORDERS)}, not {order_by!r}"
+        )
+    with _stats_lock:
+        queries = [_summary(key, stats) for key, stats in _stats.items()]
+        untracked = _untracked_calls
+    sort_key = QUERY_ORDERS[order_by]
+    queries.sort(key=lambda query: query[sort_key] or 0, reverse=True)
+    return {
+        "pid": os.getpid(),
+        "slow_query_ms": SLOW_QUERY_MS or None,
+        "fingerprints": len(queries),
+        "untracked_calls": untracked,
+        "queries": queries[:limit],
+    }
+
+
+def _summary(key: str, stats: _QueryStats) -> Dict[str, Any]:
+    """Statistics of one fingerprint in milliseconds."""
+    ordered = sorted(stats.samples)
+
+    def ms(seconds: float) -> float:
+        return round(seconds * 1000, 2)
+
+    def percentile(fraction: float) -> Optional[float]:
+        if not ordered:
+            return None
+        return ms(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))])
+
+    return {
+        "fingerprint": key,
+        "method": stats.method,
+        "statement": stats.statement,
+        "calls": stats.calls,
+        "errors": stats.errors,
+        "rows": stats.rows,
+        "total_ms": ms(stats.total_seconds),
+        "mean_ms": ms(stats.total_seconds / stats.calls) if stats.calls else None,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": ms(stats.max_seconds),
+        "slow_calls": stats.slow_calls,
+        "plan": stats.plan,
+    }
+
+
+def reset() -> None:
+    """Forget every statistic, e.g. between load test phases."""
+    global _untracked_calls
+    with _stats_lock:
+        _stats.clear()
+        _untracked_calls = 0
+
+
+def _explain(connection: Any, query: Any, vars: Any) -> Optional[str]:
+    """The plan Postgres picks for a statement, without running it.
+
+    Runs in a savepoint so a statement EXPLAIN rejects does not abort the
+    caller's transaction.
+    """
+    prefix = b"EXPLAIN " if isinstance(query, bytes) else "EXPLAIN "
+    savepoint = not connection.autocommit
+    cur = connection.cursor()
+    try:
+        if savepoint:
+            cur.execute("SAVEPOINT query_stats_explain")
+        try:
+            cur.execute(prefix + query, vars)
+            plan = "\n".join(row[0] for row in cur.fetchall())
+        except Exception as e:
+            if savepoint:
+                cur.execute("ROLLBACK TO SAVEPOINT query_stats_explain")
+            logger.debug(f"Could not explain query: {str(e)}")
+            plan = None
+        if savepoint:
+            cur.execute("RELEASE SAVEPOINT query_stats_explain")
+        return plan
+    finally:
+        cur.close()
+
+
+class StatsCursor:
+    """DB-API cursor wrapper recording each execute in the query statistics."""
+
+    def __init__(self, cursor: Any, connection: Any, method: str):
+        self._cursor = cursor
+        self._connection = connection
+        self._method = method
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self) -> "StatsCursor":
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc_info) -> Any:
+        return self._cursor.__exit__(*exc_info)
+
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = self._cursor.execute(query, vars)
+            failed = False
+            return result
+        finally:
+            seconds = time.perf_counter() - started
+            statement = sanitize_sql(query)
+            stats = record(
+                statement,
+                self._method,
+                seconds,
+                -1 if failed else self._cursor.rowcount,
+                failed,
+            )
+            if not failed and SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+                self._log_slow(stats, statement, seconds, query, vars)
+
+    def _log_slow(
+        self,
+        stats: Optional[_QueryStats],
+        statement: str,
+        seconds: float,
+        query: Any,
+        vars: Any,
+    ) -> None:
+        key = fingerprint(statement)
+        logger.warning(
+            f"Slow query in {self._method} ({seconds * 1000:.0f} ms) "
+            f"[{key}]: {statement}"
+        )
+        if stats is None or stats.explained or not SLOW_QUERY_EXPLAIN:
+            return
+        # Only the first slow call of a statement pays for the plan
+        stats.explained = True
+        if not statement.upper().startswith(_EXPLAINABLE):
+            return
+        try:
+            stats.plan = _explain(self._connection, query, vars)
+        except Exception as e:
+            logger.error(f"Error explaining slow query [{key}]: {str(e)}")
+            return
+        if stats.plan:
+            logger.warning(f"Plan for [{key}]:\n{stats.plan}")
+
+
+class StatsConnection:
+    """DB-API connection wrapper whose cursors are StatsCursors."""
+
+    def __init__(self, connection: Any, method: str):
+        self._connection = connection
+        self._method = method
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs) -> StatsCursor:
+        return StatsCursor(
+            self._connection.cursor(*args, **kwargs), self._connection, self._method
+        )
@@ -0,0 +1,36 @@
+import threading
+import time
+from typing import Hashable, Optional
+
+from cache import LRUCache
+
+
+class RateLimiter:
+    """Token-bucket rate limiter keyed by e.g. client IP or username.
+
+    Each key may spend ``burst`` attempts at once and regains ``rate`` attempts
+    per second. Buckets live in an LRU, so memory stays bounded; a key evicted
+    from it simply starts again with a full bucket. State is per process.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = LRUCache(maxsize=max_keys)
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Hashable) -> Optional[float]:
+        """Spend one attempt for key.
+
+        Returns:
+            None if allowed, otherwise the seconds until the next attempt is
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (float(self.burst), now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets.set(key, (tokens, now))
+                return (1 - tokens) / self.rate
+            self._buckets.set(key, (tokens - 1, now))
+            return None
@@ -0,0 +1,91 @@
+import html
+import logging
+import os
+from typing import Dict, List, Optional
+
+from images import image_links
+from tracing import traced
+
+try:
+    import markdown
+    import nh3
+except ImportError:  # optional; without them pages render notes in the browser
+    markdown = None
+    nh3 = None
+
+logger = logging.getLogger(__name__)
+
+NOTES_SERVER_RENDER = os.getenv("NOTES_SERVER_RENDER", "true").lower() == "true"
+
+# Close to what marked.js renders in the browser: tables, fenced code,
+# footnotes and definition lists
+MARKDOWN_EXTENSIONS = ["extra", "sane_lists"]
+
+
+def server_render_enabled() -> bool:
+    """Whether notes are pre-rendered to HTML when they are stored."""
+    return NOTES_SERVER_RENDER and markdown is not None and nh3 is not None
+
+
+def render_markdown(notes: str) -> str:
+    """Convert notes markdown to HTML with anything unsafe stripped.
+
+    Generated notes are model output, so raw HTML in them (scripts, event
+    handlers, javascript: links) must not reach the page.
+    """
+    rendered = markdown.markdown(notes, extensions=MARKDOWN_EXTENSIONS)
+    return nh3.clean(rendered)
+
+
+def render_figures(username: str, folder: str, images: List[Dict], alt: str) -> str:
+    """Figure markup for a note's images, pointing at their renditions."""
+    figures = []
+    for image in image_links(username, folder, images):
+        filename = image.get("filename") if isinstance(image, dict) else None
+        if not filename:
+            continue
+        fallback = f"/images/{username}/images/{folder}/{filename}"
+        figures.append(
+            '<figure class="figure">'
+            f'<a href="{html.escape(image.get("original", fallback))}" target="_blank">'
+            f'<img src="{html.escape(image.get("src", fallback))}"'
+            f' srcset="{html.escape(image.get("srcset", ""))}"'
+            ' sizes="(max-width: 768px) 100vw, 960px"'
+            ' loading="lazy" decoding="async"'
+            f' alt="{html.escape(alt)}" class="img-fluid mb-2">'
+            "</a>"
+            '<figcaption class="figure-caption text-center">'
+            f'{html.escape(str(image.get("caption") or ""))}'
+            "</figcaption>"
+            "</figure>"
+        )
+    return "".join(figures)
+
+
+@traced()
+def render_note(
+    notes: str, images: List[Dict], username: str, folder: str, alt: str
+) -> Optional[Dict[str, str]]:
+    """Pre-render a note for inlining into its page.
+
+    Args:
+        notes: Markdown notes
+        images: The note's images (filename and caption)
+        username: Owner of the PDF the images were extracted from
+        folder: Extracted-images folder name
+        alt: Alt text for the images
+
+    Returns:
+        Optional[Dict[str, str]]: ``notes_html`` and ``images_html``, or None
+        if server rendering is disabled or fails
+    """
+    if not server_render_enabled():
+        return None
+    try:
+        return {
+            "notes_html": render_markdown(notes),
+            "images_html": render_figures(username, folder, images or [], alt),
+        }
+    except Exception as e:
+        logger.error(f"Error rendering notes HTML: {str(e)}")
+        return None
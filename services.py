@@ -1,44 +1,58 @@
+import asyncio
 import logging
+import os
+from concurrent.futures import Executor
 from pathlib import Path
-from typing import Dict, Optional, Tuple, List, Any
+from typing import TYPE_CHECKING, Dict, Optional, Tuple, List, Any
 from datetime import datetime, timezone
 import hashlib
 from fastapi import UploadFile
-import bcrypt
-from google.generativeai.types.file_types import File as GeminiFile
-from db import DatabaseManager, hash_password, verify_password
+from db import DatabaseManager
 from pdf import NoteGenerator
-from file_utils import save_uploaded_file, get_image_files
+from file_utils import save_uploaded_file, get_image_files, image_folders
+from images import create_renditions
+from passwords import PasswordHasher
+from rendering import render_note
+import storage
+from storage import QuotaExceededError
+import llm_usage
+from llm_usage import BudgetExceededError
+from metrics import PDF_STAGE_SECONDS, timed
+from tracing import in_context, traced
 import shutil
 import json
+import re
+import time
 
-logger = logging.getLogger(__name__)
-
-
-class ServiceManager:
-    """Singleton to manage shared resources."""
+if TYPE_CHECKING:
+    from google.generativeai.types.file_types import File as GeminiFile
 
-    _instance = None
-    db: DatabaseManager  # Define the class attribute with type hint
-
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance.db = DatabaseManager()
-        return cls._instance
-
-    def __init__(self):
-        """Initialize instance attributes if not already set."""
-        if not hasattr(self, "db"):
-            self.db = DatabaseManager()
+logger = logging.getLogger(__name__)
 
 
 class NoteService:
-    def __init__(self):
-        self.service_manager = ServiceManager()
-        self.db = self.service_manager.db
-        self.note_generator = NoteGenerator()
+    def __init__(self, db: DatabaseManager, note_generator: NoteGenerator):
+        self.db = db
+        self.note_generator = note_generator
+
+    def backfill_notes_html(
+        self, kind: str, result: Dict, images: List[Dict], alt: str
+    ) -> None:
+        """Render and store HTML for notes stored before it was pre-rendered."""
+        if result.get("has_html"):
+            return
+        folder = Path(result["pdf_path"]).stem + "_18e1b007"
+        rendered = render_note(result["notes"], images, result["username"], folder, alt)
+        if rendered is None:
+            return
+        note_id = result["topicid"] if kind == "topic" else result["subtopicid"]
+        try:
+            self.db.store_notes_html(kind, note_id, rendered)
+        except Exception as e:
+            # The page falls back to rendering in the browser
+            logger.error(f"Error storing notes HTML: {str(e)}")
 
+    @traced()
     async def get_topic_notes(self, chapter: str, topic: str) -> Tuple[Dict, int]:
         """Get or generate topic notes."""
         try:
@@ -56,6 +70,7 @@ class NoteService:
                 logger.info(
                     f"No existing notes found for topic: {chapter}/{topic}. Generating new notes..."
                 )
+                llm_usage.check_budget(self.db, result["username"])
 
                 try:
                     # Generate new notes
@@ -68,15 +83,28 @@ class NoteService:
                         result["username"], pdf_path, pdf_path.stem
                     )
 
-                    generated_result = self.note_generator.generate_topic_notes(
-                        gemini_file, chapter, topic, image_files or []
+                    with llm_usage.attribute(
+                        username=result["username"],
+                        pdfid=result["pdfid"],
+                        chapter=chapter,
+                    ):
+                        generated_result = self.note_generator.generate_topic_notes(
+                            gemini_file, chapter, topic, image_files or []
+                        )
+
+                    # Store the generated notes with their pre-rendered HTML
+                    rendered = render_note(
+                        generated_result["notes"],
+                        generated_result["images"],
+                        result["username"],
+                        pdf_path.stem + "_18e1b007",
+                        "Topic image",
                     )
-
-                    # Store the generated notes
                     self.db.store_topic_notes(
                         result["topicid"],
                         generated_result["notes"],
                         generated_result["images"],
+                        rendered,
                     )
 
                     logger.info(
@@ -95,6 +123,9 @@ class NoteService:
 
             # Return existing notes
             logger.info(f"Returning existing notes for topic: {chapter}/{topic}")
+            self.backfill_notes_html(
+                "topic", result, result["images"] or [], "Topic image"
+            )
             return {
                 "notes": result["notes"],
                 "images": result["images"] or [],
@@ -102,10 +133,14 @@ class NoteService:
                 "pdf_folder": Path(result["pdf_path"]).stem + "_18e1b007",
             }, 200
 
+        except BudgetExceededError as e:
+            return {"error": str(e)}, 429
+
         except Exception as e:
             logger.error(f"Error in get_topic_notes: {str(e)}")
             return {"error": "Internal server error"}, 500
 
+    @traced()
     async def get_subtopic_notes(
         self, chapter: str, topic: str, subtopic: str
     ) -> Tuple[Dict, int]:
@@ -125,6 +160,7 @@ class NoteService:
                 logger.info(
                     f"Generating new notes for subtopic: {chapter}/{topic}/{subtopic}"
                 )
+                llm_usage.check_budget(self.db, result["username"])
                 try:
                     pdf_path = Path(result["pdf_path"])
                     gemini_file = await self.get_valid_gemini_file(
@@ -137,18 +173,33 @@ class NoteService:
                     )
 
                     # Generate notes using NoteGenerator
-                    generated_result = self.note_generator.generate_subtopic_notes(
-                        gemini_file, chapter, topic, subtopic, image_files or []
-                    )
+                    with llm_usage.attribute(
+                        username=result["username"],
+                        pdfid=result["pdfid"],
+                        chapter=chapter,
+                    ):
+                        generated_result = self.note_generator.generate_subtopic_notes(
+                            gemini_file, chapter, topic, subtopic, image_files or []
+                        )
 
                     # Ensure images is a list of dicts with filename and caption
                     images_to_store = generated_result.get("images", [])
                     if not isinstance(images_to_store, list):
                         images_to_store = []
 
-                    # Store the generated notes
+                    # Store the generated notes with their pre-rendered HTML
+                    rendered = render_note(
+                        generated_result["notes"],
+                        images_to_store,
+                        result["username"],
+                        pdf_path.stem + "_18e1b007",
+                        "Subtopic image",
+                    )
                     self.db.store_subtopic_notes(
-                        result["subtopicid"], generated_result["notes"], images_to_store
+                        result["subtopicid"],
+                        generated_result["notes"],
+                        images_to_store,
+                        rendered,
                     )
 
                     logger.info(
@@ -176,6 +227,7 @@ class NoteService:
             elif not isinstance(images, list):
                 images = []
 
+            self.backfill_notes_html("subtopic", result, images, "Subtopic image")
             return {
                 "notes": result["notes"],
                 "images": images,
@@ -183,10 +235,14 @@ class NoteService:
                 "pdf_folder": Path(result["pdf_path"]).stem + "_18e1b007",
             }, 200
 
+        except BudgetExceededError as e:
+            return {"error": str(e)}, 429
+
         except Exception as e:
             logger.error(f"Error in get_subtopic_notes: {str(e)}")
             return {"error": "Internal server error"}, 500
 
+    @traced()
     async def get_valid_gemini_file(self, pdf_id: int, pdf_path: Path):
         """Get or create a valid Gemini file."""
         try:
@@ -201,19 +257,13 @@ class NoteService:
                         stored_file["gemini_file"]
                     )
 
-            # Get username for the PDF
-            pdf_info = self.db.get_pdf_info(pdf_id)
-            if not pdf_info:
+            if not self.db.get_pdf_info(pdf_id):
                 raise ValueError(f"PDF not found with ID: {pdf_id}")
 
             # Upload new file if not found or expired
             new_file = self.note_generator.upload_to_gemini(pdf_path)
             file_dict = self.note_generator.create_gemini_file_dict(new_file)
-            self.db.store_gemini_file(
-                str(pdf_path),
-                pdf_info["username"],  # Use username from PDF info
-                file_dict,
-            )
+            self.db.store_gemini_file(pdf_id, file_dict)
             return new_file
 
         except Exception as e:
@@ -222,10 +272,28 @@ class NoteService:
 
 
 class UserService:
-    def __init__(self):
-        self.service_manager = ServiceManager()
-        self.db = self.service_manager.db
+    def __init__(self, db: DatabaseManager, password_hasher: PasswordHasher):
+        self.db = db
+        self.password_hasher = password_hasher
+
+    async def _check_password(self, user: Dict, password: str) -> bool:
+        """Verify a login, upgrading the stored hash if its cost is outdated."""
+        if not await self.password_hasher.verify(password, user["password_hash"]):
+            return False
+
+        if self.password_hasher.needs_rehash(user["password_hash"]):
+            try:
+                new_hash = await self.password_hasher.hash(password)
+                self.db.update_user_profile(
+                    user["username"], {"password_hash": new_hash}
+                )
+                logger.info(f"Rehashed password for user: {user['username']}")
+            except Exception as e:
+                # The old hash still works; try again on the next login
+                logger.error(f"Error rehashing password: {str(e)}")
+        return True
 
+    @traced()
     async def login_user(self, username: str, password: str) -> Tuple[Dict, int]:
         """Handle user login by username."""
         try:
@@ -233,7 +301,7 @@ class UserService:
             if not user:
                 return {"error": "User not found"}, 404
 
-            if verify_password(password, user["password_hash"]):
+            if await self._check_password(user, password):
                 return {
                     "message": "Login successful",
                     "username": user["username"],
@@ -245,6 +313,7 @@ class UserService:
             logger.error(f"Error in login_user: {str(e)}")
             return {"error": "Internal server error"}, 500
 
+    @traced()
     async def login_user_by_email(self, email: str, password: str) -> Tuple[Dict, int]:
         """Handle user login by email."""
         try:
@@ -252,7 +321,7 @@ class UserService:
             if not user:
                 return {"error": "User not found"}, 404
 
-            if verify_password(password, user["password_hash"]):
+            if await self._check_password(user, password):
                 return {
                     "message": "Login successful",
                     "username": user["username"],
@@ -273,6 +342,7 @@ class UserService:
             logger.error(f"Error checking email existence: {str(e)}")
             raise
 
+    @traced()
     async def register_user(
         self, username: str, password: str, email: str
     ) -> Tuple[Dict, int]:
@@ -282,7 +352,7 @@ class UserService:
                 return {"error": "Username already exists"}, 400
 
             # Hash password using the utility function
-            password_hash = hash_password(password)
+            password_hash = await self.password_hasher.hash(password)
 
             # Store user with email
             self.db.create_user(username, password_hash, email)
@@ -294,11 +364,38 @@ class UserService:
 
 
 class FileService:
-    def __init__(self):
-        self.service_manager = ServiceManager()
-        self.db = self.service_manager.db
-        self.note_generator = NoteGenerator()
+    def __init__(
+        self,
+        db: DatabaseManager,
+        note_generator: NoteGenerator,
+        image_executor: Executor,
+    ):
+        self.db = db
+        self.note_generator = note_generator
+        self.image_executor = image_executor
+
+    def render_images(self, images_dir: Path) -> None:
+        """Start rendering thumbnails for extracted images in the process pool.
+
+        Not awaited: any rendition still missing when requested is generated
+        on demand.
+        """
+
+        def log_failure(future) -> None:
+            # Pending renders are cancelled when the executor shuts down
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error:
+                logger.error(f"Error rendering images in {images_dir}: {str(error)}")
+
+        try:
+            future = self.image_executor.submit(create_renditions, images_dir)
+            future.add_done_callback(log_failure)
+        except Exception as e:
+            logger.error(f"Error scheduling image renditions: {str(e)}")
 
+    @traced()
     async def process_pdf_upload(
         self, file: UploadFile, username: str
     ) -> Tuple[Dict, int]:
@@ -312,7 +409,14 @@ class FileService:
 
             if filename is None:
                 return {"error": "No filename provided"}, 400
-            pdf_path = await save_uploaded_file(file, username, filename)
+
+            # Refuse before writing anything if the upload cannot fit
+            used = self.db.get_storage_usage(username)
+            storage.check_quota(used, file.size or 0, 1)
+            max_bytes, max_files = storage.remaining(used)
+            with timed(PDF_STAGE_SECONDS, stage="save"):
+                pdf_path = await save_uploaded_file(file, username, filename, max_bytes)
+            pdf_bytes = pdf_path.stat().st_size
 
             # Create images directory for this PDF
             pdf_base_name = Path(str(filename)).stem
@@ -321,26 +425,37 @@ class FileService:
             )
             images_dir.mkdir(parents=True, exist_ok=True)
 
-            # Extract images from PDF
+            # Extract images from PDF, as many as the quota leaves room for
             logger.info(f"Extracting images from PDF: {pdf_path}")
             try:
-                image_files = self.note_generator.extract_images_from_pdf(
-                    pdf_path, images_dir
-                )
+                with timed(PDF_STAGE_SECONDS, stage="extract_images"):
+                    image_files = self.note_generator.extract_images_from_pdf(
+                        pdf_path,
+                        images_dir,
+                        max_files=None if max_files is None else max_files - 1,
+                        max_bytes=None if max_bytes is None else max_bytes - pdf_bytes,
+                    )
                 logger.info(f"Extracted {len(image_files)} images to {images_dir}")
+                self.render_images(images_dir)
             except Exception as e:
                 logger.error(f"Error extracting images: {str(e)}")
                 image_files = []
 
             # Create PDF record in database
-            pdf_id = self.db.create_pdf_record(str(pdf_path), username, filename)
+            with timed(PDF_STAGE_SECONDS, stage="db_record"):
+                pdf_id = self.db.create_pdf_record(str(pdf_path), username, filename)
+                self.db.record_pdf_usage(pdf_id, pdf_bytes, *storage.usage(images_dir))
 
             # Upload to Gemini and extract structure
-            gemini_file = self.note_generator.upload_to_gemini(pdf_path)
-            structure = self.note_generator.extract_pdf_structure(gemini_file)
+            with timed(PDF_STAGE_SECONDS, stage="gemini_upload"):
+                gemini_file = self.note_generator.upload_to_gemini(pdf_path)
+            with timed(PDF_STAGE_SECONDS, stage="extract_structure"):
+                with llm_usage.attribute(username=username, pdfid=pdf_id):
+                    structure = self.note_generator.extract_pdf_structure(gemini_file)
 
             # Store PDF structure in database
-            self.db.create_pdf_structure(pdf_id, structure)
+            with timed(PDF_STAGE_SECONDS, stage="db_structure"):
+                self.db.create_pdf_structure(pdf_id, structure)
 
             return {
                 "message": "PDF processed successfully",
@@ -349,6 +464,10 @@ class FileService:
                 "images": image_files,
             }, 200
 
+        except QuotaExceededError as e:
+            logger.warning(f"Rejected upload from {username}: {str(e)}")
+            return {"error": str(e)}, 413
+
         except Exception as e:
             logger.error(f"Error processing PDF upload: {str(e)}")
             # Clean up any partially created directories if they exist
@@ -356,6 +475,7 @@ class FileService:
                 shutil.rmtree(images_dir)
             return {"error": str(e)}, 500
 
+    @traced()
     async def get_user_pdfs(self, username: str) -> Tuple[Dict, int]:
         """Get list of user's PDFs."""
         try:
@@ -375,8 +495,9 @@ class FileService:
             logger.error(f"Error getting user PDFs: {str(e)}")
             return {"error": "Internal server error"}, 500
 
+    @traced()
     async def process_pdf_content(
-        self, pdf_id: int, pdf_path: Path, gemini_file: GeminiFile
+        self, pdf_id: int, pdf_path: Path, gemini_file: "GeminiFile"
     ) -> List[Dict]:
         """Process PDF content to extract chapters and topics."""
         try:
@@ -395,8 +516,13 @@ class FileService:
             logger.error(f"Error processing PDF content: {str(e)}")
             raise
 
+    @traced()
     async def delete_pdf(self, pdf_id: int, username: str) -> Tuple[Dict, int]:
-        """Delete PDF and associated data."""
+        """Delete a PDF and its associated data.
+
+        The PDF is only marked deleted here, which is quick however large
+        the book is; reclaim_deleted_pdfs removes its rows and files later.
+        """
         try:
             # Verify ownership
             pdf_info = self.db.get_pdf_info(pdf_id)
@@ -406,30 +532,178 @@ class FileService:
             if pdf_info["username"] != username:
                 return {"error": "Unauthorized"}, 403
 
-            # Delete the PDF file and its data
-            pdf_path = Path(pdf_info["pdf_path"])
-
-            # Delete from database first
-            self.db.delete_pdf(pdf_id)
-
-            # Delete the physical file if it exists
-            if pdf_path.exists():
-                pdf_path.unlink()
-
-                # Delete associated image folder if it exists
-                image_folder = pdf_path.parent / f"{pdf_path.stem}_18e1b007"
-                if image_folder.exists() and image_folder.is_dir():
-                    import shutil
-
-                    shutil.rmtree(image_folder)
+            if not self.db.soft_delete_pdf(pdf_id):
+                return {"error": "PDF not found"}, 404
 
-            logger.info(f"Successfully deleted PDF: {pdf_path}")
+            logger.info(f"Successfully deleted PDF: {pdf_info['pdf_path']}")
             return {"message": "PDF deleted successfully"}, 200
 
         except Exception as e:
             logger.error(f"Error deleting PDF: {str(e)}")
             return {"error": "Internal server error"}, 500
 
+    @traced()
+    def reclaim_deleted_pdfs(self, limit: int = 10, batch_size: int = 500) -> int:
+        """Remove soft-deleted PDFs: Gemini upload, files, then rows.
+
+        Runs as a background job. Each step tolerates having been done
+        already, so a PDF that fails part-way is retried on the next run.
+
+        Returns:
+            int: Number of PDFs fully reclaimed
+        """
+        reclaimed = 0
+        for pdf in self.db.get_deleted_pdfs(limit):
+            try:
+                gemini_file = pdf["gemini_file"] or {}
+                if gemini_file.get("name"):
+                    try:
+                        self.note_generator.delete_gemini_file(gemini_file["name"])
+                    except Exception as e:
+                        # Already expired or gone; Gemini drops it after 48h anyway
+                        logger.warning(
+                            f"Could not delete Gemini file {gemini_file['name']}: {str(e)}"
+                        )
+
+                self.remove_pdf_files(pdf["username"], Path(pdf["pdf_path"]))
+                self.db.purge_pdf_rows(pdf["pdfid"], batch_size)
+                reclaimed += 1
+            except Exception as e:
+                logger.error(f"Error reclaiming PDF {pdf['pdfid']}: {str(e)}")
+        if reclaimed:
+            logger.info(f"Reclaimed {reclaimed} deleted PDFs")
+        return reclaimed
+
+    def remove_pdf_files(self, username: str, pdf_path: Path) -> None:
+        """Delete a PDF file and its image folders unless a live PDF still uses them."""
+        live_paths = {Path(path) for path in self.db.get_pdf_paths(username)}
+        if pdf_path not in live_paths:
+            pdf_path.unlink(missing_ok=True)
+
+        if pdf_path.stem in {path.stem for path in live_paths}:
+            return
+        for image_folder in image_folders(username, pdf_path.stem):
+            shutil.rmtree(image_folder, ignore_errors=True)
+            logger.info(f"Deleted image folder: {image_folder}")
+        for image_folder in storage.archived_folders(username, pdf_path.stem):
+            storage.archive_path(image_folder).unlink(missing_ok=True)
+            logger.info(f"Deleted image archive of {image_folder}")
+
+    @traced()
+    def refresh_storage(self) -> Dict[str, int]:
+        """Archive cold image folders and re-measure every PDF's disk usage.
+
+        Runs as a background job. Usage recorded at upload time misses
+        renditions written later and archiving, so it is measured again
+        here; this also fills it in for PDFs uploaded before accounting.
+
+        Returns:
+            Dict[str, int]: Number of PDFs measured and folders archived
+        """
+        uploads = Path("uploads")
+        measured = archived = 0
+        if not uploads.is_dir():
+            return {"measured": 0, "archived": 0}
+
+        now = time.time()
+        for user_dir in sorted(uploads.iterdir()):
+            if not user_dir.is_dir() or user_dir.name.startswith("."):
+                continue
+            username = user_dir.name
+            for pdf in self.db.get_user_pdfs(username):
+                try:
+                    pdf_path = Path(pdf["pdf_path"])
+                    image_bytes = image_files = 0
+                    for folder in image_folders(username, pdf_path.stem):
+                        if storage.is_cold(folder, now):
+                            storage.archive_folder(folder)
+                            archived += 1
+                        else:
+                            folder_bytes, folder_files = storage.usage(folder)
+                            image_bytes += folder_bytes
+                            image_files += folder_files
+                    for folder in storage.archived_folders(username, pdf_path.stem):
+                        image_bytes += storage.archive_path(folder).stat().st_size
+                        image_files += 1
+
+                    pdf_bytes = pdf_path.stat().st_size if pdf_path.is_file() else 0
+                    self.db.record_pdf_usage(
+                        pdf["pdfid"], pdf_bytes, image_bytes, image_files
+                    )
+                    measured += 1
+                except Exception as e:
+                    logger.error(
+                        f"Error refreshing storage for PDF {pdf['pdfid']}: {str(e)}"
+                    )
+        logger.info(f"Measured {measured} PDFs, archived {archived} image folders")
+        return {"measured": measured, "archived": archived}
+
+    @traced()
+    def collect_garbage(self, grace_seconds: float) -> int:
+        """Delete files under uploads/ that no live PDF row refers to.
+
+        Catches what deletion never cleaned up, such as image folders left by
+        older versions or by crashed uploads. Anything modified within
+        grace_seconds is skipped, since an upload in progress writes its
+        files before its row.
+
+        Returns:
+            int: Number of files and folders deleted
+        """
+        uploads = Path("uploads")
+        if not uploads.is_dir():
+            return 0
+
+        cutoff = time.time() - grace_seconds
+        removed = 0
+        for user_dir in sorted(uploads.iterdir()):
+            if not user_dir.is_dir() or user_dir.name.startswith("."):
+                continue
+            try:
+                live_paths = {
+                    Path(path) for path in self.db.get_pdf_paths(user_dir.name)
+                }
+                live_stems = {path.stem for path in live_paths}
+
+                # Uploads interrupted before they were moved into place
+                # leave .part files behind
+                for pdf_file in [*user_dir.glob("*.pdf"), *user_dir.glob(".*.part")]:
+                    if pdf_file in live_paths or pdf_file.stat().st_mtime > cutoff:
+                        continue
+                    pdf_file.unlink(missing_ok=True)
+                    logger.info(f"Deleted orphaned PDF: {pdf_file}")
+                    removed += 1
+
+                images_dir = user_dir / "images"
+                if not images_dir.is_dir():
+                    continue
+                for entry in images_dir.iterdir():
+                    # An image folder, or the archive of one
+                    name = entry.name
+                    if entry.is_file() and name.endswith(storage.ARCHIVE_SUFFIX):
+                        name = name[: -len(storage.ARCHIVE_SUFFIX)]
+                    elif not entry.is_dir():
+                        continue
+                    stem, _, suffix = name.rpartition("_")
+                    if (
+                        not re.fullmatch(r"[0-9a-f]{8}", suffix)
+                        or stem in live_stems
+                        or entry.stat().st_mtime > cutoff
+                    ):
+                        continue
+                    if entry.is_dir():
+                        shutil.rmtree(entry, ignore_errors=True)
+                    else:
+                        entry.unlink(missing_ok=True)
+                    logger.info(f"Deleted orphaned images: {entry}")
+                    removed += 1
+            except Exception as e:
+                logger.error(f"Error collecting garbage in {user_dir}: {str(e)}")
+        if removed:
+            logger.info(f"Upload garbage collection removed {removed} entries")
+        return removed
+
+    @traced()
     async def upload_pdf(self, file: UploadFile, username: str) -> Tuple[Dict, int]:
         """Upload and process PDF file."""
         pdf_path = None
@@ -449,20 +723,38 @@ class FileService:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 filename = f"{base}_{timestamp}{ext}"
 
-            pdf_path = await save_uploaded_file(file, username, filename)
+            # Refuse before writing anything if the upload cannot fit
+            used = self.db.get_storage_usage(username)
+            storage.check_quota(used, file.size or 0, 1)
+            max_bytes, max_files = storage.remaining(used)
+            pdf_path = await save_uploaded_file(file, username, filename, max_bytes)
+            pdf_bytes = pdf_path.stat().st_size
 
             # Extract images using note_generator
-            image_folder = await self.extract_images_from_pdf(username, pdf_path)
+            image_folder = await self.extract_images_from_pdf(
+                username,
+                pdf_path,
+                max_files=None if max_files is None else max_files - 1,
+                max_bytes=None if max_bytes is None else max_bytes - pdf_bytes,
+            )
 
             try:
                 # Create initial PDF record with 'pending' status
                 pdf_id = self.db.create_pdf_record(
                     str(pdf_path), username, filename, "pending"
                 )
+                self.db.record_pdf_usage(
+                    pdf_id,
+                    pdf_bytes,
+                    *storage.usage(
+                        Path("uploads") / username / "images" / image_folder
+                    ),
+                )
 
                 # Try to process with Gemini
                 gemini_file = self.note_generator.upload_to_gemini(pdf_path)
-                structure = self.note_generator.extract_pdf_structure(gemini_file)
+                with llm_usage.attribute(username=username, pdfid=pdf_id):
+                    structure = self.note_generator.extract_pdf_structure(gemini_file)
 
                 # Store PDF structure in database
                 self.db.create_pdf_structure(pdf_id, structure)
@@ -488,6 +780,10 @@ class FileService:
                     "can_retry": True,
                 }, 500
 
+        except QuotaExceededError as e:
+            logger.warning(f"Rejected upload from {username}: {str(e)}")
+            return {"error": str(e)}, 413
+
         except Exception as e:
             # If initial upload fails, clean up everything
             if pdf_path and Path(pdf_path).exists():
@@ -497,7 +793,14 @@ class FileService:
             logger.error(f"Error processing PDF upload: {str(e)}")
             return {"error": str(e)}, 500
 
-    async def extract_images_from_pdf(self, username: str, pdf_path: Path) -> str:
+    @traced()
+    async def extract_images_from_pdf(
+        self,
+        username: str,
+        pdf_path: Path,
+        max_files: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ) -> str:
         """Extract images from PDF and save them to user's directory."""
         try:
             # Create unique folder name for images
@@ -511,10 +814,11 @@ class FileService:
 
             # Extract images using note_generator
             image_files = self.note_generator.extract_images_from_pdf(
-                pdf_path, output_folder
+                pdf_path, output_folder, max_files=max_files, max_bytes=max_bytes
             )
 
             logger.info(f"Extracted {len(image_files)} images to {output_folder}")
+            self.render_images(output_folder)
             return image_folder
 
         except Exception as e:
@@ -528,9 +832,8 @@ class FileService:
             if pdf_path.exists():
                 pdf_path.unlink()
 
-            # Delete the images folder if it exists
-            image_folder = pdf_path.parent / f"{pdf_path.stem}_18e1b007"
-            if image_folder.exists():
+            # Delete the images extracted from it
+            for image_folder in image_folders(pdf_path.parent.name, pdf_path.stem):
                 shutil.rmtree(image_folder)
 
             # Delete database record if it exists
@@ -541,6 +844,7 @@ class FileService:
         except Exception as e:
             logger.error(f"Error cleaning up failed upload: {str(e)}")
 
+    @traced()
     async def retry_pdf_processing(self, pdf_id: int) -> Tuple[Dict, int]:
         """Retry processing a failed PDF."""
         try:
@@ -557,7 +861,8 @@ class FileService:
 
             # Try processing again
             gemini_file = self.note_generator.upload_to_gemini(pdf_path)
-            chapters = await self.process_pdf_content(pdf_id, pdf_path, gemini_file)
+            with llm_usage.attribute(username=pdf_info.get("username"), pdfid=pdf_id):
+                chapters = await self.process_pdf_content(pdf_id, pdf_path, gemini_file)
 
             # Update status to 'completed' if successful
             self.db.update_pdf_status(pdf_id, "completed")
@@ -571,3 +876,131 @@ class FileService:
             logger.error(f"Error retrying PDF processing: {str(e)}")
             self.db.update_pdf_status(pdf_id, "failed", str(e))
             return {"error": str(e)}, 500
+
+
+class QuizService:
+    """Serve chapter quizzes from a pool of pre-generated variants.
+
+    Each chapter keeps up to ``QUIZ_POOL_SIZE`` unserved quizzes. A request
+    for a new quiz takes one from the pool, falls back to sampling the
+    chapter's question bank, and only calls Gemini when neither is possible.
+    """
+
+    QUESTIONS_PER_LEVEL = 5
+
+    def __init__(
+        self, db: DatabaseManager, note_service: NoteService, executor: Executor
+    ):
+        self.db = db
+        self.note_service = note_service
+        self.note_generator = note_service.note_generator
+        self.executor = executor
+        self.pool_size = int(os.getenv("QUIZ_POOL_SIZE", "2"))
+        self._refilling: set = set()
+
+    @traced()
+    async def get_quiz(self, chapter: str, new: bool = False) -> Tuple[Dict, int]:
+        """Get the chapter's current quiz, or a fresh one if new is set."""
+        try:
+            # Check if a quiz already exists and we're not forcing a new one
+            if not new:
+                existing_quiz = self.db.get_latest_quiz_with_questions(chapter)
+                if existing_quiz and existing_quiz["questions"]:
+                    return {
+                        "quiz_id": existing_quiz["quizid"],
+                        "questions": existing_quiz["questions"],
+                    }, 200
+
+            pooled_quiz = self.db.pop_pooled_quiz(chapter)
+            if pooled_quiz and pooled_quiz["questions"]:
+                logger.info(
+                    f"Serving pooled quiz {pooled_quiz['quizid']} for {chapter}"
+                )
+                return {
+                    "quiz_id": pooled_quiz["quizid"],
+                    "questions": pooled_quiz["questions"],
+                }, 200
+
+            chapter_info = self.db.get_chapter_info(chapter)
+            if not chapter_info:
+                return {"error": "Chapter not found"}, 404
+
+            # Assemble a quiz from stored questions before paying for an LLM call
+            questions = self.db.sample_question_bank(chapter, self.QUESTIONS_PER_LEVEL)
+            if questions:
+                logger.info(f"Assembled quiz for {chapter} from question bank")
+            else:
+                questions = await self._generate_questions(chapter_info)
+
+            quiz_id = self.db.store_quiz_questions(chapter, questions)
+
+            # Return only questions and options (no answers)
+            questions_only = [
+                {
+                    "questionid": i + 1,
+                    "question": q["question"],
+                    "options": q["options"],
+                }
+                for i, q in enumerate(questions)
+            ]
+            return {"quiz_id": quiz_id, "questions": questions_only}, 200
+
+        except BudgetExceededError as e:
+            return {"error": str(e)}, 429
+
+        except Exception as e:
+            logger.error(f"Error getting quiz: {str(e)}")
+            return {"error": "Failed to generate quiz"}, 500
+
+    @traced()
+    async def refill_pool(self, chapter: str) -> None:
+        """Top up the chapter's pool of unserved quizzes in the background."""
+        if chapter in self._refilling:
+            return
+
+        self._refilling.add(chapter)
+        try:
+            missing = self.pool_size - self.db.count_pooled_quizzes(chapter)
+            if missing <= 0:
+                return
+
+            chapter_info = self.db.get_chapter_info(chapter)
+            if not chapter_info:
+                return
+
+            for _ in range(missing):
+                questions = await self._generate_questions(chapter_info)
+                self.db.store_quiz_questions(chapter, questions, pooled=True)
+
+            logger.info(f"Added {missing} quizzes to the pool for {chapter}")
+
+        except BudgetExceededError as e:
+            logger.info(f"Stopped refilling quiz pool for {chapter}: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error refilling quiz pool for {chapter}: {str(e)}")
+        finally:
+            self._refilling.discard(chapter)
+
+    @traced()
+    async def _generate_questions(self, chapter_info: Dict) -> List[Dict]:
+        """Ask Gemini for a new set of questions without blocking the event loop.
+
+        Raises:
+            BudgetExceededError: If the PDF's owner has no budget left today
+        """
+        llm_usage.check_budget(self.db, chapter_info["username"])
+        pdf_path = Path(chapter_info["pdf_path"])
+        gemini_file = await self.note_service.get_valid_gemini_file(
+            chapter_info["pdfid"], pdf_path
+        )
+        with llm_usage.attribute(
+            username=chapter_info["username"],
+            pdfid=chapter_info["pdfid"],
+            chapter=chapter_info["chaptername"],
+        ):
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                in_context(self.note_generator.generate_quiz_questions),
+                gemini_file,
+                chapter_info["chaptername"],
+            )
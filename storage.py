@@ -0,0 +1,221 @@
+import logging
+import os
+import re
+import shutil
+import tarfile
+import threading
+import time
+import uuid
+from pathlib import Path, PurePath
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Per-user limits on everything under uploads/<username>/; 0 disables a limit
+STORAGE_QUOTA_BYTES = int(os.getenv("STORAGE_QUOTA_BYTES", str(2 * 1024**3)))
+STORAGE_QUOTA_FILES = int(os.getenv("STORAGE_QUOTA_FILES", "20000"))
+
+# Image folders untouched for this long are packed into a single archive
+IMAGE_ARCHIVE_AFTER_DAYS = float(os.getenv("IMAGE_ARCHIVE_AFTER_DAYS", "30"))
+
+ARCHIVE_SUFFIX = ".tar.gz"
+
+# How often a folder's last-use time is bumped while it is being read
+TOUCH_INTERVAL_SECONDS = 3600
+
+_touched = LRUCache(maxsize=4096)
+_restore_lock = threading.Lock()
+
+
+class QuotaExceededError(ValueError):
+    """An upload would take a user over their storage quota."""
+
+
+def usage(path: Path) -> Tuple[int, int]:
+    """Bytes and number of files in a file or directory tree.
+
+    Returns:
+        Tuple[int, int]: (bytes, files); (0, 0) if the path does not exist
+    """
+    if path.is_file():
+        return path.stat().st_size, 1
+    total_bytes = total_files = 0
+    if path.is_dir():
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total_bytes += os.stat(os.path.join(root, name)).st_size
+                    total_files += 1
+                except FileNotFoundError:
+                    continue
+    return total_bytes, total_files
+
+
+def check_quota(used: Dict, incoming_bytes: int = 0, incoming_files: int = 0) -> None:
+    """Raise QuotaExceededError if adding to a user's usage would exceed a quota.
+
+    Args:
+        used: ``bytes`` and ``files`` from DatabaseManager.get_storage_usage
+        incoming_bytes: Size of what is about to be written
+        incoming_files: Number of files about to be written
+    """
+    if STORAGE_QUOTA_BYTES and used["bytes"] + incoming_bytes > STORAGE_QUOTA_BYTES:
+        raise QuotaExceededError(
+            f"Storage quota exceeded: {used['bytes'] + incoming_bytes} of "
+            f"{STORAGE_QUOTA_BYTES} bytes"
+        )
+    if STORAGE_QUOTA_FILES and used["files"] + incoming_files > STORAGE_QUOTA_FILES:
+        raise QuotaExceededError(
+            f"Storage quota exceeded: {used['files'] + incoming_files} of "
+            f"{STORAGE_QUOTA_FILES} files"
+        )
+
+
+def remaining(used: Dict) -> Tuple[Optional[int], Optional[int]]:
+    """Bytes and files a user may still write; None where there is no limit."""
+    return (
+        max(STORAGE_QUOTA_BYTES - used["bytes"], 0) if STORAGE_QUOTA_BYTES else None,
+        max(STORAGE_QUOTA_FILES - used["files"], 0) if STORAGE_QUOTA_FILES else None,
+    )
+
+
+def archive_path(folder: Path) -> Path:
+    """Where an archived image folder is kept."""
+    return folder.with_name(folder.name + ARCHIVE_SUFFIX)
+
+
+def archived_folders(username: str, base_folder: str) -> List[Path]:
+    """Image folders of a user's PDF that are currently archived.
+
+    Returns the folder paths (not the archive paths), so they can be passed
+    to restore_folder.
+    """
+    images_dir = Path("uploads") / username / "images"
+    if not images_dir.is_dir():
+        return []
+    pattern = re.compile(
+        rf"{re.escape(base_folder)}_[0-9a-f]{{8}}{re.escape(ARCHIVE_SUFFIX)}"
+    )
+    return sorted(
+        archive.with_name(archive.name[: -len(ARCHIVE_SUFFIX)])
+        for archive in images_dir.iterdir()
+        if archive.is_file() and pattern.fullmatch(archive.name)
+    )
+
+
+def touch(folder: Path) -> None:
+    """Mark an image folder as recently used, so it is not archived.
+
+    Bumps the folder's mtime at most once per TOUCH_INTERVAL_SECONDS.
+    """
+    now = time.time()
+    key = str(folder)
+    last = _touched.get(key)
+    if last is not None and now - last < TOUCH_INTERVAL_SECONDS:
+        return
+    try:
+        os.utime(folder)
+        _touched.set(key, now)
+    except OSError:
+        pass
+
+
+def is_cold(folder: Path, now: Optional[float] = None) -> bool:
+    """Whether an image folder has gone unused for IMAGE_ARCHIVE_AFTER_DAYS."""
+    cutoff = (now or time.time()) - IMAGE_ARCHIVE_AFTER_DAYS * 86400
+    return folder.stat().st_mtime < cutoff
+
+
+def archive_folder(folder: Path) -> int:
+    """Pack an image folder's source images into one archive and remove the folder.
+
+    Renditions are left out; they are regenerated on demand. The main win
+    is thousands of files becoming one, since JPEG and PNG data barely
+    compresses further.
+
+    Returns:
+        int: Size of the archive in bytes
+    """
+    target = archive_path(folder)
+    partial = target.with_name(f".{target.name}.{uuid.uuid4().hex}")
+    with tarfile.open(partial, "w:gz") as tar:
+        for path in sorted(folder.iterdir()):
+            if path.is_file() and not path.name.startswith("."):
+                tar.add(path, arcname=path.name)
+    os.replace(partial, target)
+    shutil.rmtree(folder)
+    logger.info(f"Archived image folder {folder}")
+    return target.stat().st_size
+
+
+def restore_folder(folder: Path) -> bool:
+    """Re-inflate an archived image folder.
+
+    Safe to call concurrently: the archive is unpacked next to the folder
+    and renamed into place, and only one extraction wins.
+
+    Returns:
+        bool: Whether the folder exists afterwards
+    """
+    if folder.is_dir():
+        return True
+    archive = archive_path(folder)
+    with _restore_lock:
+        if folder.is_dir():
+            return True
+        if not archive.is_file():
+            return False
+        partial = folder.with_name(f".{folder.name}.{uuid.uuid4().hex}")
+        try:
+            with tarfile.open(archive, "r:gz") as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(partial, filter="data")
+                else:
+                    tar.extractall(partial)
+            os.rename(partial, folder)
+        except OSError:
+            # Another worker process restored it first
+            shutil.rmtree(partial, ignore_errors=True)
+            if not folder.is_dir():
+                raise
+        archive.unlink(missing_ok=True)
+    logger.info(f"Restored archived image folder {folder}")
+    return True
+
+
+def use_folder(folder: Path) -> bool:
+    """Restore an image folder if it was archived, and mark it as in use.
+
+    Returns:
+        bool: Whether the folder exists
+    """
+    if not restore_folder(folder):
+        return False
+    touch(folder)
+    return True
+
+
+class ArchivedImagesStaticFiles(StaticFiles):
+    """StaticFiles over uploads/ that re-inflates archived image folders on demand.
+
+    Paths look like <username>/images/<folder>/<filename>. Every hit marks
+    its folder as in use.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        parts = PurePath(path).parts
+        if (
+            len(parts) == 4
+            and parts[1] == "images"
+            and not any(part.startswith(".") for part in parts)
+        ):
+            folder = Path(self.directory) / parts[0] / "images" / parts[2]
+            await run_in_threadpool(use_folder, folder)
+        return await super().get_response(path, scope)
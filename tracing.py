@@ -0,0 +1,278 @@
+"""Span-based request tracing with OpenTelemetry.
+
+Off unless TRACE_EXPORTER is set:
+
+- ``otlp`` sends spans over OTLP/HTTP to OTEL_EXPORTER_OTLP_ENDPOINT
+  (default http://localhost:4318), e.g. a local collector or Jaeger
+- ``file`` appends one JSON span per line to TRACE_FILE (default
+  ``traces/{pid}.jsonl``; ``{pid}`` keeps gunicorn workers apart)
+
+TRACE_SAMPLE_RATIO (default 1.0) is the share of new traces recorded;
+requests arriving with a sampled ``traceparent`` are always recorded. When
+tracing is off, or the opentelemetry packages are missing, every helper here
+is a no-op.
+"""
+
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import re
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from metrics import route_name
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+except ImportError:  # tracing is optional
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "").lower()
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces/{pid}.jsonl")
+
+# Literals that could carry user data, replaced in recorded SQL
+_SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+# psycopg2 placeholders, %s and %(name)s
+_SQL_PLACEHOLDER = re.compile(r"%(?:\(\w+\))?s")
+# IN lists and multi-row VALUES, whose length varies between calls
+_SQL_VALUES = re.compile(
+    r"\b(IN|VALUES) ?\(\?(?:, ?\?)*\)(?:, ?\(\?(?:, ?\?)*\))*", re.IGNORECASE
+)
+_WHITESPACE = re.compile(r"\s+")
+# Bulk inserts expand to very long statements; the start identifies them
+MAX_STATEMENT_LENGTH = 2000
+
+_enabled = False
+
+
+def setup_tracing(service_name: str = "textbookai") -> bool:
+    """Install the tracer provider and exporter chosen by TRACE_EXPORTER.
+
+    Call once per process, after any fork.
+
+    Returns:
+        bool: Whether tracing is on
+    """
+    global _enabled
+    if trace is None or TRACE_EXPORTER in ("", "none") or _enabled:
+        return _enabled
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    if TRACE_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        exporter = OTLPSpanExporter()
+    elif TRACE_EXPORTER == "file":
+        path = Path(TRACE_FILE.format(pid=os.getpid()))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        exporter = ConsoleSpanExporter(
+            out=open(path, "a", buffering=1),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+    else:
+        logger.error(f"Unknown TRACE_EXPORTER {TRACE_EXPORTER!r}; tracing is off")
+        return False
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        sampler=ParentBased(TraceIdRatioBased(TRACE_SAMPLE_RATIO)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    _enabled = True
+    logger.info(f"Tracing to {TRACE_EXPORTER}, sampling {TRACE_SAMPLE_RATIO:.0%}")
+    return True
+
+
+def shutdown_tracing() -> None:
+    """Flush spans still buffered for export."""
+    if _enabled:
+        trace.get_tracer_provider().shutdown()
+
+
+def is_recording() -> bool:
+    """Whether the current span is sampled, so extra detail is worth collecting."""
+    return _enabled and trace.get_current_span().is_recording()
+
+
+def current_ids() -> Optional[Tuple[str, str]]:
+    """Hex trace and span ids of the current span, if one is being recorded."""
+    if not is_recording():
+        return None
+    context = trace.get_current_span().get_span_context()
+    return format(context.trace_id, "032x"), format(context.span_id, "016x")
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Any]]:
+    """Record the block as a child of the current span.
+
+    Exceptions are recorded on the span and re-raised. Yields the span (None
+    when tracing is off) so callers can add attributes found along the way.
+    """
+    if not _enabled:
+        yield None
+        return
+    tracer = trace.get_tracer(__name__)
+    with tracer.start_as_current_span(
+        name, attributes={k: v for k, v in attributes.items() if v is not None}
+    ) as current:
+        yield current
+
+
+def set_attributes(current: Optional[Any], **attributes: Any) -> None:
+    """Add attributes to a span from span(), ignoring None span and values."""
+    if current is not None:
+        for key, value in attributes.items():
+            if value is not None:
+                current.set_attribute(key, value)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator recording each call of a function, sync or async, as a span."""
+
+    def decorate(function: Callable) -> Callable:
+        span_name = name or function.__qualname__
+
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def run_async(*args, **kwargs):
+                with span(span_name):
+                    return await function(*args, **kwargs)
+
+            return run_async
+
+        @functools.wraps(function)
+        def run(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+
+        return run
+
+    return decorate
+
+
+def in_context(function: Callable) -> Callable:
+    """Bind a callable to the current context before handing it to an executor.
+
+    loop.run_in_executor does not carry contextvars into the worker thread,
+    so spans started there would otherwise begin new traces.
+    """
+    return functools.partial(contextvars.copy_context().run, function)
+
+
+def sanitize_sql(query: Any) -> str:
+    """A query with literals and placeholders replaced by ?, on one line.
+
+    IN lists and VALUES rows collapse to (...), so statements that differ
+    only in their parameters, or in how many rows they insert, read the same.
+    """
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    query = _SQL_STRING.sub("?", str(query))
+    query = _SQL_NUMBER.sub("?", query)
+    query = _SQL_PLACEHOLDER.sub("?", query)
+    query = _WHITESPACE.sub(" ", query).strip()
+    query = _SQL_VALUES.sub(r"\1 (...)", query)
+    return query[:MAX_STATEMENT_LENGTH]
+
+
+class TracingMiddleware:
+    """Start a server span per HTTP request, continuing an incoming traceparent."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not _enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope.get("headers", [])
+        }
+        tracer = trace.get_tracer(__name__)
+        with tracer.start_as_current_span(
+            f"{scope['method']} {scope['path']}",
+            context=propagate.extract(headers),
+            kind=SpanKind.SERVER,
+            attributes={
+                "http.request.method": scope["method"],
+                "url.path": scope["path"],
+            },
+        ) as current:
+
+            async def send_with_status(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    current.set_attribute(
+                        "http.response.status_code", message["status"]
+                    )
+                    if message["status"] >= 500:
+                        current.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # Known once routing has run; keeps span names low-cardinality
+                route = route_name(scope)
+                current.update_name(f"{scope['method']} {route}")
+                current.set_attribute("http.route", route)
+
+
+class TracedCursor:
+    """DB-API cursor wrapper recording each execute as a span with sanitized SQL."""
+
+    def __init__(self, cursor: Any):
+        self._cursor = cursor
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self) -> "TracedCursor":
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc_info) -> Any:
+        return self._cursor.__exit__(*exc_info)
+
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        with span("db.query", **{"db.system": "postgresql"}) as current:
+            set_attributes(current, **{"db.statement": sanitize_sql(query)})
+            result = self._cursor.execute(query, vars)
+            set_attributes(current, **{"db.rows": self._cursor.rowcount})
+            return result
+
+
+class TracedConnection:
+    """DB-API connection wrapper whose cursors are TracedCursors."""
+
+    def __init__(self, connection: Any):
+        self._connection = connection
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs) -> TracedCursor:
+        return TracedCursor(self._connection.cursor(*args, **kwargs))